@@ -0,0 +1,105 @@
+"""Measures how pymanager copes with thousands of sleeping processes.
+
+Starts pymanager with the given number of sleep processes and reports the
+launch time, the resident memory of the manager per managed process, the
+latency of GET / and GET /status, and the shutdown time. Memory is sampled
+again after every query round, it should stay flat while nothing changes.
+
+    python benchmarks/scale.py --processes 5000
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def rss(pid):
+	with open("/proc/{0}/status".format(pid)) as f:
+		for line in f:
+			if line.startswith("VmRSS:"):
+				return int(line.split()[1]) * 1024
+	return 0
+
+def request(port, path, method="GET"):
+	req = urllib.request.Request("http://localhost:{0}{1}".format(port, path), method=method)
+	with urllib.request.urlopen(req, timeout=60) as response:
+		return response.read()
+
+def timed(port, path):
+	started = time.time()
+	request(port, path)
+	return time.time() - started
+
+def wait_running(port, timeout):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		try:
+			if json.loads(request(port, "/status").decode())["status"] == "running":
+				return True
+		except (OSError, ValueError):
+			pass
+		time.sleep(0.1)
+	return False
+
+def percentile(values, fraction):
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+	parser = OptionParser()
+	parser.add_option("-n", "--processes", dest="processes", type="int", default=5000, help="Number of sleeping processes to manage.")
+	parser.add_option("-p", "--port", dest="port", type="int", default=5099, help="HTTP port of the manager.")
+	parser.add_option("-q", "--queries", dest="queries", type="int", default=20, help="Queries per round.")
+	parser.add_option("-r", "--rounds", dest="rounds", type="int", default=3, help="Query rounds.")
+	(opts, args) = parser.parse_args()
+
+	config = {
+		"http": {"enabled": True, "port": opts.port},
+		"graceful_time": 10,
+		"processes": {
+			"sleeper": {"executable": "sleep", "arguments": ["3600"], "replicas": opts.processes},
+		},
+	}
+	workdir = tempfile.mkdtemp()
+	path = os.path.join(workdir, "pymanager.json")
+	with open(path, "w") as f:
+		json.dump(config, f)
+
+	started = time.time()
+	manager = subprocess.Popen([sys.executable, os.path.join(ROOT, "pymanager.py"), "-f", path], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+	try:
+		if not wait_running(opts.port, max(60, opts.processes / 10)):
+			print("The manager did not finish launching.")
+			return 1
+		print("Launched {0} processes in {1:.2f}s.".format(opts.processes, time.time() - started))
+		baseline = rss(manager.pid)
+		print("Manager RSS: {0:.1f} MiB, {1:.1f} KiB per process.".format(baseline / 1048576, baseline / 1024 / opts.processes))
+		rendering = time.time()
+		count = json.loads(request(opts.port, "/").decode())["count"]
+		print("GET / rendered {0} processes in {1:.3f}s.".format(count, time.time() - rendering))
+
+		for round in range(opts.rounds):
+			full = [timed(opts.port, "/") for _ in range(opts.queries)]
+			status = [timed(opts.port, "/status") for _ in range(opts.queries)]
+			print("Round {0}: GET / p50 {1:.3f}s max {2:.3f}s, GET /status p50 {3:.3f}s max {4:.3f}s, RSS {5:.1f} MiB.".format(
+				round + 1, percentile(full, 0.5), max(full), percentile(status, 0.5), max(status), rss(manager.pid) / 1048576))
+
+		stopping = time.time()
+		request(opts.port, "/", "DELETE")
+		manager.wait(60)
+		print("Shut down in {0:.2f}s.".format(time.time() - stopping))
+	finally:
+		if manager.poll() is None:
+			manager.terminate()
+			manager.wait()
+		os.remove(path)
+		os.rmdir(workdir)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -2,34 +2,58 @@ from pymutils.process import Process
 import pymutils.verifier as verifier
 from optparse import OptionParser
 import pymutils.http_service as http_service
+import pymutils.supervisor as supervisor
 from pymutils.debug import verbose, debug, log
 import collections
+from concurrent.futures import Future
+import functools
 import os
 import json
 import inspect
 import signal
 import sys
+import threading
 import time
 from pymutils.global_storage import Globals
+from pymutils.launcher import Launcher
+from pymutils.shutdown import shutdown_all, stop_processes
+from pymutils.log_sink import open_sink, close_sinks
+from pymutils.events import set_status
+from pymutils.metrics import ResourceSampler
+from pymutils.replicas import expand_processes
+from pymutils.restart_policy import RestartPolicy, Restarter
+from pymutils.cgroup import CgroupTree
+from pymutils.limits import fd_budget, ensure_fd_budget
+from pymutils.zygote import Zygote
+from pymutils.jobs import jobs
+from pymutils.state import StateFile, definition_hash, stop_stale
+from pymutils.sockets import SocketSpec, socket_addresses
+from pymutils.socket_verifier import SocketVerifier
+from pymutils.control import ControlServer, ctl_main
+from pymutils.federation import federation_main
+from pymutils.liveness import LivenessCheck
 
 version = "0.2.6.1"
 __version__ = version
 
-def parse(filename):
+def parse(filename, fatal=True):
+	"""Loads the configuration file. Errors exit the manager, or raise ValueError when not fatal, as on reload."""
+	def fail(message, code):
+		if not fatal:
+			raise ValueError(message)
+		print(message)
+		exit(code)
 	try:
 		with open(filename, 'r') as f:
 			config_data = f.read()
 	except FileNotFoundError:
-		print("Cannot find file {0}.".format(filename))
-		exit(1)
+		fail("Cannot find file {0}.".format(filename), 1)
 	except Exception as e:
-		print("Error while loading file {0}: {1}.".format(filename, e))
-		exit(2)
+		fail("Error while loading file {0}: {1}.".format(filename, e), 2)
 	try:
 		jdata = json.JSONDecoder(object_pairs_hook=collections.OrderedDict).decode(config_data)
 	except ValueError:
-		print("{0} is not a valid JSON file.".format(filename))
-		exit(3)
+		fail("{0} is not a valid JSON file.".format(filename), 3)
 
 	return jdata
 
@@ -37,6 +61,44 @@ def clean_outfile():
 	if Globals.outfile is not sys.stdout and Globals.outfile is not None:
 		Globals.outfile.close()
 		Globals.outfile = None
+	close_sinks()
+
+def clean_zygote():
+	if Globals.zygote is not None:
+		Globals.zygote.close()
+		Globals.zygote = None
+
+def clean_cgroups():
+	if Globals.cgroups is not None:
+		Globals.cgroups.close()
+		Globals.cgroups = None
+
+def detach(signum, frame):
+	"""Exits without stopping the processes, leaving them to be adopted by the next manager."""
+	if Globals.shutdown or Globals.state_file is None:
+		return
+	print("Detaching from the running processes...")
+	for proc in Process.processes:
+		if proc.proc is not None and proc.poll() is None and (proc.proc.stdin is not None or proc.proc.stdout is not None):
+			log("[WARNING] process {0} cannot be adopted, as its input or output is piped to the manager (stdin, suppress_output, or redirect_output with a rotated log or a captured output); the next manager will launch it again.".format(proc.name))
+	Globals.state_file.stop()
+	Globals.state_file.write()
+	Globals.detached = True
+	Globals.shutdown = True
+	Globals.may_terminate = True
+	set_status("detached")
+	supervisor.notify()
+
+def clean_control():
+	if Globals.control is not None:
+		Globals.control.close()
+		Globals.control = None
+
+def clean_sockets():
+	# Detached processes keep using the sockets, Unix socket paths are left in place for them.
+	if Globals.listen_sockets is not None and not Globals.detached:
+		Globals.listen_sockets.close()
+		Globals.listen_sockets = None
 
 def graceful_shutdown(signum, frame):
 	if Globals.in_force_quit:
@@ -44,25 +106,23 @@ def graceful_shutdown(signum, frame):
 	if Globals.shutdown:
 		if signum == signal.SIGINT:
 			Globals.in_force_quit = True
-			Globals.status = "force shutdown"
+			set_status("force shutdown")
 			for proc in Process.processes:
 				if proc.poll() is None:
 					proc.kill()
 			Globals.may_terminate = True
+			supervisor.notify()
 			clean_outfile()
 		return
 	print("Shutting down gracefully (SIGINT again to terminate immediately)...")
 	Globals.shutdown = True
-	Globals.status = "shutdown"
-	for proc in Process.processes:
-		if Globals.in_force_quit:
-			return
-		try:
-			if proc.poll() is None:
-				proc.force_terminate(Globals.terminate_time_allowed)
-		except Exception:
-			pass
+	set_status("shutdown")
+	supervisor.notify()
+	shutdown_all()
+	if Globals.in_force_quit:
+		return
 	Globals.may_terminate = True
+	supervisor.notify()
 	clean_outfile()
 	
 def spawnDaemon(func, conf):
@@ -89,6 +149,10 @@ def spawnDaemon(func, conf):
     os._exit(os.EX_OK)
 
 def main():
+	if sys.argv[1:2] == ["ctl"]:
+		return ctl_main(sys.argv[2:])
+	if sys.argv[1:2] == ["federation"]:
+		return federation_main(sys.argv[2:])
 	parser = OptionParser()
 	parser.add_option("-V", "--version", dest="version", default=False, action="store_true", help="Display version and exit.")
 	parser.add_option("-v", "--verbose", dest="verbose", default=False, action="store_true", help="Display process launch and verification step-by-step.")
@@ -103,6 +167,7 @@ def main():
 		exit(0)
 
 	config = parse(opts.filename)
+	Globals.config_file = os.path.abspath(opts.filename)
 	if opts.debug:
 		config["verbose"] = 2
 	elif opts.verbose:
@@ -118,13 +183,187 @@ def main():
 	else:
 		return spawn_and_monitor(config)
 
+def load_modules(config, verifiers):
+	"""Imports the modules of the configuration, adding their verifiers to verifiers."""
+	if "modules" in config:
+		for module, definition in config["modules"].items():
+			debug("Loading module {0}".format(module))
+			if "verifiers" not in definition:
+				log("[WARNING] module {0} does not contain a list of verifiers to load.".format(module))
+			else:
+				try:
+					mod = __import__(module)
+					for v in definition["verifiers"]:
+						try:
+							a = getattr(mod, v)
+							if inspect.isclass(a):
+								if issubclass(a, verifier.Verifier):
+									debug("Loading verifier {0}".format(v))
+									verifiers["{0}.{1}".format(module, v)] = getattr(mod, v)
+								else:
+									log("[WARNING] object '{0}' from module {1} is not a subclass of Verifier".format(v, module))
+							else:
+								log("[WARNING] object '{0}' from module {1} is not a class".format(v, module))
+						except AttributeError:
+							log("[WARNING] missing verifier '{0}' from module {1}".format(v, module))
+				except ImportError:
+					log("[WARNING] module {0} not found.".format(module))
+
+def make_verifier(key, vdef, verifiers):
+	if "type" not in vdef:
+		raise KeyError("Missing verifier type for verifier of process {0}.".format(key))
+	if vdef["type"] not in verifiers:
+		raise ValueError("Missing verifier {0} used in process {1}".format(vdef["type"], key))
+	args = {}
+	if "arguments" in vdef:
+		args = vdef["arguments"]
+	debug("Setting up verifier {0} for process {1}.".format(vdef["type"], key))
+	return verifiers[vdef["type"]](**args)
+
+def prepare_process(key, procdef, verifiers, adopt=None):
+	if "executable" not in procdef or "arguments" not in procdef:
+		raise KeyError("Missing executable or arguments in definition for process {0}.".format(key))
+	cmdargs = [procdef["executable"]]
+	cmdargs += procdef["arguments"]
+	vfy = None
+	if "verifier" in procdef:
+		vfy = make_verifier(key, procdef["verifier"], verifiers)
+	liveness = None
+	if "liveness" in procdef:
+		lconf = dict(procdef["liveness"])
+		lvfy = make_verifier(key, lconf, verifiers)
+		lconf.pop("type")
+		lconf.pop("arguments", None)
+		liveness = LivenessCheck(None, lvfy, **lconf)
+	options = {}
+	if "options" in procdef:
+		options = dict(procdef["options"])
+	if liveness is not None and liveness.verifier.needs_output:
+		options["capture_output"] = True
+	for check in (vfy, liveness.verifier if liveness is not None else None):
+		if isinstance(check, SocketVerifier):
+			for declaration in options.get("sockets", []):
+				if check.targets(SocketSpec(declaration)):
+					log("[WARNING] the socket verifier of process {0} connects to {1}, which the manager keeps listening, so it passes before the process accepts connections. Use an HTTP or output verifier.".format(key, check.describe()))
+	if "limits" in procdef:
+		options["limits"] = procdef["limits"]
+	if "scheduling" in procdef:
+		options["scheduling"] = procdef["scheduling"]
+	policy = None
+	if "restart" in procdef:
+		pconf = procdef["restart"]
+		if not isinstance(pconf, dict):
+			pconf = {"policy": pconf}
+		policy = RestartPolicy(**pconf)
+	return functools.partial(launch_process, key, procdef, cmdargs, vfy, options, policy, liveness, adopt)
+
+def launch_process(key, procdef, cmdargs, vfy, options, policy, liveness=None, adopt=None):
+	if adopt is not None:
+		verbose("Adopting process key '{0}' with pid {1}.".format(key, adopt["pid"]))
+	else:
+		verbose("Launching process key '{0}'.".format(key))
+	proc = Process(cmdargs, vfy, key, adopt, False, **options)
+	if "depends_on" in procdef:
+		proc.depends_on = procdef["depends_on"]
+	if "groups" in procdef:
+		proc.groups = procdef["groups"]
+	proc.restart_policy = policy
+	proc.definition = procdef
+	Process.add_process(proc)
+	# Adopted processes were verified by the manager which launched them.
+	verification = proc.verify() if adopt is None else None
+	ready = Future()
+	def verified(future):
+		if future is not None and future.exception() is not None:
+			ready.set_exception(future.exception())
+			return
+		if liveness is not None:
+			liveness.proc = proc
+			proc.liveness = liveness
+			liveness.start()
+		verbose("Process {0} creation finished.".format(key))
+		ready.set_result(proc)
+	if verification is None:
+		verified(None)
+	else:
+		verification.add_done_callback(verified)
+	return ready
+
+reload_lock = threading.Lock()
+
+def diff_definitions(running, procdefs):
+	"""Returns the names added, removed and changed in procdefs compared to the running definitions, in order."""
+	added = [name for name in procdefs if name not in running]
+	removed = [name for name in running if name not in procdefs]
+	changed = [name for name in procdefs if name in running and running[name] != procdefs[name]]
+	return added, removed, changed
+
+def reload_config(job):
+	"""Applies the changes of the process definitions in the configuration file to the running processes.
+
+	Processes are matched by name: new definitions are launched, processes whose
+	definition was removed are stopped, and processes whose definition changed are
+	stopped and launched again. Unchanged processes are left alone.
+	"""
+	with reload_lock:
+		started = time.time()
+		config = parse(Globals.config_file, False)
+		if "processes" not in config:
+			raise ValueError("No processes listed in the configuration file.")
+		load_modules(config, Globals.verifiers)
+		procdefs = expand_processes(config["processes"])
+		running = collections.OrderedDict((proc.name, proc) for proc in Process.processes if proc.name is not None)
+		added, removed, changed = diff_definitions(collections.OrderedDict((name, proc.definition) for name, proc in running.items()), procdefs)
+		launcher = Launcher(config.get("launch_concurrency"), [name for name in running if name not in removed and name not in changed])
+		for name in added + changed:
+			launcher.add(name, prepare_process(name, procdefs[name], Globals.verifiers), procdefs[name].get("depends_on", []))
+		launcher.order()
+		ensure_fd_budget(fd_budget(procdefs.values()))
+		job.step("diff", started, added=added, removed=removed, changed=changed)
+		verbose("Reloading: {0} added, {1} removed, {2} changed.".format(len(added), len(removed), len(changed)))
+
+		Globals.reloading = True
+		try:
+			started = time.time()
+			stopping = [running[name] for name in removed + changed]
+			for proc in stopping:
+				proc.stopped = True
+			stop_processes(stopping, Globals.terminate_time_allowed)
+			for proc in stopping:
+				Process.processes.remove(proc)
+			if Globals.listen_sockets is not None:
+				Globals.listen_sockets.retain(socket_addresses(procdefs.values()))
+			job.step("stop", started, processes=len(stopping))
+
+			started = time.time()
+			launcher.run()
+			job.step("launch", started, processes=len(added) + len(changed))
+		finally:
+			Globals.reloading = False
+			supervisor.notify()
+		return {"added": added, "removed": removed, "changed": changed, "unchanged": len(running) - len(removed) - len(changed)}
+
+def reload_signal(signum, frame):
+	if Globals.shutdown:
+		return
+	if Globals.reloader is None:
+		log("[WARNING] ignoring SIGHUP, the processes are still being launched.")
+		return
+	jobs.submit("reload", reload_config)
+
+def restarting():
+	"""Returns whether a process is being restarted, its previous incarnation gone and the next one not yet watched."""
+	return any(proc.restart_lock.locked() for proc in Process.processes)
+
 def spawn_and_monitor(config):
 	verifiers = {}
 
 	if "verbose" in config:
 		Globals.verbose = config["verbose"]
+	if "logging" in config:
+		Globals.log_options = config["logging"]
 	if "logfile" in config:
-		Globals.outfile = open(config["logfile"], "wb", 0)
+		Globals.outfile = open_sink(config["logfile"])
 	else:
 		Globals.outfile = sys.stdout
 
@@ -138,40 +377,25 @@ def spawn_and_monitor(config):
 			if "port" in hconf:
 				debug("Port is present in configuration.")
 				port = hconf["port"]
-			http_service.fork_http_service(port)
+			server = "threaded"
+			if "server" in hconf:
+				server = hconf["server"]
+			http_service.fork_http_service(port, server, "debug" in hconf and hconf["debug"])
 			verbose("HTTP service listening on port :{0}".format(port))
 		else:
 			debug("HTTP is disabled.")
 
+	if "output_buffer_size" in config:
+		Globals.output_buffer_size = int(config["output_buffer_size"])
+
 	if "default_shell" in config:
 		debug("Default shell is present, value: {0}".format(config["default_shell"]))
 		Globals.default_shell = config["default_shell"]
 
 	verbose("Parsing modules list.")
-	Globals.status = "parsing modules"
-	if "modules" in config:
-		for module, definition in config["modules"].items():
-			debug("Loading module {0}".format(module))
-			if "verifiers" not in definition:
-				log("[WARNING] module {0} does not contain a list of verifiers to load.".format(module))
-			else:
-				try:
-					mod = __import__(module)
-					for v in definition["verifiers"]:
-						try:
-							a = getattr(mod, v)
-							if inspect.isclass(a):
-								if issubclass(a, verifier.Verifier):
-									debug("Loading verifier {0}".format(v))
-									verifiers["{0}.{1}".format(module, v)] = getattr(mod, v)
-								else:
-									log("[WARNING] object '{0}' from module {1} is not a subclass of Verifier".format(v, module))
-							else:
-								log("[WARNING] object '{0}' from module {1} is not a class".format(v, module))
-						except AttributeError:
-							log("[WARNING] missing verifier '{0}' from module {1}".format(v, module))
-				except ImportError:
-					log("[WARNING] module {0} not found.".format(module))
+	set_status("parsing modules")
+	load_modules(config, verifiers)
+	Globals.verifiers = verifiers
 
 	verbose("Modules are loaded, parsing processes.")
 	if not "processes" in config:
@@ -179,52 +403,89 @@ def spawn_and_monitor(config):
 		clean_outfile()
 		return 4
 
+	if "metrics" in config and config["metrics"].get("enabled", False):
+		mconf = config["metrics"]
+		Globals.sampler = ResourceSampler(mconf.get("interval", 5), mconf.get("window", 12), mconf.get("descendants", False))
+		Globals.sampler.start()
+		debug("Resource sampling is enabled.")
+
+	if config.get("cgroups", False):
+		Globals.cgroups = CgroupTree.create()
+		if Globals.cgroups is None:
+			log("[WARNING] cgroups are enabled, but no writable cgroup v2 hierarchy was found. Using process groups only.")
+
+	if "zygote" in config:
+		zconf = config["zygote"]
+		try:
+			Globals.zygote = Zygote(zconf.get("preload", []), zconf.get("python")).start()
+			debug("Zygote started in {0:.3f}s.".format(Globals.zygote.boot_seconds))
+		except Exception as e:
+			log("[WARNING] could not start the zygote, launching Python processes normally: {0}".format(e))
+			Globals.zygote = None
+
+	Globals.supervisor = supervisor.Supervisor()
 	signal.signal(signal.SIGINT, graceful_shutdown)
 	signal.signal(signal.SIGTERM, graceful_shutdown)
 	signal.signal(signal.SIGQUIT, graceful_shutdown)
+	signal.signal(signal.SIGHUP, reload_signal)
+	signal.signal(signal.SIGUSR2, detach)
+
+	if "control_socket" in config:
+		try:
+			Globals.control = ControlServer(config["control_socket"]).start()
+			verbose("Control socket listening on {0}.".format(Globals.control.path))
+		except OSError as e:
+			log("[WARNING] could not open the control socket {0}: {1}".format(config["control_socket"], e))
 
 	verbose("Processes parsed, launching.")
-	Globals.status = "launching processes"
+	set_status("launching processes")
 	if "messages" in config:
 		Globals.messages = config["messages"]
 
 	try:
-		for key, procdef in config["processes"].items():
-			verbose("Launching process key '{0}'.".format(key))
-			if "executable" not in procdef or "arguments" not in procdef:
-				raise KeyError("Missing executable or arguments in definition for process {0}.".format(key))
-			cmdargs = [procdef["executable"]]
-			cmdargs += procdef["arguments"]
-			vfy = None
-			if "verifier" in procdef:
-				if "type" not in procdef["verifier"]:
-					raise KeyError("Missing verifier type for verifier of process {0}.".format(key))
-				if procdef["verifier"]["type"] not in verifiers:
-					raise ValueError("Missing verifier {0} used in process {1}".format(procdef["verifier"]["type"], key))
-				args = {}
-				if "arguments" in procdef["verifier"]:
-					args = procdef["verifier"]["arguments"]
-				debug("Setting up verifier {0} for process.".format(procdef["verifier"]["type"]))
-				vfy = verifiers[procdef["verifier"]["type"]](**args)
-			options = {}
-			if "options" in procdef:
-				options = procdef["options"]
-			verbose("Creating process.")
-			proc = Process(cmdargs, vfy, **options)
-			Process.add_process(proc)
-			verbose("Process creation finished.")
+		procdefs = expand_processes(config["processes"])
+		ensure_fd_budget(fd_budget(procdefs.values()))
+		adoptable = {}
+		if "state_file" in config:
+			Globals.state_file = StateFile(config["state_file"])
+			adoptable = Globals.state_file.load()
+			stale = []
+			for name, entry in list(adoptable.items()):
+				procdef = procdefs.get(name)
+				# Processes piped to the previous manager lost their output, they are started again, as are
+				# processes with sockets, which the new manager binds again.
+				if procdef is None or entry["piped"] or procdef.get("options", {}).get("sockets") or entry["definition"] != definition_hash(procdef):
+					stale.append(adoptable.pop(name))
+			if stale:
+				stop_stale(stale, Globals.terminate_time_allowed)
+		launcher = Launcher(config.get("launch_concurrency"))
+		for key, procdef in procdefs.items():
+			depends_on = []
+			if "depends_on" in procdef:
+				depends_on = procdef["depends_on"]
+			launcher.add(key, prepare_process(key, procdef, verifiers, adoptable.get(key)), depends_on)
+		launcher.run()
+		if Globals.state_file is not None:
+			Globals.state_file.write()
+			Globals.state_file.start()
+		# Reloading diffs against the running processes, so it waits until all of them were launched.
+		Globals.reloader = reload_config
 	except Exception as e:
 		etype, _, _ = sys.exc_info()
 		log("[ERROR] could not set up processes: {0}: {1}".format(etype.__name__, e))
-		Globals.status = "shutdown"
+		set_status("shutdown")
 		#traceback.print_exc()
 		for proc in Process.processes:
 			try:
 				proc.kill()
 			except Exception:
 				pass
-			clean_outfile()
-			return 5
+		clean_control()
+		clean_zygote()
+		clean_sockets()
+		clean_cgroups()
+		clean_outfile()
+		return 5
 
 	verbose("Finished setting up processes.")
 	if "keep_alive" in config:
@@ -241,23 +502,34 @@ def spawn_and_monitor(config):
 			log("[WARNING] invalid graceful_time '{0}', must be a positive number.".format(t))
 
 	
-	Globals.status = "running"
-	runningProcesses = len(Process.processes)
-	while (runningProcesses or Globals.keep_alive) and not Globals.shutdown:
-		runningProcesses = 0
-		for proc in Process.processes:
-			result = proc.poll()
-			if result is None:
-				runningProcesses += 1
-		time.sleep(5)
-		if not Globals.keep_alive and not runningProcesses:
-			Globals.may_terminate = True
+	if "shutdown_order" in config:
+		if config["shutdown_order"] == "dependencies":
+			Globals.shutdown_waves = True
+		elif config["shutdown_order"] != "parallel":
+			log("[WARNING] invalid shutdown_order '{0}', must be 'parallel' or 'dependencies'.".format(config["shutdown_order"]))
+
+	set_status("running")
+	restarter = Restarter()
+	while (Globals.supervisor.running() or restarter.pending() or Globals.keep_alive or Globals.reloading or restarting()) and not Globals.shutdown:
+		for proc in Globals.supervisor.wait(restarter.next_timeout()):
+			restarter.process_exited(proc)
+		restarter.run_due()
+	if not Globals.shutdown:
+		Globals.may_terminate = True
 
 	verbose("Entering shutdown phase.")
-	Globals.status = "shutdown"
+	set_status("shutdown")
 	while not Globals.may_terminate:
-		time.sleep(5)
+		Globals.supervisor.wait()
 
+	if Globals.state_file is not None and not Globals.detached:
+		Globals.state_file.stop()
+		Globals.state_file.remove()
+	http_service.wait_for_answers(1)
+	clean_control()
+	clean_zygote()
+	clean_sockets()
+	clean_cgroups()
 	clean_outfile()
 	return 0
 
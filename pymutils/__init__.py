@@ -1,5 +1,8 @@
 from .exited_verifier import ExitedVerifier
+from .file_verifier import FileExistsVerifier
 from .http_verifier import HttpOkVerifier
+from .output_verifier import OutputMatchVerifier
+from .socket_verifier import SocketVerifier, TcpConnectVerifier, UnixSocketVerifier
 from .verifier import Verifier
 
-__all__ = ["exited_verifier", "http_verifier", "verifier"]
\ No newline at end of file
+__all__ = ["exited_verifier", "file_verifier", "http_verifier", "output_verifier", "socket_verifier", "verifier"]
\ No newline at end of file
@@ -0,0 +1,148 @@
+import asyncio
+import ssl
+from urllib.parse import urlsplit
+
+class HttpError(Exception):
+	def __init__(self, message):
+		self.message = message
+
+	def __str__(self):
+		return self.message
+
+class Response:
+	def __init__(self, status, headers, body):
+		self.status_code = status
+		self.headers = headers
+		self.body = body
+
+	def text(self):
+		return self.body.decode("utf-8", "replace")
+
+class ConnectionPool:
+	"""A minimal asyncio HTTP/1.1 client keeping connections alive between requests.
+
+	Idle connections are kept per scheme, host and port, so repeated requests to
+	the same endpoint - such as readiness checks - reuse a single TCP connection.
+	A pool must only be used from the event loop it was first used on.
+	"""
+
+	def __init__(self, max_idle_per_host=8):
+		self.max_idle_per_host = max_idle_per_host
+		self.idle = {}
+		self.ssl_context = None
+
+	async def _connect(self, key):
+		scheme, host, port = key
+		context = None
+		if scheme == "https":
+			if self.ssl_context is None:
+				self.ssl_context = ssl.create_default_context()
+			context = self.ssl_context
+		return await asyncio.open_connection(host, port, ssl=context)
+
+	def _release(self, key, conn):
+		idle = self.idle.setdefault(key, [])
+		if len(idle) < self.max_idle_per_host:
+			idle.append(conn)
+		else:
+			conn[1].close()
+
+	def _acquire(self, key):
+		idle = self.idle.get(key)
+		while idle:
+			conn = idle.pop()
+			if not conn[1].is_closing() and not conn[0].at_eof():
+				return conn
+			conn[1].close()
+		return None
+
+	async def request(self, method, url, headers=None, body=None, timeout=None):
+		return await asyncio.wait_for(self._request(method, url, headers or {}, body), timeout)
+
+	async def get(self, url, headers=None, timeout=None):
+		return await self.request("GET", url, headers, None, timeout)
+
+	async def _request(self, method, url, headers, body):
+		parts = urlsplit(url)
+		if parts.scheme not in ("http", "https"):
+			raise HttpError("Unsupported URL scheme in {0}.".format(url))
+		port = parts.port or (443 if parts.scheme == "https" else 80)
+		key = (parts.scheme, parts.hostname, port)
+		path = parts.path or "/"
+		if parts.query:
+			path += "?" + parts.query
+		if isinstance(body, str):
+			body = body.encode("utf-8")
+		lines = ["{0} {1} HTTP/1.1".format(method, path), "Host: {0}".format(parts.netloc)]
+		for name, value in headers.items():
+			lines.append("{0}: {1}".format(name, value))
+		if body is not None or method in ("POST", "PUT", "PATCH", "DELETE"):
+			lines.append("Content-Length: {0}".format(len(body or b"")))
+		payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+		conn = self._acquire(key)
+		if conn is not None:
+			try:
+				return await self._exchange(key, conn, method, payload)
+			except (ConnectionError, asyncio.IncompleteReadError):
+				# The server closed the idle connection, retry once on a fresh one.
+				conn[1].close()
+			except BaseException:
+				conn[1].close()
+				raise
+		conn = await self._connect(key)
+		try:
+			return await self._exchange(key, conn, method, payload)
+		except BaseException:
+			conn[1].close()
+			raise
+
+	async def _exchange(self, key, conn, method, payload):
+		reader, writer = conn
+		writer.write(payload)
+		await writer.drain()
+		status_line = await reader.readuntil(b"\r\n")
+		try:
+			version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+			status = int(status)
+		except ValueError:
+			raise HttpError("Malformed status line {0!r}.".format(status_line))
+		headers = {}
+		while True:
+			line = await reader.readuntil(b"\r\n")
+			if line == b"\r\n":
+				break
+			name, _, value = line.decode("latin-1").partition(":")
+			headers[name.strip().lower()] = value.strip()
+
+		keep_alive = version != "HTTP/1.0" and headers.get("connection", "").lower() != "close"
+		if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+			body = b""
+		elif headers.get("transfer-encoding", "").lower() == "chunked":
+			chunks = []
+			while True:
+				size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+				if size == 0:
+					while await reader.readuntil(b"\r\n") != b"\r\n":
+						pass
+					break
+				chunks.append(await reader.readexactly(size))
+				await reader.readexactly(2)
+			body = b"".join(chunks)
+		elif "content-length" in headers:
+			body = await reader.readexactly(int(headers["content-length"]))
+		else:
+			body = await reader.read()
+			keep_alive = False
+
+		if keep_alive:
+			self._release(key, conn)
+		else:
+			writer.close()
+		return Response(status, headers, body)
+
+	def close(self):
+		for idle in self.idle.values():
+			for conn in idle:
+				conn[1].close()
+		self.idle = {}
@@ -0,0 +1,37 @@
+import random
+
+class Backoff:
+	"""Exponential backoff with jitter, capped at a maximum delay.
+
+	Configured from a dictionary with the keys initial, factor, max and jitter,
+	where jitter is the fraction of each delay that may be randomly cut off.
+	"""
+
+	def __init__(self, **kwargs):
+		self.initial = 0.1
+		self.factor = 2.0
+		self.maximum = 5.0
+		self.jitter = 0.2
+
+		if "initial" in kwargs:
+			self.initial = float(kwargs["initial"])
+
+		if "factor" in kwargs:
+			self.factor = float(kwargs["factor"])
+
+		if "max" in kwargs:
+			self.maximum = float(kwargs["max"])
+
+		if "jitter" in kwargs:
+			self.jitter = float(kwargs["jitter"])
+
+	def delay(self, attempt):
+		"""Returns the delay to wait after the given (zero-based) failed attempt."""
+		delay = min(self.maximum, self.initial * (self.factor ** min(attempt, 64)))
+		return delay - random.uniform(0, delay * self.jitter)
+
+	def delays(self):
+		attempt = 0
+		while True:
+			yield self.delay(attempt)
+			attempt += 1
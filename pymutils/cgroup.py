@@ -0,0 +1,192 @@
+import os
+import signal
+from .debug import debug, log
+
+def cgroup2_mount():
+	"""Returns the mount point of the cgroup v2 hierarchy, or None."""
+	try:
+		with open("/proc/self/mountinfo") as f:
+			for line in f:
+				fields = line.split()
+				separator = fields.index("-")
+				if fields[separator + 1] == "cgroup2":
+					return fields[4]
+	except (OSError, ValueError, IndexError):
+		pass
+	return None
+
+def own_cgroup():
+	"""Returns the cgroup v2 path of the manager, relative to the hierarchy root."""
+	with open("/proc/self/cgroup") as f:
+		for line in f:
+			if line.startswith("0::"):
+				return line[3:].strip()
+	return None
+
+def read_controllers(path, name="cgroup.controllers"):
+	try:
+		with open(os.path.join(path, name)) as f:
+			return set(f.read().split())
+	except OSError:
+		return set()
+
+def write_controllers(path, change):
+	with open(os.path.join(path, "cgroup.subtree_control"), "w") as f:
+		f.write(change)
+
+class CgroupTree:
+	"""A writable cgroup v2 subtree with one child cgroup per managed process.
+
+	The subtree is created below the cgroup of the manager. Processes are moved
+	into their cgroup before they exec, so their whole process tree can be listed
+	and signalled, even after processes left their process group.
+	"""
+
+	# The controllers the cgroups of processes need for cpu_max and memory_max.
+	CONTROLLERS = ("cpu", "memory")
+
+	def __init__(self, root, parent=None):
+		self.root = root
+		self.parent = parent
+		self.controllers = set()
+		self.parent_enabled = set()
+		self.leaf = None
+
+	@classmethod
+	def create(cls):
+		"""Creates the subtree of this manager, returning None if cgroup v2 is not available or writable."""
+		mount = cgroup2_mount()
+		if mount is None:
+			debug("cgroup v2 is not mounted.")
+			return None
+		try:
+			path = own_cgroup()
+		except OSError:
+			return None
+		if path is None:
+			return None
+		parent = os.path.join(mount, path.lstrip("/"))
+		root = os.path.join(parent, "pymanager-{0}".format(os.getpid()))
+		try:
+			os.makedirs(root, exist_ok=True)
+		except OSError as e:
+			debug("cgroup v2 subtree {0} is not writable: {1}".format(root, e))
+			return None
+		tree = cls(root, parent)
+		tree.enable_controllers()
+		debug("Using cgroup v2 subtree {0} with controllers: {1}.".format(root, ", ".join(sorted(tree.controllers)) or "none"))
+		return tree
+
+	def enable_controllers(self):
+		"""Enables the cpu and memory controllers for the cgroups of processes, as far as the hierarchy allows.
+
+		A controller reaches the subtree only if the cgroup of the manager enables
+		it for its children, which a cgroup holding processes cannot do. If it is
+		not enabled yet, the manager moves into the leaf cgroup <subtree>/manager,
+		and enables it in the cgroup it left, which works when the manager was
+		alone in it, as in a delegated service cgroup.
+		"""
+		wanted = set(CgroupTree.CONTROLLERS)
+		missing = wanted - read_controllers(self.root)
+		if missing & read_controllers(self.parent):
+			leaf = os.path.join(self.root, "manager")
+			try:
+				os.makedirs(leaf, exist_ok=True)
+				CgroupTree.join(leaf)
+				self.leaf = leaf
+				enable = missing & read_controllers(self.parent)
+				write_controllers(self.parent, " ".join("+" + name for name in sorted(enable)))
+				self.parent_enabled = enable
+			except OSError as e:
+				debug("Could not enable {0} in {1}: {2}".format(", ".join(sorted(missing)), self.parent, e))
+				self._leave()
+		available = wanted & read_controllers(self.root)
+		if available:
+			try:
+				write_controllers(self.root, " ".join("+" + name for name in sorted(available)))
+			except OSError as e:
+				debug("Could not enable the cpu and memory controllers in {0}: {1}".format(self.root, e))
+		self.controllers = wanted & read_controllers(self.root, "cgroup.subtree_control")
+
+	def _leave(self):
+		"""Moves the manager back into its own cgroup, undoing enable_controllers."""
+		if self.leaf is None:
+			return
+		try:
+			if self.parent_enabled:
+				write_controllers(self.parent, " ".join("-" + name for name in sorted(self.parent_enabled)))
+				self.parent_enabled = set()
+			CgroupTree.join(self.parent)
+		except OSError as e:
+			debug("Could not move the manager back to {0}: {1}".format(self.parent, e))
+			return
+		CgroupTree.remove(self.leaf)
+		self.leaf = None
+
+	def missing_controllers(self, files):
+		"""Returns the controllers needed by the cgroup files, such as cpu.max, which the subtree does not have."""
+		return set(name.split(".")[0] for name in files) - self.controllers
+
+	def path(self, name):
+		return os.path.join(self.root, name)
+
+	def prepare(self, name):
+		"""Creates the cgroup of a process and returns its path."""
+		path = self.path(name)
+		os.makedirs(path, exist_ok=True)
+		return path
+
+	@staticmethod
+	def join(path):
+		"""Moves the calling process into the cgroup. Used in the child before exec."""
+		with open(os.path.join(path, "cgroup.procs"), "w") as f:
+			f.write("0")
+
+	@staticmethod
+	def procs(path):
+		try:
+			with open(os.path.join(path, "cgroup.procs")) as f:
+				return [int(pid) for pid in f.read().split()]
+		except OSError:
+			return []
+
+	@staticmethod
+	def kill(path, signum):
+		"""Signals every process in the cgroup."""
+		if signum == signal.SIGKILL and os.path.exists(os.path.join(path, "cgroup.kill")):
+			try:
+				with open(os.path.join(path, "cgroup.kill"), "w") as f:
+					f.write("1")
+				return
+			except OSError:
+				pass
+		for pid in CgroupTree.procs(path):
+			try:
+				os.kill(pid, signum)
+			except ProcessLookupError:
+				pass
+
+	@staticmethod
+	def remove(path):
+		try:
+			os.rmdir(path)
+		except OSError:
+			pass
+
+	def close(self):
+		"""Removes the cgroups left empty, along with the subtree itself."""
+		try:
+			names = os.listdir(self.root)
+		except OSError:
+			return
+		for name in names:
+			path = os.path.join(self.root, name)
+			if os.path.isdir(path) and path != self.leaf:
+				CgroupTree.remove(path)
+		if self.leaf is not None:
+			try:
+				write_controllers(self.root, " ".join("-" + name for name in sorted(self.controllers)))
+			except OSError:
+				pass
+			self._leave()
+		CgroupTree.remove(self.root)
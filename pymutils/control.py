@@ -0,0 +1,317 @@
+"""A Unix socket control channel, and the pymanager ctl command using it.
+
+Every line sent to the socket is a JSON command, or a JSON array of commands
+executed in order, and is answered by one line with the result, or the array of
+results. A command is an object with op (status, restart, stop, start, signal,
+reload or shutdown) and the processes it applies to, selected by id, name and
+group (lists or comma separated strings) or all. Requests on one connection are
+answered in order, so clients may send many lines before reading the answers.
+"""
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+from .global_storage import Globals
+from .process import Process
+from .shutdown import stop_processes, async_shutdown
+from .events import set_status
+from .jobs import jobs
+from .debug import log
+from . import supervisor
+
+MAX_WORKERS = 64
+
+class ControlError(Exception):
+	pass
+
+def selection(command, required=True):
+	"""Returns the processes selected by the id, name, group and all keys of the command."""
+	if command.get("all", False):
+		return list(Process.processes)
+	def values(key):
+		value = command.get(key, [])
+		if isinstance(value, (str, int)):
+			value = str(value).split(",")
+		return [item for item in value if item != ""]
+	if not values("id") and not values("name") and not values("group"):
+		if required:
+			raise ControlError("No processes selected, use id, name, group or all.")
+		return list(Process.processes)
+	try:
+		ids = [int(value) for value in values("id")]
+	except ValueError:
+		raise ControlError("Invalid ID list '{0}'.".format(command["id"]))
+	procs = Process.processes.select(ids, values("name"), values("group"))
+	if not procs:
+		raise ControlError("No process matches the selection.")
+	return procs
+
+def not_in_shutdown():
+	if Globals.shutdown:
+		raise ControlError("Process is in shutdown.")
+
+def run_all(func, procs):
+	"""Calls func on the processes concurrently, returning the data of each process, or its error."""
+	def run(proc):
+		try:
+			func(proc)
+		except Exception as e:
+			return {"id": proc.internalId, "name": proc.name, "error": "{0}: {1}".format(type(e).__name__, e)}
+		return proc.get_data()
+	if len(procs) == 1:
+		return [run(procs[0])]
+	with ThreadPoolExecutor(max_workers=min(len(procs), MAX_WORKERS)) as pool:
+		return list(pool.map(run, procs))
+
+def command_status(command):
+	data = {"status": Globals.status, "processes": [proc.get_data() for proc in selection(command, False)]}
+	return data
+
+def command_restart(command):
+	not_in_shutdown()
+	timeout = float(command.get("timeout", 5))
+	def restart(proc):
+		proc.reset_failures()
+		proc.restart(timeout)
+	return {"processes": run_all(restart, selection(command))}
+
+def command_start(command):
+	not_in_shutdown()
+	def start(proc):
+		if proc.poll() is None:
+			return
+		proc.reset_failures()
+		proc.restart()
+	return {"processes": run_all(start, selection(command))}
+
+def command_stop(command):
+	not_in_shutdown()
+	procs = selection(command)
+	for proc in procs:
+		proc.stopped = True
+	stop_processes(procs, float(command.get("timeout", Globals.terminate_time_allowed)))
+	return {"processes": [proc.get_data() for proc in procs]}
+
+def command_signal(command):
+	not_in_shutdown()
+	name = str(command.get("signal", ""))
+	try:
+		signum = signal.Signals[name.upper() if name.upper().startswith("SIG") else "SIG" + name.upper()]
+	except KeyError:
+		raise ControlError("Unknown signal '{0}'.".format(name))
+	signalled = []
+	for proc in selection(command):
+		if proc.poll() is None:
+			proc.signal(signum)
+			signalled.append(proc.internalId)
+	return {"signalled": signalled}
+
+def command_reload(command):
+	not_in_shutdown()
+	if Globals.reloader is None:
+		raise ControlError("Reloading is not available.")
+	return {"job": jobs.submit("reload", Globals.reloader).get_data()}
+
+def command_shutdown(command):
+	not_in_shutdown()
+	Globals.shutdown = True
+	set_status("shutdown")
+	supervisor.notify()
+	return {"job": jobs.submit("shutdown", async_shutdown).get_data()}
+
+COMMANDS = {
+	"status": command_status,
+	"restart": command_restart,
+	"start": command_start,
+	"stop": command_stop,
+	"signal": command_signal,
+	"reload": command_reload,
+	"shutdown": command_shutdown,
+}
+
+def execute(command):
+	if not isinstance(command, dict) or not isinstance(command.get("op"), str) or command["op"] not in COMMANDS:
+		return {"success": False, "error": "Invalid command, op must be one of {0}.".format(", ".join(COMMANDS))}
+	started = time.time()
+	try:
+		result = COMMANDS[command["op"]](command)
+	except ControlError as e:
+		return {"success": False, "op": command["op"], "error": str(e)}
+	except Exception as e:
+		# A failed command must not cost the commands queued after it on the connection.
+		return {"success": False, "op": command["op"], "error": "{0}: {1}".format(type(e).__name__, e)}
+	result["success"] = not any("error" in proc for proc in result.get("processes", []))
+	result["op"] = command["op"]
+	result["seconds"] = round(time.time() - started, 4)
+	return result
+
+def handle_line(line):
+	try:
+		request = json.loads(line)
+	except ValueError as e:
+		return {"success": False, "error": "Invalid JSON: {0}".format(e)}
+	if isinstance(request, list):
+		return [execute(command) for command in request]
+	return execute(request)
+
+class ControlServer:
+	"""Serves the control socket, one thread per connection."""
+
+	def __init__(self, path):
+		self.path = os.path.abspath(path)
+		self.sock = None
+
+	def start(self):
+		if os.path.exists(self.path):
+			# Left by a manager which did not exit cleanly.
+			os.remove(self.path)
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		# Created owner-only, as a chmod after bind leaves a window in which anyone may connect.
+		umask = os.umask(0o177)
+		try:
+			self.sock.bind(self.path)
+		finally:
+			os.umask(umask)
+		self.sock.listen(16)
+		thread = threading.Thread(target=self._accept)
+		thread.daemon = True
+		thread.start()
+		return self
+
+	def _accept(self):
+		while True:
+			try:
+				conn, _ = self.sock.accept()
+			except OSError:
+				return
+			thread = threading.Thread(target=self._serve, args=(conn,))
+			thread.daemon = True
+			thread.start()
+
+	def _serve(self, conn):
+		with conn, conn.makefile("rb") as reader, conn.makefile("wb") as writer:
+			try:
+				for line in reader:
+					if not line.strip():
+						continue
+					writer.write((json.dumps(handle_line(line.decode("utf-8", "replace"))) + "\n").encode("utf-8"))
+					writer.flush()
+			except OSError:
+				pass
+			except Exception as e:
+				log("[WARNING] control connection failed: {0}: {1}".format(type(e).__name__, e))
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+			try:
+				os.remove(self.path)
+			except OSError:
+				pass
+
+# The pymanager ctl command.
+
+def parse_commands(args):
+	"""Turns "restart web @workers #3 stop db" into commands: words after an op select processes by name, @group, #id or all."""
+	commands = []
+	args = list(args)
+	while args:
+		op = args.pop(0)
+		if op not in COMMANDS:
+			raise ValueError("Unknown command '{0}', must be one of {1}.".format(op, ", ".join(COMMANDS)))
+		command = {"op": op, "id": [], "name": [], "group": []}
+		if op == "signal":
+			if not args:
+				raise ValueError("Missing signal name.")
+			command["signal"] = args.pop(0)
+		while args and args[0] not in COMMANDS:
+			word = args.pop(0)
+			if word == "all":
+				command["all"] = True
+			elif word.startswith("@"):
+				command["group"].append(word[1:])
+			elif word.startswith("#"):
+				command["id"].append(word[1:])
+			else:
+				command["name"].append(word)
+		commands.append(command)
+	return commands
+
+def socket_path(filename):
+	"""Returns the control socket configured in the configuration file."""
+	with open(filename) as f:
+		config = json.load(f)
+	if "control_socket" not in config:
+		raise ValueError("{0} does not set control_socket.".format(filename))
+	return config["control_socket"]
+
+def ctl_main(argv):
+	parser = OptionParser(usage="%prog ctl [options] COMMAND [PROCESS...] [COMMAND [PROCESS...]]...\n\n"
+		"Commands: {0}. Processes are names, @group, #id or all.".format(", ".join(COMMANDS)))
+	parser.add_option("-f", "--file", dest="filename", default="pymanager.json", help="The pymanager file setting control_socket, defaults to pymanager.json.", metavar="FILE")
+	parser.add_option("-s", "--socket", dest="socket", default=None, help="The control socket, instead of the one set in the pymanager file.", metavar="PATH")
+	parser.add_option("-t", "--timeout", dest="timeout", type="float", default=None, help="Graceful time for restart and stop.")
+	parser.add_option("-b", "--batch", dest="batch", default=False, action="store_true", help="Send the JSON lines read from standard input, printing the answers.")
+	opts, args = parser.parse_args(argv)
+	try:
+		path = opts.socket or socket_path(opts.filename)
+		commands = [] if opts.batch else parse_commands(args)
+	except (OSError, ValueError) as e:
+		print(e, file=sys.stderr)
+		return 2
+	if not opts.batch and not commands:
+		parser.print_usage(sys.stderr)
+		return 2
+	for command in commands:
+		if opts.timeout is not None:
+			command["timeout"] = opts.timeout
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(path)
+	except OSError as e:
+		print("Cannot connect to {0}: {1}".format(path, e), file=sys.stderr)
+		return 1
+	failed = False
+	with sock, sock.makefile("rb") as reader:
+		if opts.batch:
+			# Sent from another thread, so the answers are read while requests are still being sent.
+			sent = []
+			def send():
+				try:
+					for line in sys.stdin:
+						if line.strip():
+							sock.sendall(line.rstrip("\n").encode("utf-8") + b"\n")
+							sent.append(line)
+					sock.shutdown(socket.SHUT_WR)
+				except OSError:
+					pass
+			sender = threading.Thread(target=send)
+			sender.daemon = True
+			sender.start()
+			answered = 0
+			for line in reader:
+				answer = json.loads(line.decode("utf-8"))
+				failed = failed or not all(result.get("success") for result in (answer if isinstance(answer, list) else [answer]))
+				sys.stdout.write(line.decode("utf-8"))
+				answered += 1
+			sender.join()
+			if answered < len(sent):
+				print("The connection was closed after {0} of {1} answers.".format(answered, len(sent)), file=sys.stderr)
+				failed = True
+		else:
+			sock.sendall((json.dumps(commands) + "\n").encode("utf-8"))
+			line = reader.readline()
+			if not line:
+				print("The connection was closed before the answer.", file=sys.stderr)
+				return 1
+			for result in json.loads(line.decode("utf-8")):
+				failed = failed or not result.get("success")
+				print(json.dumps(result, indent=2))
+	return 1 if failed else 0
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import subprocess
+import threading
+from .global_storage import Globals
+from .debug import debug
+
+def source_environment(path, shell):
+	"""Sources the file in the given shell and returns the resulting environment."""
+	cmd = ". {0}; env".format(path)
+	if shell is False:
+		shell = True
+	if shell is True:
+		shell = Globals.default_shell
+	if shell is not True:
+		cmd = [shell, "-c", '%s' % cmd]
+		shell = False
+	pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=shell)
+	output = pipe.communicate()[0]
+	return dict((line.decode().split("=", 1) for line in output.splitlines()))
+
+class CachedEnvironment:
+	def __init__(self, signature, digest, environment):
+		self.signature = signature
+		self.digest = digest
+		self.environment = environment
+
+class EnvironmentCache:
+	"""Caches sourced environment files, shared by every process using the same file and shell.
+
+	An entry is reused as long as the file keeps its modification time and size,
+	or, when those changed, its contents hash to the same digest.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.key_locks = {}
+		self.entries = {}
+		self.hits = 0
+		self.misses = 0
+
+	def _digest(self, path):
+		with open(path, "rb") as f:
+			return hashlib.sha1(f.read()).hexdigest()
+
+	def load(self, path, shell):
+		try:
+			st = os.stat(path)
+		except OSError:
+			return source_environment(path, shell)
+		key = (os.path.abspath(path), shell)
+		signature = (st.st_mtime_ns, st.st_size)
+		with self.lock:
+			key_lock = self.key_locks.setdefault(key, threading.Lock())
+		with key_lock:
+			entry = self.entries.get(key)
+			if entry is not None and entry.signature != signature:
+				digest = self._digest(path)
+				if digest == entry.digest:
+					entry.signature = signature
+				else:
+					entry = None
+			if entry is not None:
+				with self.lock:
+					self.hits += 1
+				debug("Environment file {0} served from cache ({1} hits, {2} misses).".format(path, self.hits, self.misses))
+				return dict(entry.environment)
+			digest = self._digest(path)
+			environment = source_environment(path, shell)
+			self.entries[key] = CachedEnvironment(signature, digest, environment)
+			with self.lock:
+				self.misses += 1
+			debug("Environment file {0} sourced ({1} hits, {2} misses).".format(path, self.hits, self.misses))
+			return dict(environment)
+
+	def stats(self):
+		return {"hits": self.hits, "misses": self.misses, "files": len(self.entries)}
+
+environment_cache = EnvironmentCache()
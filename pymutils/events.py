@@ -0,0 +1,54 @@
+import collections
+import itertools
+import threading
+import time
+from .global_storage import Globals
+
+class EventBus:
+	"""Structured events about processes and the manager, numbered by a monotonic sequence.
+
+	The most recent events are kept so clients can resume from the last sequence
+	number they received.
+	"""
+
+	def __init__(self, history=1000):
+		self.condition = threading.Condition()
+		self.history = collections.deque(maxlen=history)
+		self.seq = 0
+
+	def emit(self, kind, **data):
+		with self.condition:
+			self.seq += 1
+			event = {"seq": self.seq, "type": kind, "time": time.time()}
+			event.update(data)
+			self.history.append(event)
+			self.condition.notify_all()
+		return event
+
+	def since(self, seq, timeout=None):
+		"""Returns the events after seq, waiting up to timeout for one if there are none.
+
+		If events after seq were already dropped from the history, the first event
+		returned has a sequence number higher than seq + 1.
+		"""
+		with self.condition:
+			if self.seq <= seq:
+				self.condition.wait(timeout)
+			missing = self.seq - seq
+			if missing <= 0:
+				return []
+			if missing >= len(self.history):
+				return list(self.history)
+			return list(itertools.islice(self.history, len(self.history) - missing, None))
+
+events = EventBus()
+
+def emit(kind, **data):
+	return events.emit(kind, **data)
+
+def set_status(status):
+	"""Changes the status of the manager reported by GET /status."""
+	if Globals.status == status:
+		return
+	Globals.status = status
+	emit("manager.status", status=status)
@@ -1,3 +1,5 @@
+import asyncio
+import os
 import subprocess
 from .verifier import Verifier
 
@@ -12,12 +14,37 @@ class ExitedVerifier(Verifier):
 		if "expect_code" in kwargs:
 			self.expect_code = kwargs["expect_code"]
 
+	def check_code(self, proc):
+		if proc.code() != self.expect_code:
+			self.log_fail("Expected exit code {0}, got {1}".format(self.expect_code, proc.code()))
+		return proc.code() == self.expect_code
+
 	def run(self, proc):
 		try:
 			proc.wait(self.timeout)
 		except subprocess.TimeoutExpired:
 			self.log_fail("Process did not exit in given timeframe {0}s".format(self.timeout))
 			return False
-		if proc.code() != self.expect_code:
-			self.log_fail("Expected exit code {0}, got {1}".format(proc.code(), self.expect_code))
-		return proc.code() == self.expect_code
\ No newline at end of file
+		return self.check_code(proc)
+
+	async def arun(self, proc):
+		if proc.poll() is not None:
+			return self.check_code(proc)
+		try:
+			fd = os.pidfd_open(proc.proc.pid)
+		except (AttributeError, OSError):
+			return await super().arun(proc)
+		loop = asyncio.get_event_loop()
+		exited = loop.create_future()
+		loop.add_reader(fd, lambda: exited.done() or exited.set_result(True))
+		try:
+			await asyncio.wait_for(exited, self.timeout)
+		except asyncio.TimeoutError:
+			self.log_fail("Process did not exit in given timeframe {0}s".format(self.timeout))
+			return False
+		finally:
+			loop.remove_reader(fd)
+			os.close(fd)
+		# The pidfd is readable once the process exited, the wait only reaps it.
+		proc.wait(1)
+		return self.check_code(proc)
@@ -0,0 +1,204 @@
+"""A coordinator over the HTTP interfaces of many pymanager instances.
+
+Status, restart and shutdown requests are sent to every member at once from the
+verifier engine loop, through its keep-alive connection pool, so an operation on
+the whole federation takes about as long as its slowest member, and never longer
+than the timeout. The answers are merged into one view, in which a member which
+could not be reached or refused the request is reported with its error instead
+of failing the operation.
+"""
+import asyncio
+import json
+import sys
+from optparse import OptionParser
+from urllib.parse import urlsplit, urlencode
+import bottle
+from .aio_http import HttpError
+from .verifier_engine import get_engine
+
+class FederationError(Exception):
+	pass
+
+class Member:
+	def __init__(self, definition):
+		if isinstance(definition, str):
+			definition = {"url": definition}
+		if "url" not in definition:
+			raise FederationError("Federation member {0} has no url.".format(json.dumps(definition)))
+		self.url = definition["url"].rstrip("/")
+		if "://" not in self.url:
+			self.url = "http://" + self.url
+		parts = urlsplit(self.url)
+		if parts.scheme not in ("http", "https") or not parts.hostname:
+			raise FederationError("Invalid federation member url '{0}'.".format(definition["url"]))
+		self.name = definition.get("name", parts.netloc)
+
+class Federation:
+	"""Sends requests to all members concurrently, each allowed timeout seconds."""
+
+	def __init__(self, members, timeout=5):
+		self.members = [member if isinstance(member, Member) else Member(member) for member in members]
+		self.timeout = float(timeout)
+		if not self.members:
+			raise FederationError("The federation has no members.")
+		names = [member.name for member in self.members]
+		for name in names:
+			if names.count(name) > 1:
+				raise FederationError("Federation member name '{0}' is not unique.".format(name))
+
+	async def call(self, member, method, path):
+		"""Returns the result of one request: success, the HTTP status and the JSON data, or the error."""
+		loop = asyncio.get_event_loop()
+		started = loop.time()
+		result = {"success": False}
+		try:
+			response = await get_engine().http.request(method, member.url + path, timeout=self.timeout)
+		except asyncio.TimeoutError:
+			result["error"] = "No answer within {0}s.".format(self.timeout)
+		except (OSError, HttpError, asyncio.IncompleteReadError, ValueError) as e:
+			result["error"] = str(e) or type(e).__name__
+		else:
+			result["status"] = response.status_code
+			try:
+				data = json.loads(response.text()) if response.body else None
+			except ValueError:
+				data = None
+			if 200 <= response.status_code < 300:
+				result["success"] = True
+				result["data"] = data
+			else:
+				try:
+					result["error"] = data["error"]["message"]
+				except (TypeError, KeyError):
+					result["error"] = "HTTP status {0}.".format(response.status_code)
+		result["seconds"] = round(loop.time() - started, 3)
+		return result
+
+	async def _fan_out(self, requests):
+		calls = [self.call(member, method, path) for member in self.members for method, path in requests]
+		results = await asyncio.gather(*calls)
+		return [results[i:i + len(requests)] for i in range(0, len(results), len(requests))]
+
+	def fan_out(self, *requests):
+		"""Sends every (method, path) request to every member, returning the results per member, in order."""
+		return get_engine().submit(self._fan_out(requests)).result()
+
+	def merge(self, results, render):
+		"""Merges the results of every member, render turning the successful results of a member into its entry."""
+		nodes = []
+		errors = {}
+		for member, member_results in zip(self.members, results):
+			node = {"name": member.name, "url": member.url, "seconds": max(result["seconds"] for result in member_results)}
+			failed = [result for result in member_results if not result["success"]]
+			if failed:
+				node["success"] = False
+				node["error"] = failed[0]["error"]
+				errors[member.name] = node["error"]
+			else:
+				node["success"] = True
+				node.update(render(*[result["data"] for result in member_results]))
+			nodes.append(node)
+		return {"success": not errors, "nodes": nodes, "errors": errors}
+
+	def status(self):
+		"""The status and processes of every member, with the total number of processes."""
+		def render(processes, status):
+			return {"status": status["status"], "count": processes["count"], "processes": processes["processes"]}
+		merged = self.merge(self.fan_out(("GET", "/"), ("GET", "/status")), render)
+		merged["count"] = sum(node.get("count", 0) for node in merged["nodes"])
+		return merged
+
+	def restart(self, selection):
+		"""Restarts the processes matching the selection (id, name, group or all query parameters) on every member."""
+		return self.merge(self.fan_out(("POST", "/restart?" + urlencode(selection))), lambda accepted: {"job": accepted["job"]})
+
+	def shutdown(self):
+		"""Shuts every member down."""
+		return self.merge(self.fan_out(("DELETE", "/")), lambda accepted: {"job": accepted["job"]})
+
+def make_app(federation):
+	"""Returns the bottle application serving the coordinator HTTP interface."""
+	app = bottle.Bottle()
+
+	@app.get("/")
+	def federation_status():
+		return federation.status()
+
+	@app.post("/restart")
+	def federation_restart():
+		return federation.restart(dict(bottle.request.query))
+
+	@app.delete("/")
+	def federation_shutdown():
+		return federation.shutdown()
+
+	return app
+
+def serve(federation, port=5000, server="threaded"):
+	from .http_service import ThreadingWSGIServer, KeepAliveHandler
+	app = make_app(federation)
+	if server == "threaded":
+		bottle.run(app, host="localhost", port=port, quiet=True, server="wsgiref", server_class=ThreadingWSGIServer, handler_class=KeepAliveHandler)
+	else:
+		bottle.run(app, host="localhost", port=port, quiet=True, server=server)
+
+def selection_query(words):
+	"""Turns the words "web @workers #3" or "all" into the query parameters selecting those processes."""
+	query = {}
+	for word in words:
+		if word == "all":
+			query["all"] = "1"
+		elif word.startswith("@"):
+			query.setdefault("group", []).append(word[1:])
+		elif word.startswith("#"):
+			query.setdefault("id", []).append(word[1:])
+		else:
+			query.setdefault("name", []).append(word)
+	for key, value in query.items():
+		if isinstance(value, list):
+			query[key] = ",".join(value)
+	return query
+
+def federation_config(filename):
+	with open(filename) as f:
+		config = json.load(f)
+	if "federation" not in config:
+		raise FederationError("{0} has no federation section.".format(filename))
+	return config["federation"]
+
+def federation_main(argv):
+	parser = OptionParser(usage="%prog federation [options] [status | restart PROCESS... | shutdown]\n\n"
+		"Without a command, serves the merged HTTP interface of the members. Processes are names, @group, #id or all.")
+	parser.add_option("-f", "--file", dest="filename", default=None, help="A pymanager file with a federation section listing the members.", metavar="FILE")
+	parser.add_option("-m", "--member", dest="members", default=[], action="append", help="The HTTP address of a member, may be repeated.", metavar="URL")
+	parser.add_option("-t", "--timeout", dest="timeout", type="float", default=None, help="Seconds allowed to each member, defaults to 5.")
+	parser.add_option("-p", "--port", dest="port", type="int", default=None, help="The port of the coordinator HTTP interface, defaults to 5000.")
+	opts, args = parser.parse_args(argv)
+	try:
+		fconf = federation_config(opts.filename) if opts.filename is not None else {}
+		members = fconf.get("members", []) + opts.members
+		timeout = opts.timeout if opts.timeout is not None else fconf.get("timeout", 5)
+		federation = Federation(members, timeout)
+	except (OSError, ValueError, FederationError) as e:
+		print(e, file=sys.stderr)
+		return 2
+
+	if not args:
+		port = opts.port if opts.port is not None else fconf.get("port", 5000)
+		serve(federation, port, fconf.get("server", "threaded"))
+		return 0
+	command, words = args[0], args[1:]
+	if command == "status":
+		result = federation.status()
+	elif command == "restart":
+		if not words:
+			print("No processes selected, use names, @group, #id or all.", file=sys.stderr)
+			return 2
+		result = federation.restart(selection_query(words))
+	elif command == "shutdown":
+		result = federation.shutdown()
+	else:
+		parser.print_usage(sys.stderr)
+		return 2
+	print(json.dumps(result, indent=2))
+	return 0 if result["success"] else 1
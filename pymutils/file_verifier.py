@@ -0,0 +1,159 @@
+import asyncio
+import ctypes
+import os
+import struct
+from .verifier import Verifier
+from .global_storage import Globals
+from .backoff import Backoff
+from .limits import libc
+from .verifier_engine import get_engine
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT_HEADER = struct.Struct("iIII")
+
+class Inotify:
+	"""A single inotify instance serving every file verifier on the verifier engine loop.
+
+	Callbacks are registered per watched directory and called on any event in it.
+	"""
+
+	def __init__(self, loop):
+		self.loop = loop
+		self.fd = libc().inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+		if self.fd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		self.callbacks = {}
+		loop.add_reader(self.fd, self._read)
+
+	def watch(self, directory, callback):
+		"""Calls callback on changes in directory. Returns the watch descriptor, to unwatch."""
+		wd = libc().inotify_add_watch(self.fd, os.fsencode(directory), IN_WATCH_MASK)
+		if wd < 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		self.callbacks.setdefault(wd, set()).add(callback)
+		return wd
+
+	def unwatch(self, wd, callback):
+		callbacks = self.callbacks.get(wd)
+		if callbacks is None:
+			return
+		callbacks.discard(callback)
+		if not callbacks:
+			del self.callbacks[wd]
+			libc().inotify_rm_watch(self.fd, wd)
+
+	def _read(self):
+		try:
+			data = os.read(self.fd, 65536)
+		except BlockingIOError:
+			return
+		woken = set()
+		offset = 0
+		while offset + EVENT_HEADER.size <= len(data):
+			wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+			offset += EVENT_HEADER.size + length
+			woken.update(self.callbacks.get(wd, ()))
+		for callback in woken:
+			callback()
+
+_inotify = None
+
+def get_inotify(loop):
+	"""Returns the inotify instance of the loop, or None if inotify is not available."""
+	global _inotify
+	if _inotify is None:
+		try:
+			_inotify = Inotify(loop)
+		except (OSError, AttributeError):
+			_inotify = False
+	return _inotify or None
+
+def existing_ancestor(path):
+	"""Returns the deepest existing directory on the way to path."""
+	directory = os.path.dirname(os.path.abspath(path))
+	while not os.path.isdir(directory):
+		directory = os.path.dirname(directory)
+	return directory
+
+class FileExistsVerifier(Verifier):
+	"""Passes once the file at path exists, and is not empty if nonempty is set.
+
+	Waits for inotify events on the deepest existing directory leading to the file,
+	so nothing runs while nothing changes; polls according to backoff if inotify is
+	not available.
+	"""
+
+	def __init__(self, **kwargs):
+		self.path = ""
+		self.timeout = 30
+		self.nonempty = False
+		self.backoff = Backoff()
+
+		if "path" in kwargs:
+			self.path = kwargs["path"]
+
+		if "timeout" in kwargs:
+			self.timeout = kwargs["timeout"]
+
+		if "nonempty" in kwargs:
+			self.nonempty = kwargs["nonempty"]
+
+		if "backoff" in kwargs:
+			self.backoff = Backoff(**kwargs["backoff"])
+
+	def ready(self):
+		try:
+			size = os.stat(self.path).st_size
+		except OSError:
+			return False
+		return size > 0 or not self.nonempty
+
+	def run(self, proc):
+		return get_engine().verify(self, proc)
+
+	async def arun(self, proc):
+		loop = asyncio.get_event_loop()
+		timeout_at = loop.time() + self.timeout
+		inotify = get_inotify(loop)
+		changed = asyncio.Event()
+		watched = None
+		delays = self.backoff.delays()
+		self.log_verbose("Waiting for {0}".format(self.path))
+		try:
+			while True:
+				if inotify is not None:
+					directory = existing_ancestor(self.path)
+					if watched is None or watched[0] != directory:
+						if watched is not None:
+							inotify.unwatch(watched[1], changed.set)
+						watched = (directory, inotify.watch(directory, changed.set))
+				changed.clear()
+				if self.ready():
+					return True
+				if Globals.shutdown:
+					return False
+				remaining = timeout_at - loop.time()
+				if remaining <= 0:
+					break
+				try:
+					if inotify is not None:
+						await asyncio.wait_for(changed.wait(), remaining)
+					else:
+						await asyncio.sleep(min(next(delays), remaining))
+				except asyncio.TimeoutError:
+					break
+		finally:
+			if watched is not None:
+				inotify.unwatch(watched[1], changed.set)
+		self.log_fail("{0} did not appear in given timeframe {1}s".format(self.path, self.timeout))
+		return False
@@ -4,9 +4,30 @@ class Globals:
 	may_terminate = False
 	keep_alive = False
 	terminate_time_allowed = 10
+	shutdown_waves = False
 	status = "booting"
+	state_version = 0
 	default_shell = True
 	verbose = 0
 	outfile = None
+	supervisor = None
+	verifier_engine = None
+	output_multiplexer = None
+	listen_sockets = None
+	control = None
+	sampler = None
+	scheduler = None
+	cgroups = None
+	zygote = None
+	config_file = None
+	verifiers = {}
+	reloader = None
+	reloading = False
+	state_file = None
+	detached = False
+	output_buffer_size = 65536
+	log_options = {}
+	log_sinks = {}
 
-	messages = []
\ No newline at end of file
+	messages = []
+	stop_latencies = {}
\ No newline at end of file
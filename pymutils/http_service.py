@@ -1,8 +1,19 @@
-from bottle import get, post, delete, request, run, abort, HTTPResponse
+from bottle import get, post, delete, request, response, run, abort, HTTPResponse
 from .process import Process
 from .global_storage import Globals
-from threading import Thread
+from . import supervisor
+from .shutdown import async_shutdown
+from .environment import environment_cache
+from .jobs import jobs
+from .rolling import rolling_restart
+from .snapshot import Snapshot
+from .events import events, set_status
+from threading import Thread, Condition
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
 import json
+import signal
+import time
 
 def r403(message):
 	raise HTTPResponse(json.dumps({"success": False, "error": {"message": message}}), 403)
@@ -13,24 +24,112 @@ def r404(message):
 def r400(message):
 	raise HTTPResponse(json.dumps({"success": False, "error": {"message": message}}), 400)
 
-def fork_http_service(port=5001):
-	p = Thread(target=launch_http_service, args=(port,))
+def r202(job):
+	raise HTTPResponse(json.dumps({"success": True, "job": job.get_data()}), 202, {"Content-Type": "application/json", "Location": "/jobs/{0}".format(job.internalId)})
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+	daemon_threads = True
+
+class KeepAliveServerHandler(ServerHandler):
+	http_version = "1.1"
+
+	def cleanup_headers(self):
+		super().cleanup_headers()
+		# A response of unknown length, such as the event stream, ends with the connection.
+		if "Content-Length" not in self.headers:
+			self.headers["Connection"] = "close"
+			self.request_handler.close_connection = True
+			# Streams last until the client leaves, the manager does not wait for them to exit.
+			self.request_handler.finished()
+
+class KeepAliveHandler(WSGIRequestHandler):
+	"""Serves HTTP/1.1 requests one after the other on the same connection.
+
+	wsgiref answers a single request per connection, so clients polling the
+	manager, such as a federation coordinator, would reconnect every time.
+	Idle connections are closed after timeout seconds.
+	"""
+
+	protocol_version = "HTTP/1.1"
+	timeout = 60
+	answering = 0
+	answered = Condition()
+	in_answer = False
+
+	def address_string(self):
+		return self.client_address[0]
+
+	def log_request(self, *args, **kwargs):
+		pass
+
+	def handle(self):
+		self.close_connection = True
+		try:
+			self.handle_request()
+			while not self.close_connection:
+				self.handle_request()
+		except (OSError, ValueError):
+			pass
+
+	def handle_request(self):
+		self.close_connection = True
+		self.raw_requestline = self.rfile.readline(65537)
+		if not self.raw_requestline:
+			return
+		if len(self.raw_requestline) > 65536:
+			self.requestline = ""
+			self.request_version = ""
+			self.command = ""
+			self.send_error(414)
+			return
+		if not self.parse_request():
+			return
+		# The application may leave a request body unread, the connection cannot be reused then.
+		if self.headers.get("Content-Length", "0") not in ("", "0"):
+			self.close_connection = True
+		with KeepAliveHandler.answered:
+			KeepAliveHandler.answering += 1
+		self.in_answer = True
+		try:
+			handler = KeepAliveServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(), multithread=True)
+			handler.request_handler = self
+			handler.run(self.server.get_app())
+			self.wfile.flush()
+		finally:
+			self.finished()
+
+	def finished(self):
+		if self.in_answer:
+			self.in_answer = False
+			with KeepAliveHandler.answered:
+				KeepAliveHandler.answering -= 1
+				KeepAliveHandler.answered.notify_all()
+
+def wait_for_answers(timeout):
+	"""Waits until the requests being answered are answered, so a DELETE / gets its response before the manager exits."""
+	with KeepAliveHandler.answered:
+		KeepAliveHandler.answered.wait_for(lambda: KeepAliveHandler.answering == 0, timeout)
+
+def fork_http_service(port=5001, server="threaded", debug=False):
+	p = Thread(target=launch_http_service, args=(port, server, debug))
 	p.daemon = True
 	p.start()
 
-def launch_http_service(port=5001):
-	run(host='localhost', port=port, debug=True, quiet=True)
+def launch_http_service(port=5001, server="threaded", debug=False):
+	if server == "threaded":
+		run(host='localhost', port=port, debug=debug, quiet=True, server="wsgiref", server_class=ThreadingWSGIServer, handler_class=KeepAliveHandler)
+	else:
+		run(host='localhost', port=port, debug=debug, quiet=True, server=server)
 
-def async_shutdown():
-	for proc in Process.processes:
-		if proc.poll() is None:
-			proc.force_terminate(Globals.terminate_time_allowed)
-	Globals.may_terminate = True
+def serve_snapshot(snapshot):
+	body, etag = snapshot.get()
+	if request.headers.get("If-None-Match") == etag:
+		raise HTTPResponse(status=304, headers={"ETag": etag})
+	response.content_type = "application/json"
+	response.set_header("ETag", etag)
+	return body
 
-@get("/")
-def list_processes():
-	if Globals.shutdown:
-		r403("Process is in shutdown.")
+def render_processes():
 	output = {
 		"count": len(Process.processes),
 		"processes": [],
@@ -40,35 +139,201 @@ def list_processes():
 		output["processes"].append(procdata)
 	return output
 
+def render_status():
+	output = {
+		"status": Globals.status,
+		"environment_cache": environment_cache.stats()
+	}
+	if Globals.stop_latencies:
+		output["stop_latencies"] = Globals.stop_latencies
+	return output
+
+processes_snapshot = Snapshot(render_processes)
+status_snapshot = Snapshot(render_status)
+
+@get("/")
+def list_processes():
+	if Globals.shutdown:
+		r403("Process is in shutdown.")
+	return serve_snapshot(processes_snapshot)
+
 @get("/status")
 def service_status():
-	return {
-		"status": Globals.status
-	}
+	return serve_snapshot(status_snapshot)
+
+@get("/events")
+def event_stream():
+	"""Streams events as server-sent events, or as JSON lines with format=jsonl.
+
+	Only new events are sent, unless the Last-Event-ID header or the since
+	parameter gives the sequence number to resume after.
+	"""
+	seq = events.seq
+	try:
+		if "Last-Event-ID" in request.headers:
+			seq = int(request.headers["Last-Event-ID"])
+		elif "since" in request.query:
+			seq = int(request.query["since"])
+	except ValueError:
+		r400("Invalid event sequence number.")
+	jsonl = request.query.get("format") == "jsonl"
+	response.content_type = "application/x-ndjson" if jsonl else "text/event-stream"
+	response.set_header("Cache-Control", "no-cache")
+
+	def stream(seq):
+		yield "" if jsonl else ": connected\n\n"
+		while not Globals.may_terminate:
+			batch = events.since(seq, 15)
+			if not batch:
+				yield "\n" if jsonl else ": keep-alive\n\n"
+				continue
+			if batch[0]["seq"] > seq + 1:
+				gap = {"seq": batch[0]["seq"] - 1, "type": "stream.gap", "lost": batch[0]["seq"] - seq - 1}
+				batch.insert(0, gap)
+			for event in batch:
+				seq = event["seq"]
+				data = json.dumps(event)
+				if jsonl:
+					yield data + "\n"
+				else:
+					yield "id: {0}\nevent: {1}\ndata: {2}\n\n".format(event["seq"], event["type"], data)
+	return stream(seq)
+
+@get("/metrics")
+def prometheus_metrics():
+	if Globals.sampler is None:
+		r404("Resource sampling is not enabled.")
+	response.content_type = "text/plain; version=0.0.4"
+	return Globals.sampler.prometheus()
 
+@get("/jobs")
+def list_jobs():
+	return {"jobs": [job.get_data() for job in jobs]}
+
+@get("/jobs/<id>")
+def job_status(id):
+	try:
+		job = jobs.get(int(id))
+	except ValueError:
+		r400("Invalid job ID '{0}'.".format(id))
+	if job is None:
+		r404("Job with id '{0}' not found.".format(id))
+	return {"success": True, "job": job.get_data()}
+
+def find_process(id):
+	try:
+		proc = Process.processes.get(int(id))
+	except ValueError:
+		r400("Invalid ID '{0}'.".format(id))
+	if proc is None:
+		r404("Process with id '{0}' not found.".format(id))
+	return proc
+
+def find_named_process(name):
+	proc = Process.processes.get_name(name)
+	if proc is None:
+		r404("Process with name '{0}' not found.".format(name))
+	return proc
+
+def select_processes():
+	"""Selects processes by the comma separated id, name and group query parameters, or all of them with all."""
+	if request.query.get("all", "") not in ("", "0", "false"):
+		return list(Process.processes)
+	def values(key):
+		if key not in request.query:
+			return []
+		return [value for value in request.query[key].split(",") if value]
+	if not values("id") and not values("name") and not values("group"):
+		r400("No processes selected, use the id, name, group or all parameters.")
+	try:
+		ids = [int(value) for value in values("id")]
+	except ValueError:
+		r400("Invalid ID list '{0}'.".format(request.query["id"]))
+	procs = Process.processes.select(ids, values("name"), values("group"))
+	if not procs:
+		r404("No process matches the selection.")
+	return procs
+
+@get("/processes/<id>/output")
+def process_output(id):
+	proc = find_process(id)
+	if proc.output is None:
+		r404("Output of process with id '{0}' is not captured.".format(id))
+	tail = None
+	if "tail" in request.query:
+		try:
+			tail = int(request.query["tail"])
+		except ValueError:
+			r400("Invalid tail '{0}'.".format(request.query["tail"]))
+	return {"success": True, "id": proc.internalId, "output": proc.output.tail(tail)}
+
+def restart_job(job, procs):
+	data = []
+	for proc in procs:
+		started = time.time()
+		proc.reset_failures()
+		proc.restart(5)
+		job.step("restart", started, process=proc.internalId)
+		data.append(proc.get_data())
+	return data
+
+def restart_processes(procs):
+	if Globals.shutdown:
+		r403("Process is in shutdown.")
+	r202(jobs.submit("restart", restart_job, procs))
 
 @post("/restart/<id>")
 def restart_process(id):
+	restart_processes([find_process(id)])
+
+@post("/restart/name/<name>")
+def restart_named_process(name):
+	restart_processes([find_named_process(name)])
+
+@post("/restart")
+def restart_selected_processes():
+	restart_processes(select_processes())
+
+@post("/rolling-restart")
+def rolling_restart_processes():
 	if Globals.shutdown:
 		r403("Process is in shutdown.")
-	p = None
+	procs = select_processes()
 	try:
-		for proc in Process.processes:
-			if proc.internalId == int(id):
-				proc.restart(5)
-				data = proc.get_data()
-				return {"success": True, "process": data}
-		r404("Process with id '{0}' not found.")
+		batch = int(request.query.get("batch", 1))
+		grace = float(request.query.get("grace", 5))
 	except ValueError:
-		r400("Invalid ID '{0}'.".format(id))
+		r400("Invalid batch size or grace period.")
+	r202(jobs.submit("rolling-restart", rolling_restart, procs, batch, grace))
+
+@post("/signal/<signame>")
+def signal_selected_processes(signame):
+	if Globals.shutdown:
+		r403("Process is in shutdown.")
+	try:
+		signum = signal.Signals[signame.upper() if signame.upper().startswith("SIG") else "SIG" + signame.upper()]
+	except KeyError:
+		r400("Unknown signal '{0}'.".format(signame))
+	signalled = []
+	for proc in select_processes():
+		if proc.poll() is None:
+			proc.signal(signum)
+			signalled.append(proc.internalId)
+	return {"success": True, "signalled": signalled}
+
+@post("/reload")
+def reload_configuration():
+	if Globals.shutdown:
+		r403("Process is in shutdown.")
+	if Globals.reloader is None:
+		r404("Reloading is not available.")
+	r202(jobs.submit("reload", Globals.reloader))
 
 @delete("/")
 def kill_process_tree():
 	if Globals.shutdown:
 		r403("Process is in shutdown.")
 	Globals.shutdown = True
-	Globals.status = "shutdown"
-	p = Thread(target=async_shutdown, args=())
-	p.start()
-	return {"success": True}
-
+	set_status("shutdown")
+	supervisor.notify()
+	r202(jobs.submit("shutdown", async_shutdown))
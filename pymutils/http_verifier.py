@@ -1,8 +1,12 @@
+import asyncio
 import time
 import requests
 from requests import exceptions as reqexcept
 from .verifier import Verifier
 from .global_storage import Globals
+from .backoff import Backoff
+from .aio_http import HttpError
+from .verifier_engine import get_engine
 
 class HttpOkVerifier(Verifier):
 	def __init__(self, **kwargs):
@@ -10,12 +14,13 @@ class HttpOkVerifier(Verifier):
 		self.timeout = 30
 		self.interval = 1
 		self.headers = {}
+		self.backoff = Backoff()
 
 		if "url" in kwargs:
 			self.url = kwargs["url"]
 
 		if "timeout" in kwargs:
-			self.timeout = kwars["timeout"]
+			self.timeout = kwargs["timeout"]
 
 		if "interval" in kwargs:
 			self.interval = kwargs["interval"]
@@ -23,20 +28,44 @@ class HttpOkVerifier(Verifier):
 		if "headers" in kwargs:
 			self.headers = kwargs["headers"]
 
+		if "backoff" in kwargs:
+			self.backoff = Backoff(**kwargs["backoff"])
+
 	def run(self, proc):
-		passed = False
 		timeout_at = time.time() + self.timeout
-		while not passed and time.time() < timeout_at:
+		delays = self.backoff.delays()
+		while time.time() < timeout_at:
 			try:
 				self.log_verbose("Attempting connection to {0} with a timeout of {1}s".format(self.url, self.interval))
 				resp = requests.get(self.url, headers=self.headers, timeout=self.interval)
 				if resp.status_code >= 200 and resp.status_code < 300:
-					passed = True
-				else:
-					self.log_fail("Got status {0} from server.".format(resp.status_code))
-			except reqexcept.ConnectionError as e:
+					return True
+				self.log_fail("Got status {0} from server.".format(resp.status_code))
+			except reqexcept.RequestException as e:
+				self.log_fail("Connection error: {0}".format(e))
+			if Globals.shutdown:
+				return False
+			# Refused connections fail at once, waiting keeps the loop from spinning.
+			time.sleep(max(0, min(next(delays), timeout_at - time.time())))
+		return False
+
+	async def arun(self, proc):
+		pool = get_engine().http
+		loop = asyncio.get_event_loop()
+		timeout_at = loop.time() + self.timeout
+		delays = self.backoff.delays()
+		while loop.time() < timeout_at:
+			try:
+				self.log_verbose("Attempting connection to {0} with a timeout of {1}s".format(self.url, self.interval))
+				resp = await pool.get(self.url, self.headers, self.interval)
+				if resp.status_code >= 200 and resp.status_code < 300:
+					return True
+				self.log_fail("Got status {0} from server.".format(resp.status_code))
+			except asyncio.TimeoutError:
+				self.log_fail("Connection to {0} timed out after {1}s".format(self.url, self.interval))
+			except (OSError, HttpError) as e:
 				self.log_fail("Connection error: {0}".format(e))
-				pass
 			if Globals.shutdown:
 				return False
-		return passed
+			await asyncio.sleep(max(0, min(next(delays), timeout_at - loop.time())))
+		return False
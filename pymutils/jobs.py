@@ -0,0 +1,89 @@
+import collections
+import sys
+import threading
+import time
+from .debug import log
+from .events import emit
+
+class Job:
+	"""A long running operation executed in the background, such as a restart or a shutdown."""
+
+	def __init__(self, internalId, kind, func, args):
+		self.internalId = internalId
+		self.kind = kind
+		self.func = func
+		self.args = args
+		self.status = "pending"
+		self.created = time.time()
+		self.started = None
+		self.finished = None
+		self.result = None
+		self.error = None
+		self.steps = []
+
+	def step(self, description, started, **kwargs):
+		"""Records a finished step of the job, started at the given time."""
+		data = {"step": description, "seconds": round(time.time() - started, 3)}
+		data.update(kwargs)
+		self.steps.append(data)
+
+	def run(self):
+		self.status = "running"
+		self.started = time.time()
+		try:
+			self.result = self.func(self, *self.args)
+			self.status = "succeeded"
+		except Exception as e:
+			etype, _, _ = sys.exc_info()
+			self.error = "{0}: {1}".format(etype.__name__, e)
+			self.status = "failed"
+			# Jobs started by a signal have nobody polling them, so failures are reported here.
+			log("[WARNING] {0} job {1} failed: {2}".format(self.kind, self.internalId, self.error))
+			emit("job.failed", id=self.internalId, job=self.kind, error=self.error)
+		self.finished = time.time()
+
+	def get_data(self):
+		data = {
+			"id": self.internalId,
+			"kind": self.kind,
+			"status": self.status,
+			"steps": self.steps,
+		}
+		if self.finished is not None:
+			data["seconds"] = round(self.finished - self.started, 3)
+		if self.result is not None:
+			data["result"] = self.result
+		if self.error is not None:
+			data["error"] = self.error
+		return data
+
+class JobManager:
+	"""Runs jobs on their own threads and keeps the most recent ones for status queries."""
+
+	def __init__(self, keep=100):
+		self.keep = keep
+		self.lock = threading.Lock()
+		self.jobs = collections.OrderedDict()
+		self.next_id = 1
+
+	def submit(self, kind, func, *args):
+		"""Starts func(job, *args) in the background and returns the job."""
+		with self.lock:
+			job = Job(self.next_id, kind, func, args)
+			self.next_id += 1
+			self.jobs[job.internalId] = job
+			while len(self.jobs) > self.keep:
+				self.jobs.popitem(last=False)
+		thread = threading.Thread(target=job.run)
+		thread.daemon = True
+		thread.start()
+		return job
+
+	def get(self, internalId):
+		return self.jobs.get(internalId)
+
+	def __iter__(self):
+		with self.lock:
+			return iter(list(self.jobs.values()))
+
+jobs = JobManager()
@@ -0,0 +1,109 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .global_storage import Globals
+from .debug import verbose, debug
+
+class DependencyError(Exception):
+	def __init__(self, message):
+		self.message = message
+
+	def __str__(self):
+		return self.message
+
+class Launcher:
+	"""Launches processes concurrently, following the dependency graph between them.
+
+	Every process whose dependencies are satisfied is launched at once. A process
+	counts as satisfied when its factory returns, which for a Process means its
+	verifier passed, or when it is listed in satisfied, as processes which are
+	already running. A factory may return a concurrent future instead, as
+	Process.verify() does, and is satisfied once it resolves; the workers only
+	start processes, so max_workers defaults to a small pool.
+	"""
+
+	def __init__(self, max_workers=None, satisfied=()):
+		self.max_workers = max_workers
+		self.satisfied = set(satisfied)
+		self.factories = {}
+		self.dependencies = {}
+		self.timings = {}
+
+	def add(self, name, factory, depends_on=None):
+		if name in self.factories:
+			raise DependencyError("Process {0} is defined twice.".format(name))
+		self.factories[name] = factory
+		self.dependencies[name] = [dep for dep in depends_on or [] if dep not in self.satisfied]
+
+	def order(self):
+		"""Returns the launch waves of the graph, raising DependencyError for missing or cyclic dependencies."""
+		remaining = {}
+		for name, deps in self.dependencies.items():
+			for dep in deps:
+				if dep not in self.factories:
+					raise DependencyError("Process {0} depends on undefined process {1}.".format(name, dep))
+			remaining[name] = set(deps)
+		waves = []
+		while remaining:
+			ready = [name for name, deps in remaining.items() if not deps]
+			if not ready:
+				raise DependencyError("Dependency cycle between processes: {0}.".format(", ".join(sorted(remaining))))
+			for name in ready:
+				del remaining[name]
+			for deps in remaining.values():
+				deps.difference_update(ready)
+			waves.append(ready)
+		return waves
+
+	def run(self):
+		"""Launches every process and returns the results of the factories by name.
+
+		If a factory raises, no further processes are launched, the processes already
+		launching are allowed to finish and the first exception is re-raised.
+		"""
+		self.order()
+		waiting = dict((name, set(deps)) for name, deps in self.dependencies.items())
+		dependents = dict((name, []) for name in self.factories)
+		for name, deps in self.dependencies.items():
+			for dep in deps:
+				dependents[dep].append(name)
+
+		results = {}
+		started = {}
+		futures = {}
+		error = None
+		workers = self.max_workers or max(1, min(len(self.factories), 32, (os.cpu_count() or 1) * 4))
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			def submit_ready():
+				for name in [name for name, deps in waiting.items() if not deps]:
+					del waiting[name]
+					debug("Dependencies of process {0} are satisfied, launching.".format(name))
+					started[name] = time.time()
+					futures[pool.submit(self.factories[name])] = name
+
+			submit_ready()
+			while futures:
+				done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+				for future in done:
+					name = futures.pop(future)
+					try:
+						result = future.result()
+					except Exception as e:
+						self.timings[name] = time.time() - started[name]
+						if error is None:
+							error = e
+						continue
+					if isinstance(result, Future):
+						# Started, waits for the process to be ready without holding a worker.
+						futures[result] = name
+						continue
+					self.timings[name] = time.time() - started[name]
+					results[name] = result
+					verbose("Process {0} is ready after {1:.2f}s.".format(name, self.timings[name]))
+					for dependent in dependents[name]:
+						waiting[dependent].discard(name)
+				if error is None and not Globals.shutdown:
+					submit_ready()
+		if error is not None:
+			raise error
+		return results
@@ -0,0 +1,205 @@
+import ctypes
+import os
+import platform
+import resource
+from .debug import log, debug
+
+# Limit name and the resource it sets.
+RLIMITS = (
+	("address_space", resource.RLIMIT_AS),
+	("open_files", resource.RLIMIT_NOFILE),
+	("cpu_seconds", resource.RLIMIT_CPU),
+	("processes", resource.RLIMIT_NPROC),
+	("file_size", resource.RLIMIT_FSIZE),
+	("core_size", resource.RLIMIT_CORE),
+)
+
+IOPRIO_CLASSES = {"none": 0, "realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# ioprio_set and ioprio_get syscall numbers by architecture.
+IOPRIO_SYSCALLS = {
+	"x86_64": (251, 252),
+	"i386": (289, 290),
+	"i686": (289, 290),
+	"aarch64": (30, 31),
+	"armv7l": (314, 315),
+	"ppc64le": (273, 274),
+	"s390x": (282, 283),
+}
+
+_libc = None
+
+def libc():
+	global _libc
+	if _libc is None:
+		_libc = ctypes.CDLL(None, use_errno=True)
+		_libc.syscall
+	return _libc
+
+def ioprio_syscall(index, *args):
+	"""Calls ioprio_set (index 0) or ioprio_get (index 1), raising OSError on failure."""
+	numbers = IOPRIO_SYSCALLS.get(platform.machine())
+	if numbers is None:
+		raise OSError("ioprio syscalls are not known on {0}.".format(platform.machine()))
+	result = libc().syscall(numbers[index], *args)
+	if result < 0:
+		errno = ctypes.get_errno()
+		raise OSError(errno, os.strerror(errno))
+	return result
+
+def rlimit_value(value):
+	if value == "unlimited" or value is None:
+		return resource.RLIM_INFINITY
+	return int(value)
+
+def rlimit_repr(value):
+	return "unlimited" if value == resource.RLIM_INFINITY else value
+
+def cpu_max_value(value):
+	"""Converts a cpu_max setting, either a number of CPUs or the raw "quota period" string, to cpu.max contents."""
+	if isinstance(value, str):
+		return value
+	return "{0} 100000".format(int(float(value) * 100000))
+
+# File descriptors kept for the HTTP service, log files and the manager itself.
+FD_RESERVE = 64
+
+def fd_budget(procdefs):
+	"""Returns the number of file descriptors the manager needs to run the process definitions.
+
+	Every process takes a pidfd for supervision and one more while it is
+	stopped, plus one per pipe: its output when it is captured, and its
+	standard input when the stdin option is set, and one per listening socket.
+	"""
+	needed = FD_RESERVE
+	for procdef in procdefs:
+		options = procdef.get("options", {})
+		needed += 2
+		if options.get("suppress_output", False) or "redirect_output" in options:
+			needed += 1
+		if options.get("stdin", False):
+			needed += 1
+		needed += len(options.get("sockets", []))
+	return needed
+
+def ensure_fd_budget(needed):
+	"""Raises the soft open files limit of the manager to needed if it is lower, up to the hard limit.
+
+	Raises ValueError if the hard limit is too low.
+	"""
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+	if soft != resource.RLIM_INFINITY and soft < needed:
+		if hard != resource.RLIM_INFINITY and hard < needed:
+			raise ValueError("The processes need {0} file descriptors, but the open files limit is {1}.".format(needed, hard))
+		resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+		debug("Raised the open files limit from {0} to {1}.".format(soft, needed))
+
+class ProcessLimits:
+	"""Resource limits and scheduling settings of a process, applied in the child before exec.
+
+	limits maps the names in RLIMITS to a number, "unlimited" or a [soft, hard]
+	pair. scheduling may set nice, ionice (a class name or an object with class
+	and level), cpu_affinity, and cpu_max and memory_max, which are written to
+	the cgroup of the process when it has one.
+	"""
+
+	def __init__(self, limits=None, scheduling=None):
+		limits = limits or {}
+		scheduling = scheduling or {}
+		names = dict(RLIMITS)
+		self.rlimits = []
+		for name, value in limits.items():
+			if name not in names:
+				raise ValueError("Unknown limit '{0}', must be one of {1}.".format(name, ", ".join(n for n, _ in RLIMITS)))
+			if isinstance(value, list):
+				soft, hard = rlimit_value(value[0]), rlimit_value(value[1])
+			else:
+				soft = hard = rlimit_value(value)
+			self.rlimits.append((names[name], soft, hard))
+
+		self.nice = None
+		self.ioprio = None
+		self.cpu_affinity = None
+		self.cgroup_files = {}
+
+		if "nice" in scheduling:
+			self.nice = int(scheduling["nice"])
+
+		if "ionice" in scheduling:
+			ionice = scheduling["ionice"]
+			if not isinstance(ionice, dict):
+				ionice = {"class": ionice}
+			ioclass = ionice.get("class", "best-effort")
+			if ioclass not in IOPRIO_CLASSES:
+				raise ValueError("Invalid ionice class '{0}', must be one of {1}.".format(ioclass, ", ".join(IOPRIO_CLASSES)))
+			level = int(ionice.get("level", 4))
+			if level < 0 or level > 7:
+				raise ValueError("Invalid ionice level {0}, must be between 0 and 7.".format(level))
+			self.ioprio = (IOPRIO_CLASSES[ioclass] << IOPRIO_CLASS_SHIFT) | level
+			# Loaded here, the child must not load libraries between fork and exec.
+			libc()
+
+		if "cpu_affinity" in scheduling:
+			if not isinstance(scheduling["cpu_affinity"], list):
+				raise ValueError("Invalid cpu_affinity '{0}', must be a list of cores.".format(scheduling["cpu_affinity"]))
+			self.cpu_affinity = set(scheduling["cpu_affinity"])
+
+		if "cpu_max" in scheduling:
+			self.cgroup_files["cpu.max"] = cpu_max_value(scheduling["cpu_max"])
+
+		if "memory_max" in scheduling:
+			self.cgroup_files["memory.max"] = str(scheduling["memory_max"])
+
+	def configured(self):
+		return bool(self.rlimits) or self.nice is not None or self.ioprio is not None or self.cpu_affinity is not None or bool(self.cgroup_files)
+
+	def configure_cgroup(self, path, controllers=None):
+		"""Writes the cgroup limits into the cgroup at path before the process joins it, only those of the given controllers if set."""
+		for name, value in self.cgroup_files.items():
+			if controllers is not None and name.split(".")[0] not in controllers:
+				continue
+			try:
+				with open(os.path.join(path, name), "w") as f:
+					f.write(value)
+			except OSError as e:
+				log("[WARNING] could not set {0} of cgroup {1}: {2}".format(name, path, e))
+
+	def apply(self):
+		"""Applies the limits to the calling process. Runs in the child, between fork and exec."""
+		for limit, soft, hard in self.rlimits:
+			resource.setrlimit(limit, (soft, hard))
+		if self.nice is not None:
+			os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+		if self.ioprio is not None:
+			ioprio_syscall(0, IOPRIO_WHO_PROCESS, 0, self.ioprio)
+		if self.cpu_affinity is not None:
+			os.sched_setaffinity(0, self.cpu_affinity)
+
+def effective_limits(pid, cgroup=None):
+	"""Reads the limits and scheduling settings a running process actually has."""
+	data = {"limits": {}, "scheduling": {}}
+	try:
+		for name, limit in RLIMITS:
+			soft, hard = resource.prlimit(pid, limit)
+			data["limits"][name] = [rlimit_repr(soft), rlimit_repr(hard)]
+		scheduling = data["scheduling"]
+		scheduling["nice"] = os.getpriority(os.PRIO_PROCESS, pid)
+		scheduling["cpu_affinity"] = sorted(os.sched_getaffinity(pid))
+	except (OSError, AttributeError):
+		return data
+	try:
+		ioprio = ioprio_syscall(1, IOPRIO_WHO_PROCESS, pid)
+		classes = dict((number, name) for name, number in IOPRIO_CLASSES.items())
+		scheduling["ionice"] = {"class": classes.get(ioprio >> IOPRIO_CLASS_SHIFT, "none"), "level": ioprio & ((1 << IOPRIO_CLASS_SHIFT) - 1)}
+	except OSError:
+		pass
+	if cgroup is not None:
+		for name, key in (("cpu.max", "cpu_max"), ("memory.max", "memory_max")):
+			try:
+				with open(os.path.join(cgroup, name)) as f:
+					scheduling[key] = f.read().strip()
+			except OSError:
+				pass
+	return data
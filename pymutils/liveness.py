@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+from .global_storage import Globals
+from .verifier_engine import get_engine
+from .scheduler import get_scheduler
+from .debug import log, verbose
+from .events import emit
+from .snapshot import state_changed
+
+class LivenessCheck:
+	"""Runs a verifier against a running process every period seconds.
+
+	A check fails if the verifier does not pass within timeout seconds. After
+	failure_threshold consecutive failures, the process is restarted (action
+	restart) or reported unhealthy until a check passes again (action mark).
+	Checks are timed on the shared scheduler against their planned time, so they
+	do not drift, and a check still running when the next one is due skips it.
+	"""
+
+	ACTIONS = ("restart", "mark")
+
+	def __init__(self, proc, verifier, **kwargs):
+		self.proc = proc
+		self.verifier = verifier
+		self.period = 10.0
+		self.timeout = 5.0
+		self.failure_threshold = 3
+		self.action = "restart"
+		self.initial_delay = None
+
+		if "period" in kwargs:
+			self.period = float(kwargs["period"])
+			if self.period <= 0:
+				raise ValueError("Invalid liveness period {0}, must be positive.".format(self.period))
+
+		if "timeout" in kwargs:
+			self.timeout = float(kwargs["timeout"])
+
+		if "failure_threshold" in kwargs:
+			self.failure_threshold = max(1, int(kwargs["failure_threshold"]))
+
+		if "action" in kwargs:
+			self.action = kwargs["action"]
+			if self.action not in LivenessCheck.ACTIONS:
+				raise ValueError("Invalid liveness action '{0}', must be one of {1}.".format(self.action, ", ".join(LivenessCheck.ACTIONS)))
+
+		if "initial_delay" in kwargs:
+			self.initial_delay = float(kwargs["initial_delay"])
+
+		self.health = "unknown"
+		self.failures = 0
+		self.last_failure = None
+		self.running = False
+		self.stopped = False
+		self.timer = None
+		self.due = None
+
+	def start(self):
+		self.verifier.process = self.proc
+		delay = self.period if self.initial_delay is None else self.initial_delay
+		self.due = time.monotonic() + delay
+		self.timer = get_scheduler().call_at(self.due, self.run)
+
+	def stop(self):
+		self.stopped = True
+		if self.timer is not None:
+			get_scheduler().cancel(self.timer)
+
+	def active(self):
+		"""Returns whether the check still applies: the process is managed, running and not being restarted."""
+		from .process import Process
+		if self.stopped or Globals.shutdown or Process.processes.get(self.proc.internalId) is not self.proc:
+			self.stopped = True
+			return False
+		return not self.proc.stopped and not self.proc.restart_lock.locked() and self.proc.proc is not None and self.proc.proc.poll() is None
+
+	def schedule(self):
+		if self.stopped:
+			return
+		self.due += self.period
+		now = time.monotonic()
+		if self.due < now:
+			# Fell behind, skips the missed checks rather than running them in a burst.
+			self.due += ((now - self.due) // self.period + 1) * self.period
+		self.timer = get_scheduler().call_at(self.due, self.run)
+
+	def run(self):
+		try:
+			if self.running or not self.active():
+				return
+			self.running = True
+			started = time.monotonic()
+			future = get_engine().submit(asyncio.wait_for(self.verifier.arun(self.proc), self.timeout))
+			future.add_done_callback(lambda future: self.done(future, started))
+		finally:
+			self.schedule()
+
+	def done(self, future, started):
+		# Called on the verifier engine loop: a passing check of a healthy process has nothing
+		# left to do, anything else is handled on a worker.
+		if self.health == "healthy" and not self.failures and not future.cancelled() and future.exception() is None and future.result():
+			self.running = False
+			return
+		get_scheduler().pool.submit(self.finish, future, started)
+
+	def finish(self, future, started):
+		try:
+			passed = bool(future.result())
+		except Exception:
+			passed = False
+		self.running = False
+		if not self.active():
+			return
+		if passed:
+			if self.failures:
+				self.failures = 0
+				state_changed()
+			self.set_health("healthy")
+			return
+		self.failures += 1
+		self.last_failure = time.time()
+		state_changed()
+		emit("liveness.fail", id=self.proc.internalId, name=self.proc.name, failures=self.failures, seconds=round(time.monotonic() - started, 3))
+		if self.failures < self.failure_threshold:
+			return
+		if self.action == "mark":
+			self.set_health("unhealthy")
+			return
+		log("[WARNING] Process {0} failed {1} liveness checks, restarting.".format(self.proc.name or self.proc.cmdString, self.failures))
+		emit("liveness.restart", id=self.proc.internalId, name=self.proc.name, failures=self.failures)
+		self.failures = 0
+		self.set_health("unknown")
+		# On its own thread like automatic restarts, the workers only run checks.
+		thread = threading.Thread(target=self.restart)
+		thread.daemon = True
+		thread.start()
+
+	def restart(self):
+		previous = self.proc.proc
+		try:
+			self.proc.restart(Globals.terminate_time_allowed)
+		except Exception as e:
+			log("[WARNING] Liveness restart of process {0} failed: {1}".format(self.proc.name or self.proc.cmdString, e))
+			if self.proc.proc is previous:
+				# A failed socket handoff keeps the previous incarnation running.
+				return
+			# The new incarnation never passed its verifier; it is marked failed first, so its exit does not restart it.
+			self.proc.failed = True
+			self.proc.force_terminate(Globals.terminate_time_allowed)
+			emit("process.failed", id=self.proc.internalId, name=self.proc.name, failures=self.proc.failures)
+			state_changed()
+
+	def set_health(self, health):
+		if self.health != health:
+			verbose("Process {0} is {1}.".format(self.proc.name or self.proc.cmdString, health))
+			self.health = health
+			emit("liveness.health", id=self.proc.internalId, name=self.proc.name, health=health)
+			state_changed()
+
+	def get_data(self):
+		# Passing checks do not change the state, so GET / is not rendered again for every check.
+		return {"failures": self.failures, "last_failure": self.last_failure}
@@ -0,0 +1,160 @@
+import gzip
+import os
+import shutil
+import threading
+import time
+from .global_storage import Globals
+
+class LogSink:
+	"""A log file written in batches by a background thread, with optional rotation.
+
+	Writes are buffered in memory and flushed once flush_bytes are pending or
+	flush_interval seconds passed. The file is rotated once it grows past
+	max_bytes or gets older than max_age seconds, keeping the given number of
+	backups, which are gzipped if compress is set.
+	"""
+
+	def __init__(self, path, **kwargs):
+		self.path = path
+		self.flush_bytes = 65536
+		self.flush_interval = 1.0
+		self.max_bytes = 0
+		self.max_age = 0
+		self.backups = 5
+		self.compress = False
+
+		if "flush_bytes" in kwargs:
+			self.flush_bytes = int(kwargs["flush_bytes"])
+
+		if "flush_interval" in kwargs:
+			self.flush_interval = float(kwargs["flush_interval"])
+
+		if "max_bytes" in kwargs:
+			self.max_bytes = int(kwargs["max_bytes"])
+
+		if "max_age" in kwargs:
+			self.max_age = float(kwargs["max_age"])
+
+		if "backups" in kwargs:
+			self.backups = int(kwargs["backups"])
+
+		if "compress" in kwargs:
+			self.compress = bool(kwargs["compress"])
+
+		self.pending = []
+		self.pending_bytes = 0
+		self.closed = False
+		self.condition = threading.Condition()
+		self.write_lock = threading.Lock()
+		self.file = None
+		self._open()
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _open(self):
+		self.file = open(self.path, "ab")
+		self.size = self.file.tell()
+		self.opened_at = time.time()
+
+	def write(self, data):
+		if isinstance(data, str):
+			data = data.encode("utf-8")
+		with self.condition:
+			if self.closed:
+				# Output arriving after shutdown has nowhere to go.
+				return
+			self.pending.append(data)
+			self.pending_bytes += len(data)
+			if len(self.pending) == 1 or self.pending_bytes >= self.flush_bytes:
+				self.condition.notify()
+
+	append = write
+
+	def _take(self):
+		data = b"".join(self.pending)
+		self.pending = []
+		self.pending_bytes = 0
+		return data
+
+	def _run(self):
+		while True:
+			with self.condition:
+				if not self.closed and not self.pending:
+					self.condition.wait()
+				if not self.closed and self.pending_bytes < self.flush_bytes:
+					self.condition.wait(self.flush_interval)
+				closed = self.closed
+			self.flush()
+			if closed:
+				return
+
+	def _write(self, data):
+		self.file.write(data)
+		self.file.flush()
+		self.size += len(data)
+		if (self.max_bytes and self.size >= self.max_bytes) or (self.max_age and time.time() - self.opened_at >= self.max_age):
+			self._rotate()
+
+	def _backup_name(self, index):
+		name = "{0}.{1}".format(self.path, index)
+		if self.compress:
+			name += ".gz"
+		return name
+
+	def _rotate(self):
+		self.file.close()
+		if self.backups > 0:
+			for index in range(self.backups - 1, 0, -1):
+				if os.path.exists(self._backup_name(index)):
+					os.replace(self._backup_name(index), self._backup_name(index + 1))
+			if self.compress:
+				with open(self.path, "rb") as source, gzip.open(self._backup_name(1), "wb") as target:
+					shutil.copyfileobj(source, target)
+				os.remove(self.path)
+			else:
+				os.replace(self.path, self._backup_name(1))
+		else:
+			os.remove(self.path)
+		self._open()
+
+	def flush(self):
+		with self.write_lock:
+			with self.condition:
+				data = self._take()
+			if data:
+				self._write(data)
+
+	def close(self):
+		with self.condition:
+			if self.closed:
+				return
+			self.closed = True
+			self.condition.notify()
+		self.thread.join()
+		self.file.close()
+
+_sinks_lock = threading.Lock()
+
+def open_sink(path):
+	"""Returns the shared sink writing to path, opening it with the global logging options on first use."""
+	key = os.path.abspath(path)
+	with _sinks_lock:
+		if key not in Globals.log_sinks or Globals.log_sinks[key].closed:
+			Globals.log_sinks[key] = LogSink(path, **Globals.log_options)
+		return Globals.log_sinks[key]
+
+def rotates(options):
+	"""Returns whether the logging options rotate files, which only the manager writing them can do."""
+	return bool(options.get("max_bytes")) or bool(options.get("max_age"))
+
+def open_direct(path):
+	"""Returns a file descriptor appending to path, for a process to write its output to without the manager."""
+	return os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+
+def close_sinks():
+	with _sinks_lock:
+		sinks = list(Globals.log_sinks.values())
+		Globals.log_sinks = {}
+	for sink in sinks:
+		sink.close()
@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from array import array
+from .snapshot import state_changed
+from .process import Process
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Field name, Prometheus metric name, metric type and help text.
+FIELDS = (
+	("cpu_seconds", "pymanager_process_cpu_seconds_total", "counter", "User and system CPU time spent."),
+	("cpu_percent", "pymanager_process_cpu_percent", "gauge", "CPU usage over the last sampling interval."),
+	("rss_bytes", "pymanager_process_resident_memory_bytes", "gauge", "Resident memory size."),
+	("vms_bytes", "pymanager_process_virtual_memory_bytes", "gauge", "Virtual memory size."),
+	("threads", "pymanager_process_threads", "gauge", "Number of threads."),
+	("open_fds", "pymanager_process_open_fds", "gauge", "Number of open file descriptors."),
+	("read_bytes", "pymanager_process_read_bytes_total", "counter", "Bytes read from storage."),
+	("write_bytes", "pymanager_process_write_bytes_total", "counter", "Bytes written to storage."),
+	("processes", "pymanager_process_tree_processes", "gauge", "Number of processes sampled, including descendants."),
+)
+
+# The metric reporting the time of the latest sample of each process.
+SAMPLED_AT = "pymanager_process_last_sample_timestamp_seconds"
+
+# Fields which also keep a rolling window of samples.
+WINDOWED = ("cpu_percent", "rss_bytes")
+
+def read_stat(pid):
+	"""Returns the parent pid, CPU seconds and thread count of a process from /proc/<pid>/stat."""
+	with open("/proc/{0}/stat".format(pid), "rb") as f:
+		data = f.read()
+	# The command name may contain spaces and parentheses, fields start after the last one.
+	fields = data[data.rindex(b")") + 2:].split()
+	return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[17])
+
+def read_statm(pid):
+	with open("/proc/{0}/statm".format(pid), "rb") as f:
+		fields = f.read().split()
+	return int(fields[0]) * PAGE_SIZE, int(fields[1]) * PAGE_SIZE
+
+def read_io(pid):
+	read_bytes = write_bytes = 0
+	try:
+		with open("/proc/{0}/io".format(pid), "rb") as f:
+			for line in f:
+				if line.startswith(b"read_bytes:"):
+					read_bytes = int(line.split()[1])
+				elif line.startswith(b"write_bytes:"):
+					write_bytes = int(line.split()[1])
+	except (PermissionError, FileNotFoundError):
+		pass
+	return read_bytes, write_bytes
+
+def count_fds(pid):
+	try:
+		return len(os.listdir("/proc/{0}/fd".format(pid)))
+	except (PermissionError, FileNotFoundError):
+		return 0
+
+def children_map():
+	"""Maps every pid on the system to the list of its child pids, in one pass over /proc."""
+	children = {}
+	for entry in os.listdir("/proc"):
+		if not entry.isdigit():
+			continue
+		try:
+			ppid = read_stat(entry)[0]
+		except (OSError, ValueError, IndexError):
+			continue
+		children.setdefault(ppid, []).append(int(entry))
+	return children
+
+class ResourceSampler:
+	"""Samples the resource usage of every managed process at a fixed interval.
+
+	Values are kept in flat arrays indexed by a slot per process: the latest
+	value of every field, and a ring of the last window samples of the fields
+	in WINDOWED, stored as window consecutive entries per slot. The slots of
+	processes no longer managed are reused.
+	"""
+
+	def __init__(self, interval=5, window=12, descendants=False):
+		self.interval = interval
+		self.window = window
+		self.descendants = descendants
+		self.lock = threading.Lock()
+		self.slots = {}
+		self.free = []
+		self.pids = array("q")
+		self.sampled_at = array("d")
+		self.samples = array("q")
+		self.latest = dict((field[0], array("d")) for field in FIELDS)
+		self.windows = dict((field, array("d")) for field in WINDOWED)
+		self.thread = None
+		self.stopped = threading.Event()
+
+	def start(self):
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+
+	def _run(self):
+		next_at = time.time()
+		while not self.stopped.is_set():
+			self.sample()
+			next_at += self.interval
+			self.stopped.wait(max(0, next_at - time.time()))
+
+	def _slot(self, proc):
+		slot = self.slots.get(proc.internalId)
+		if slot is None and self.free:
+			slot = self.free.pop()
+			self.slots[proc.internalId] = slot
+			self.pids[slot] = 0
+			self.samples[slot] = 0
+		elif slot is None:
+			slot = len(self.pids)
+			self.slots[proc.internalId] = slot
+			self.pids.append(0)
+			self.sampled_at.append(0)
+			self.samples.append(0)
+			for values in self.latest.values():
+				values.append(0)
+			for values in self.windows.values():
+				values.extend([0] * self.window)
+		return slot
+
+	def _measure(self, pids):
+		totals = dict((field[0], 0) for field in FIELDS)
+		for pid in pids:
+			try:
+				_, cpu, threads = read_stat(pid)
+				vms, rss = read_statm(pid)
+			except (OSError, ValueError, IndexError):
+				continue
+			read_bytes, write_bytes = read_io(pid)
+			totals["cpu_seconds"] += cpu
+			totals["threads"] += threads
+			totals["vms_bytes"] += vms
+			totals["rss_bytes"] += rss
+			totals["read_bytes"] += read_bytes
+			totals["write_bytes"] += write_bytes
+			totals["open_fds"] += count_fds(pid)
+			totals["processes"] += 1
+		return totals
+
+	def sample(self):
+		"""Samples every running managed process in one pass."""
+		running = []
+		for proc in Process.processes:
+			if proc.proc is not None and proc.proc.returncode is None:
+				running.append(proc)
+		children = children_map() if self.descendants else {}
+		now = time.time()
+		changed = False
+		with self.lock:
+			for internalId in [i for i in self.slots if Process.processes.get(i) is None]:
+				self.free.append(self.slots.pop(internalId))
+			for proc in running:
+				pid = proc.proc.pid
+				pids = [pid]
+				if self.descendants:
+					for parent in pids:
+						pids.extend(children.get(parent, []))
+				totals = self._measure(pids)
+				slot = self._slot(proc)
+				cpu = self.latest["cpu_seconds"]
+				if self.pids[slot] == pid and self.samples[slot] > 0:
+					elapsed = now - self.sampled_at[slot]
+					totals["cpu_percent"] = max(0, totals["cpu_seconds"] - cpu[slot]) / elapsed * 100 if elapsed > 0 else 0
+				else:
+					self.samples[slot] = 0
+				position = slot * self.window + self.samples[slot] % self.window
+				# GET / is only rendered again when a value it reports changes: a new or
+				# warming up window, a latest value, or the window value being replaced.
+				if self.samples[slot] < self.window:
+					changed = True
+				elif any(values[slot] != totals[field] for field, values in self.latest.items()):
+					changed = True
+				elif any(values[position] != totals[field] for field, values in self.windows.items()):
+					changed = True
+				self.pids[slot] = pid
+				self.sampled_at[slot] = now
+				for field, values in self.latest.items():
+					values[slot] = totals[field]
+				for field, values in self.windows.items():
+					values[position] = totals[field]
+				self.samples[slot] += 1
+		if changed:
+			state_changed()
+
+	def get(self, proc):
+		"""Returns the latest values and window averages and maxima of the process, or None if never sampled."""
+		with self.lock:
+			slot = self.slots.get(proc.internalId)
+			if slot is None or self.samples[slot] == 0:
+				return None
+			data = dict((field, values[slot]) for field, values in self.latest.items())
+			count = min(self.samples[slot], self.window)
+			for field, values in self.windows.items():
+				recent = values[slot * self.window:slot * self.window + count]
+				data[field + "_avg"] = sum(recent) / count
+				data[field + "_max"] = max(recent)
+		# The sample time is left out, as GET / is not rendered again for samples which changed nothing; /metrics reports it.
+		return data
+
+	def prometheus(self):
+		"""Renders the latest values of the running processes in the Prometheus text format."""
+		running = []
+		for proc in Process.processes:
+			if proc.proc is not None and proc.proc.returncode is None and proc.internalId in self.slots:
+				running.append(proc)
+		lines = []
+		with self.lock:
+			for field, name, kind, description in FIELDS:
+				lines.append("# HELP {0} {1}".format(name, description))
+				lines.append("# TYPE {0} {1}".format(name, kind))
+				values = self.latest[field]
+				for proc in running:
+					lines.append("{0}{{{1}}} {2}".format(name, labels(proc), repr(values[self.slots[proc.internalId]])))
+			lines.append("# HELP {0} {1}".format(SAMPLED_AT, "Time of the latest sample, in seconds since the epoch."))
+			lines.append("# TYPE {0} gauge".format(SAMPLED_AT))
+			for proc in running:
+				lines.append("{0}{{{1}}} {2}".format(SAMPLED_AT, labels(proc), repr(self.sampled_at[self.slots[proc.internalId]])))
+		return "\n".join(lines) + "\n"
+
+def escape_label(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def labels(proc):
+	result = 'id="{0}"'.format(proc.internalId)
+	if proc.name is not None:
+		result += ',name="{0}"'.format(escape_label(proc.name))
+	return result
@@ -0,0 +1,187 @@
+import os
+import selectors
+import threading
+from .global_storage import Globals
+
+class RingBuffer:
+	"""Keeps the last size bytes written to it.
+
+	Listeners added with subscribe() are called with every chunk appended, while
+	the buffer is locked, so they must return quickly.
+	"""
+
+	def __init__(self, size):
+		self.size = max(1, int(size))
+		self.data = bytearray(self.size)
+		self.pos = 0
+		self.full = False
+		self.total = 0
+		self.listeners = []
+		self.lock = threading.Lock()
+
+	def append(self, chunk):
+		with self.lock:
+			self._append(chunk)
+			for listener in self.listeners:
+				listener(chunk)
+
+	def _append(self, chunk):
+		self.total += len(chunk)
+		if len(chunk) >= self.size:
+			self.data[:] = chunk[-self.size:]
+			self.pos = 0
+			self.full = True
+			return
+		end = self.pos + len(chunk)
+		if end <= self.size:
+			self.data[self.pos:end] = chunk
+		else:
+			split = self.size - self.pos
+			self.data[self.pos:] = chunk[:split]
+			self.data[:end - self.size] = chunk[split:]
+			self.full = True
+		self.pos = end % self.size
+		if self.pos == 0:
+			self.full = True
+
+	def _value(self):
+		if not self.full:
+			return bytes(self.data[:self.pos])
+		return bytes(self.data[self.pos:] + self.data[:self.pos])
+
+	def getvalue(self):
+		with self.lock:
+			return self._value()
+
+	def subscribe(self, listener, since=0):
+		"""Adds a listener and returns what was written after the first since bytes and is still kept, atomically."""
+		with self.lock:
+			self.listeners.append(listener)
+			count = self.total - since
+			if count <= 0:
+				return b""
+			return self._value()[-count:]
+
+	def unsubscribe(self, listener):
+		with self.lock:
+			if listener in self.listeners:
+				self.listeners.remove(listener)
+
+	def tail(self, lines=None):
+		"""Returns the last lines of the buffer as strings, or all of it if lines is None."""
+		data = self.getvalue()
+		if self.total > self.size:
+			# The first line was cut off by the buffer wrapping around.
+			data = data[data.find(b"\n") + 1:]
+		result = data.decode("utf-8", "replace").splitlines()
+		if lines is not None:
+			result = result[-lines:] if lines > 0 else []
+		return result
+
+class OutputMultiplexer:
+	"""Drains the output pipes of all processes from a single thread.
+
+	Children never block on a full pipe, as everything they write is read as soon
+	as it arrives and kept in the bounded ring buffer of the process.
+	"""
+
+	def __init__(self):
+		self.selector = selectors.DefaultSelector()
+		self.lock = threading.Lock()
+		self.pending = []
+		self.wake_r, self.wake_w = os.pipe()
+		os.set_blocking(self.wake_r, False)
+		os.set_blocking(self.wake_w, False)
+		self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _queue(self, operation):
+		with self.lock:
+			self.pending.append(operation)
+		try:
+			os.write(self.wake_w, b"\0")
+		except (BlockingIOError, OSError):
+			pass
+
+	def attach(self, pipe, *writers):
+		"""Starts draining the pipe, passing every chunk read to the writers. The multiplexer closes the pipe at EOF."""
+		os.set_blocking(pipe.fileno(), False)
+		self._queue(("attach", pipe, writers))
+
+	def detach(self, pipe):
+		"""Stops draining the pipe and closes it."""
+		self._queue(("detach", pipe, ()))
+
+	def _apply_pending(self):
+		with self.lock:
+			pending = self.pending
+			self.pending = []
+		for operation, pipe, writers in pending:
+			if operation == "attach":
+				if not pipe.closed:
+					self.selector.register(pipe.fileno(), selectors.EVENT_READ, (pipe, writers))
+			else:
+				self._drain(pipe)
+				self._close(pipe)
+
+	def _drain(self, pipe):
+		"""Keeps whatever the process wrote before its pipe was detached."""
+		if pipe.closed:
+			return
+		try:
+			writers = self.selector.get_key(pipe.fileno()).data[1]
+		except KeyError:
+			return
+		try:
+			while True:
+				chunk = os.read(pipe.fileno(), 65536)
+				if not chunk:
+					break
+				for writer in writers:
+					writer(chunk)
+		except OSError:
+			pass
+
+	def _close(self, pipe):
+		if pipe.closed:
+			return
+		try:
+			self.selector.unregister(pipe.fileno())
+		except KeyError:
+			pass
+		pipe.close()
+
+	def _run(self):
+		while True:
+			self._apply_pending()
+			for key, _ in self.selector.select():
+				if key.data is None:
+					try:
+						while os.read(self.wake_r, 4096):
+							pass
+					except BlockingIOError:
+						pass
+					continue
+				pipe, writers = key.data
+				try:
+					chunk = os.read(key.fd, 65536)
+				except BlockingIOError:
+					continue
+				except OSError:
+					chunk = b""
+				if chunk:
+					for writer in writers:
+						writer(chunk)
+				else:
+					self._close(pipe)
+
+_multiplexer_lock = threading.Lock()
+
+def get_multiplexer():
+	"""Returns the shared output multiplexer, starting it on first use."""
+	with _multiplexer_lock:
+		if Globals.output_multiplexer is None:
+			Globals.output_multiplexer = OutputMultiplexer()
+		return Globals.output_multiplexer
@@ -0,0 +1,71 @@
+import asyncio
+import re
+from .verifier import Verifier
+from .global_storage import Globals
+from .verifier_engine import get_engine
+
+# A line longer than this is matched by its end only.
+MAX_LINE = 65536
+
+class OutputMatchVerifier(Verifier):
+	"""Passes once a line written by the process matches the regular expression pattern.
+
+	The process output must be captured, with suppress_output or redirect_output.
+	Lines are matched as they are read from the process, and only lines written by
+	the current incarnation of the process count. Fails early if the process exits.
+	"""
+
+	needs_output = True
+
+	def __init__(self, **kwargs):
+		self.pattern = None
+		self.timeout = 30
+
+		if "pattern" in kwargs:
+			self.pattern = re.compile(kwargs["pattern"])
+
+		if "timeout" in kwargs:
+			self.timeout = kwargs["timeout"]
+
+	def run(self, proc):
+		return get_engine().verify(self, proc)
+
+	async def arun(self, proc):
+		if self.pattern is None:
+			self.log_fail("No pattern to match.")
+			return False
+		if proc.output is None:
+			self.log_fail("The output of the process is not captured, set suppress_output or redirect_output.")
+			return False
+		loop = asyncio.get_event_loop()
+		timeout_at = loop.time() + self.timeout
+		chunks = asyncio.Queue()
+		def listener(chunk):
+			loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+		pending = proc.output.subscribe(listener, proc.output_mark)
+		self.log_verbose("Waiting for output matching {0}".format(self.pattern.pattern))
+		try:
+			while True:
+				lines = pending.split(b"\n")
+				pending = lines.pop()[-MAX_LINE:]
+				for line in lines:
+					if self.pattern.search(line.decode("utf-8", "replace")):
+						return True
+				if Globals.shutdown:
+					return False
+				remaining = timeout_at - loop.time()
+				if remaining <= 0:
+					break
+				try:
+					# Wakes up now and then to notice the exit of a process which wrote nothing.
+					pending += await asyncio.wait_for(chunks.get(), min(remaining, 1))
+				except asyncio.TimeoutError:
+					if proc.poll() is not None and chunks.empty():
+						if pending and self.pattern.search(pending.decode("utf-8", "replace")):
+							return True
+						self.log_fail("Process exited with code {0} before writing a matching line.".format(proc.poll()))
+						return False
+		finally:
+			proc.output.unsubscribe(listener)
+		self.log_fail("No output matching {0} in given timeframe {1}s".format(self.pattern.pattern, self.timeout))
+		return False
@@ -1,6 +1,24 @@
+import os
 import shlex
+import signal
 import subprocess
+import threading
+import time
+from concurrent.futures import Future
 from .global_storage import Globals
+from .verifier_engine import get_engine
+from .output import RingBuffer, get_multiplexer
+from .log_sink import open_sink, open_direct, rotates
+from .environment import environment_cache
+from .registry import ProcessRegistry
+from .snapshot import state_changed
+from .events import emit
+from .cgroup import CgroupTree
+from .limits import ProcessLimits, effective_limits
+from .zygote import ZygoteProcess, zygote_argv
+from .state import AdoptedProcess
+from .sockets import wrap_command
+from .debug import debug, log
 
 class UninitializedException(Exception):
 	def __init__(self, process):
@@ -24,20 +42,107 @@ class VerificationFailedException(Exception):
 	def __str__(self):
 		return "Process verification failed.\nCommand line for process: {0}".format(self.commandLine)
 
+def live_groups():
+	"""Returns the process groups having any member which is not a zombie, in one pass over /proc."""
+	groups = set()
+	for entry in os.listdir("/proc"):
+		if not entry.isdigit():
+			continue
+		try:
+			with open("/proc/{0}/stat".format(entry), "rb") as f:
+				data = f.read()
+		except OSError:
+			continue
+		fields = data[data.rindex(b")") + 2:].split()
+		if fields[0] != b"Z":
+			groups.add(int(fields[2]))
+	return groups
+
+def group_alive(pgid, groups=None):
+	"""Returns whether the process group has any member which is not a zombie.
+
+	groups may give the result of live_groups(), to check many groups against a single pass over /proc.
+	"""
+	try:
+		os.killpg(pgid, 0)
+	except (ProcessLookupError, PermissionError):
+		return False
+	if groups is None:
+		groups = live_groups()
+	return pgid in groups
+
+def stop_tree(popen, cgroup, timeout):
+	"""Stops the tree of a process incarnation which is no longer the current one, killing it after timeout seconds."""
+	def alive():
+		popen.poll()
+		if cgroup is not None:
+			return len(CgroupTree.procs(cgroup)) > 0
+		return group_alive(popen.pid)
+
+	def send(signum):
+		if cgroup is not None:
+			CgroupTree.kill(cgroup, signum)
+		try:
+			os.killpg(popen.pid, signum)
+		except (ProcessLookupError, PermissionError):
+			pass
+
+	deadline = time.time() + timeout
+	send(signal.SIGTERM)
+	while alive() and time.time() < deadline:
+		time.sleep(0.05)
+	if alive():
+		send(signal.SIGKILL)
+	try:
+		popen.wait(timeout)
+	except subprocess.TimeoutExpired:
+		debug("Process {0} did not exit after SIGKILL.".format(popen.pid))
+
 class Process:
-	processes = []
+	__slots__ = (
+		"internalId", "name", "commandLine", "cmdString", "options", "verifier", "proc", "started_at",
+		"exit_notified", "depends_on", "groups", "stop_latency", "output", "output_mark", "cgroup", "limits",
+		"definition", "zygote_launch", "restart_lock", "liveness", "restart_policy", "restart_count", "failures", "last_failure", "failed", "stopped",
+	)
+	processes = ProcessRegistry()
 	next_id = 1
+	id_lock = threading.Lock()
 
 	@classmethod
 	def add_process(self, proc):
-		Process.processes.append(proc)
+		Process.processes.add(proc)
 
-	def __init__(self, commandLine, verifier=None, **kwargs):
-		self.internalId = Process.next_id
-		Process.next_id += 1
-		self.init(commandLine, verifier, **kwargs)
+	def __init__(self, commandLine, verifier=None, name=None, adopt=None, wait=True, **kwargs):
+		with Process.id_lock:
+			self.internalId = Process.next_id
+			Process.next_id += 1
+		self.name = name
+		self.exit_notified = None
+		self.depends_on = []
+		self.groups = []
+		self.stop_latency = None
+		self.output = None
+		self.output_mark = 0
+		self.restart_lock = threading.Lock()
+		self.liveness = None
+		self.restart_policy = None
+		self.restart_count = 0
+		self.failures = 0
+		self.last_failure = None
+		self.failed = False
+		self.stopped = False
+		self.cgroup = None
+		self.definition = None
+		if adopt is not None:
+			self.attach(commandLine, verifier, adopt, **kwargs)
+		else:
+			self.init(commandLine, verifier, wait, **kwargs)
 	
-	def init(self, commandLine, verifier=None, **kwargs):
+	def init(self, commandLine, verifier=None, wait=True, **kwargs):
+		"""Starts the process and, with wait, runs its verifier, raising VerificationFailedException if it fails.
+
+		Without wait, the verifier is left to verify().
+		"""
 		self.commandLine = commandLine
 
 		if "shell" not in kwargs:
@@ -53,69 +158,268 @@ class Process:
 			args = shlex.split(commandLine)
 		print("$ {0}".format(self.cmdString))
 		out_method = None
+		sink = None
 		if "suppress_output" in kwargs and kwargs["suppress_output"]:
 			if "redirect_output" in kwargs:
 				raise ArgumentError("Suppress output and redirect output are mutually exclusive.")
 			out_method = subprocess.PIPE
 		elif "redirect_output" in kwargs:
-			out_method = open(kwargs["redirect_output"], 'w')
+			if self.writes_directly(verifier, kwargs):
+				# The process owns its file descriptor, so it keeps writing when the manager detaches.
+				out_method = open_direct(kwargs["redirect_output"])
+			else:
+				sink = open_sink(kwargs["redirect_output"])
+				out_method = subprocess.PIPE
 		cwd = None
 		if "working_directory" in kwargs:
 			cwd = kwargs["working_directory"]
 		env = None
 		if "environment_file" in kwargs:
-			cmd = ". {0}; env".format(kwargs["environment_file"])
-			shell = kwargs["shell"]
-			if shell is False:
-				shell = True
-			if shell is True:
-				shell = Globals.default_shell
-			if shell is not True:
-				cmd = [shell, "-c", '%s' % cmd]
-				shell = False
-			pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=shell)
-			output = pipe.communicate()[0]
-			env = dict((line.decode().split("=", 1) for line in output.splitlines()))
+			env = environment_cache.load(kwargs["environment_file"], kwargs["shell"])
 
 		shell = kwargs["shell"]
 		if shell is not False and shell is not True:
 			args = [shell, "-c", ' '.join(args)]
 			shell = False
 
-		self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=out_method, stderr=subprocess.STDOUT, cwd=cwd, env=env, shell=shell)
+		pass_fds = ()
+		if kwargs.get("sockets"):
+			if shell is True:
+				args = ["/bin/sh", "-c", ' '.join(args)]
+				shell = False
+			args, env, pass_fds = wrap_command(args, kwargs["sockets"], env)
+
+		pre_exec = []
+		if Globals.cgroups is not None and kwargs.get("cgroup", True):
+			name = "proc-{0}".format(self.internalId)
+			# During a socket handoff the previous incarnation still runs, and is stopped through its own cgroup.
+			if self.cgroup == Globals.cgroups.path(name) and self.tree_alive():
+				name += "b"
+			self.cgroup = Globals.cgroups.prepare(name)
+			cgroup = self.cgroup
+			pre_exec.append(lambda: CgroupTree.join(cgroup))
+		self.limits = ProcessLimits(kwargs.get("limits"), kwargs.get("scheduling"))
+		if self.limits.cgroup_files:
+			if self.cgroup is not None:
+				missing = Globals.cgroups.missing_controllers(self.limits.cgroup_files)
+				if missing:
+					log("[WARNING] cpu_max and memory_max of {0} need the {1} cgroup controllers, which are not available, ignoring.".format(self.cmdString, ", ".join(sorted(missing))))
+				self.limits.configure_cgroup(self.cgroup, Globals.cgroups.controllers)
+			else:
+				log("[WARNING] cpu_max and memory_max of {0} need cgroups to be enabled, ignoring.".format(self.cmdString))
+		if self.limits.configured():
+			pre_exec.append(self.limits.apply)
+		preexec = None
+		if pre_exec:
+			def preexec():
+				for func in pre_exec:
+					func()
+
+		stdin = subprocess.DEVNULL
+		if kwargs.get("stdin", False):
+			stdin = subprocess.PIPE
+
+		zygote_args = None
+		if Globals.zygote is not None and kwargs.get("zygote", True) and shell is False and not pass_fds:
+			zygote_args = zygote_argv(args, Globals.zygote.python)
+
+		self.started_at = time.time()
+		try:
+			if zygote_args is not None:
+				self.fork_from_zygote(args, zygote_args, stdin, out_method, cwd, env, kwargs)
+			else:
+				self.zygote_launch = None
+				# Every process leads its own session, so its whole tree can be signalled through the process group.
+				self.proc = subprocess.Popen(args, stdin=stdin, stdout=out_method, stderr=subprocess.STDOUT, cwd=cwd, env=env, shell=shell, preexec_fn=preexec, start_new_session=True, pass_fds=pass_fds)
+		finally:
+			if isinstance(out_method, int) and out_method >= 0:
+				os.close(out_method)
+		if out_method is subprocess.PIPE:
+			if self.output is None:
+				size = Globals.output_buffer_size
+				if "output_buffer" in kwargs:
+					size = kwargs["output_buffer"]
+				self.output = RingBuffer(size)
+			# Output verifiers only look at what this incarnation writes.
+			self.output_mark = self.output.total
+			writers = [self.output.append]
+			if sink is not None:
+				writers.append(sink.write)
+			get_multiplexer().attach(self.proc.stdout, *writers)
 		self.verifier = verifier
 		self.options = kwargs
+		if Globals.supervisor is not None:
+			Globals.supervisor.watch(self)
+		state_changed()
+		emit("process.launch", id=self.internalId, name=self.name, pid=self.proc.pid, command=self.cmdString)
 
 		if verifier is not None:
-			if not verifier.run(self):
-				raise VerificationFailedException(self)
+			verifier.process = self
+			if wait:
+				self.verified(get_engine().verify(verifier, self))
+
+	@staticmethod
+	def writes_directly(verifier, options):
+		"""Returns whether the process writes its redirect_output file itself instead of through the manager.
+
+		Only then can a later manager adopt it, so it does when a state file is kept,
+		unless the file is rotated or the output must be captured.
+		"""
+		if Globals.state_file is None or rotates(Globals.log_options) or options.get("capture_output", False):
+			return False
+		return verifier is None or not verifier.needs_output
+
+	def verified(self, passed):
+		if not passed:
+			emit("verifier.fail", id=self.internalId, name=self.name)
+			raise VerificationFailedException(self)
+		emit("verifier.pass", id=self.internalId, name=self.name)
+
+	def verify(self):
+		"""Runs the verifier on the verifier engine without blocking a thread.
+
+		Returns a concurrent future resolving to the process once the verifier
+		passes, or failing with VerificationFailedException.
+		"""
+		future = Future()
+		if self.verifier is None:
+			future.set_result(self)
+			return future
+		def done(verification):
+			try:
+				self.verified(verification.result())
+			except Exception as e:
+				future.set_exception(e)
+			else:
+				future.set_result(self)
+		get_engine().submit(self.verifier.arun(self)).add_done_callback(done)
+		return future
+
+	def attach(self, commandLine, verifier, entry, **kwargs):
+		"""Takes over the running process described by the state file entry, left by a previous manager."""
+		self.commandLine = commandLine
+		if isinstance(commandLine, list):
+			self.cmdString = " ".join(commandLine)
+		else:
+			self.cmdString = commandLine
+		self.verifier = verifier
+		if verifier is not None:
+			verifier.process = self
+		self.options = kwargs
+		self.limits = ProcessLimits(kwargs.get("limits"), kwargs.get("scheduling"))
+		self.zygote_launch = None
+		if entry.get("cgroup") and os.path.isdir(entry["cgroup"]):
+			self.cgroup = entry["cgroup"]
+		self.started_at = entry["started_at"]
+		self.restart_count = entry.get("restarts", 0)
+		self.proc = AdoptedProcess(entry["pid"], commandLine)
+		if Globals.supervisor is not None:
+			Globals.supervisor.watch(self)
+		state_changed()
+		emit("process.adopt", id=self.internalId, name=self.name, pid=self.proc.pid, command=self.cmdString)
+
+	def fork_from_zygote(self, args, zygote_args, stdin, out_method, cwd, env, kwargs):
+		"""Launches the process by forking the zygote, with a Popen-like handle as proc."""
+		child_fds = []
+		if stdin is subprocess.PIPE:
+			stdin_r, stdin_w = os.pipe()
+			child_fds.append(stdin_r)
+			stdin = os.fdopen(stdin_w, "wb")
+		else:
+			child_fds.append(os.open(os.devnull, os.O_RDONLY))
+			stdin = None
+		stdout = None
+		if out_method is subprocess.PIPE:
+			stdout_r, stdout_w = os.pipe()
+			child_fds.append(stdout_w)
+			stdout = os.fdopen(stdout_r, "rb")
+		elif out_method is not None:
+			child_fds.append(os.dup(out_method))
+		else:
+			child_fds.append(os.dup(1))
+		try:
+			pid, self.zygote_launch = Globals.zygote.spawn(args, zygote_args, child_fds[0], child_fds[1], cwd, env,
+				cgroup=self.cgroup, limits=kwargs.get("limits"), scheduling=kwargs.get("scheduling"))
+		finally:
+			for fd in child_fds:
+				os.close(fd)
+		self.proc = ZygoteProcess(Globals.zygote, pid, args, stdin, stdout)
+		Globals.zygote.register(self.proc)
 
 	def __del__(self):
+		if Globals.detached:
+			return
 		if hasattr(self, "proc") and self.proc is not None:
 			self.proc.poll()
-			if self.proc.returncode is None:
+			if self.proc.returncode is None or self.tree_alive():
 				self.force_terminate()
 
 	def restart(self, timeout=10):
-		if hasattr(self, "proc") and self.proc is not None:
-			if self.proc.poll() is None:
-				self.force_terminate(timeout)
-			if self.proc.stdin:
-				self.proc.stdin.close()
-			if self.proc.stdout:
-				self.proc.stdout.close()
-		self.init(self.commandLine, self.verifier, **self.options)
+		try:
+			with self.restart_lock:
+				emit("process.restart", id=self.internalId, name=self.name)
+				if self.options.get("sockets") and self.proc is not None and self.proc.poll() is None:
+					self.handoff(timeout)
+					return
+				if hasattr(self, "proc") and self.proc is not None:
+					if self.proc.poll() is None or self.tree_alive():
+						self.force_terminate(timeout)
+					if self.proc.stdin:
+						self.proc.stdin.close()
+					if self.proc.stdout:
+						get_multiplexer().detach(self.proc.stdout)
+				self.init(self.commandLine, self.verifier, **self.options)
+		finally:
+			# The monitor loop keeps running during restarts, and checks again once they are over.
+			if Globals.supervisor is not None:
+				Globals.supervisor.notify()
+
+	def handoff(self, timeout):
+		"""Restarts the process without closing its sockets: the new incarnation is started and verified before the old one is stopped.
+
+		If the new incarnation fails, it is stopped and the old one keeps running.
+		"""
+		old, old_cgroup = self.proc, self.cgroup
+		try:
+			self.init(self.commandLine, self.verifier, **self.options)
+		except Exception:
+			if self.proc is not old:
+				stop_tree(self.proc, self.cgroup, timeout)
+				self.release(self.proc)
+				if self.cgroup != old_cgroup:
+					CgroupTree.remove(self.cgroup)
+				self.proc, self.cgroup = old, old_cgroup
+				if Globals.supervisor is not None:
+					Globals.supervisor.watch(self)
+				state_changed()
+			raise
+		stop_tree(old, old_cgroup, timeout)
+		self.release(old)
+		if old_cgroup is not None and old_cgroup != self.cgroup:
+			CgroupTree.remove(old_cgroup)
+
+	def release(self, proc):
+		"""Closes the pipes of a stopped incarnation."""
+		if proc.stdin:
+			try:
+				proc.stdin.close()
+			except OSError:
+				pass
+		if proc.stdout:
+			get_multiplexer().detach(proc.stdout)
+
+	def reset_failures(self):
+		"""Clears the crash loop and stopped state of the process, before a restart requested by the user."""
+		self.failures = 0
+		self.failed = False
+		self.stopped = False
 
 	def wait(self, timeout=None):
 		if hasattr(self, "proc") and self.proc is not None:
-			notify = False
-			if self.proc.returncode is None:
-				notify = True
-			else:
+			if self.proc.returncode is not None and self.exit_notified is self.proc:
 				return self.proc.returncode
 			code = self.proc.wait(timeout)
-			if self.proc.returncode is not None and notify and "process.exit" in Globals.messages:
-				print("Process {0} exited with code {1}".format(self.cmdString, self.proc.returncode))
+			self.notify_exit()
 			return code
 		else:
 			raise UninitializedException(self)
@@ -123,6 +427,8 @@ class Process:
 	def write(self, stdin):
 		if hasattr(self, "proc") and self.proc is not None and self.proc.stdin is not None:
 			self.proc.stdin.write(stdin)
+		elif hasattr(self, "proc") and self.proc is not None:
+			raise ValueError("The standard input of process {0} is not piped, set its stdin option.".format(self.cmdString))
 		else:
 			raise UninitializedException(self)
 
@@ -142,14 +448,25 @@ class Process:
 	def poll(self):
 		if not hasattr(self, "proc") or self.proc is None:
 			raise UninitializedException(self)
-		notify = False
-		if self.proc.returncode is None:
-			notify = True
 		self.proc.poll()
-		if self.proc.returncode is not None and notify and "process.exit" in Globals.messages:
-			print("Process {0} exited with code {1}".format(self.cmdString, self.proc.returncode))
+		self.notify_exit()
 		return self.proc.returncode
 
+	def notify_exit(self):
+		"""Reports the exit of the process, once per incarnation."""
+		if self.proc.returncode is None or self.exit_notified is self.proc:
+			return
+		self.exit_notified = self.proc
+		if self.proc.stdin is not None:
+			try:
+				self.proc.stdin.close()
+			except OSError:
+				pass
+		state_changed()
+		emit("process.exit", id=self.internalId, name=self.name, code=self.proc.returncode)
+		if "process.exit" in Globals.messages:
+			print("Process {0} exited with code {1}".format(self.cmdString, self.proc.returncode))
+
 	def signal(self, signal):
 		if hasattr(self, "proc") and self.proc is not None and self.proc.returncode is None:
 			self.proc.send_signal(signal)
@@ -165,29 +482,66 @@ class Process:
 			raise UninitializedException(self)
 
 
+	def signal_tree(self, signum):
+		"""Sends a signal to every process in the tree of the process: its cgroup, or else its process group."""
+		if self.cgroup is not None:
+			CgroupTree.kill(self.cgroup, signum)
+		try:
+			os.killpg(self.proc.pid, signum)
+		except (ProcessLookupError, PermissionError):
+			pass
+
+	def tree_alive(self, groups=None):
+		"""Returns whether any process of the tree of the process is still running.
+
+		Uses the cgroup of the process if it has one, its process group otherwise, looked up in groups if given.
+		"""
+		if not hasattr(self, "proc") or self.proc is None:
+			return False
+		self.proc.poll()
+		if self.cgroup is not None:
+			return len(CgroupTree.procs(self.cgroup)) > 0
+		return group_alive(self.proc.pid, groups)
+
+	def wait_tree(self, timeout):
+		"""Waits until the tree of the process is empty, returning False if it is not after timeout seconds."""
+		deadline = time.time() + timeout
+		while self.tree_alive():
+			if time.time() >= deadline:
+				return False
+			time.sleep(0.05)
+		return True
+
 	def terminate(self):
 		if hasattr(self, "proc") and self.proc is not None:
-			if self.proc.poll() is None:
-				self.proc.terminate()
+			if self.proc.poll() is None or self.tree_alive():
+				self.signal_tree(signal.SIGTERM)
 				self.proc.poll()
 		else:
 			raise UninitializedException(self)
 
 	def kill(self):
 		if hasattr(self, "proc") and self.proc is not None:
-			if self.proc.poll() is None:
-				self.proc.kill()
+			if self.proc.poll() is None or self.tree_alive():
+				self.signal_tree(signal.SIGKILL)
 				self.proc.poll()
 		else:
 			raise UninitializedException(self)
 
 	def force_terminate(self, timeout=10):
+		"""Terminates the whole tree of the process, killing it if it is not empty after timeout seconds."""
 		if hasattr(self, "proc") and self.proc is not None:
+			deadline = time.time() + timeout
 			self.terminate()
 			try:
 				self.wait(timeout)
 			except subprocess.TimeoutExpired:
+				pass
+			if not self.wait_tree(max(0, deadline - time.time())):
 				self.kill()
+				self.wait()
+				if not self.wait_tree(timeout):
+					debug("Process tree of {0} is not empty after SIGKILL.".format(self.cmdString))
 		else:
 			raise UninitializedException(self)
 
@@ -195,6 +549,8 @@ class Process:
 		if hasattr(self, "proc") and self.proc is not None:
 			if self.proc.poll() is None:
 				return "running"
+			elif self.failed:
+				return "failed"
 			else:
 				return "terminated"
 		else:
@@ -212,6 +568,8 @@ class Process:
 	def get_data(self):
 		procdata = {
 			"id": self.internalId,
+			"name": self.name,
+			"groups": self.groups,
 			"command": self.cmdString,
 			"status": self.status_string()
 		}
@@ -219,4 +577,24 @@ class Process:
 			procdata["pid"] = self.pid()
 		else:
 			procdata["code"] = self.code(False)
+		if self.restart_policy is not None:
+			procdata["restart_policy"] = self.restart_policy.policy
+			procdata["restarts"] = self.restart_count
+			procdata["last_failure"] = self.last_failure
+		if self.zygote_launch is not None:
+			procdata["zygote"] = {
+				"launch_seconds": round(self.zygote_launch, 4),
+				"saved_seconds": round(max(0, Globals.zygote.boot_seconds - self.zygote_launch), 4)
+			}
+		if self.liveness is not None:
+			procdata["health"] = self.liveness.health
+			procdata["liveness"] = self.liveness.get_data()
+		if self.options.get("sockets"):
+			procdata["sockets"] = [s["address"] if isinstance(s, dict) else s for s in self.options["sockets"]]
+		if self.limits.configured() and procdata["status"] == "running":
+			procdata.update(effective_limits(self.proc.pid, self.cgroup))
+		if Globals.sampler is not None:
+			resources = Globals.sampler.get(self)
+			if resources is not None and procdata["status"] == "running":
+				procdata["resources"] = resources
 		return procdata
\ No newline at end of file
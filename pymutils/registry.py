@@ -0,0 +1,74 @@
+import collections
+import threading
+from .snapshot import state_changed
+
+class ProcessRegistry:
+	"""The set of managed processes, indexed by internal id, config name and group.
+
+	Iterating over the registry yields a snapshot of the processes in the order
+	they were added, so it is safe while other threads add or remove processes.
+	"""
+
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.by_id = collections.OrderedDict()
+		self.by_name = {}
+		self.by_group = {}
+
+	def add(self, proc):
+		with self.lock:
+			self.by_id[proc.internalId] = proc
+			if proc.name is not None:
+				self.by_name[proc.name] = proc
+			for group in proc.groups:
+				self.by_group.setdefault(group, collections.OrderedDict())[proc.internalId] = proc
+		state_changed()
+
+	def remove(self, proc):
+		with self.lock:
+			self.by_id.pop(proc.internalId, None)
+			if proc.name is not None and self.by_name.get(proc.name) is proc:
+				del self.by_name[proc.name]
+			for group in proc.groups:
+				members = self.by_group.get(group)
+				if members is not None:
+					members.pop(proc.internalId, None)
+					if not members:
+						del self.by_group[group]
+		state_changed()
+
+	def __iter__(self):
+		with self.lock:
+			return iter(list(self.by_id.values()))
+
+	def __len__(self):
+		return len(self.by_id)
+
+	def get(self, internalId):
+		return self.by_id.get(internalId)
+
+	def get_name(self, name):
+		return self.by_name.get(name)
+
+	def group(self, group):
+		with self.lock:
+			return list(self.by_group.get(group, {}).values())
+
+	def groups(self):
+		with self.lock:
+			return dict((group, list(members)) for group, members in self.by_group.items())
+
+	def select(self, ids=(), names=(), groups=()):
+		"""Returns the processes matching any of the given ids, names or groups, without duplicates, ordered by id."""
+		selected = collections.OrderedDict()
+		with self.lock:
+			for internalId in ids:
+				if internalId in self.by_id:
+					selected[internalId] = self.by_id[internalId]
+			for name in names:
+				if name in self.by_name:
+					proc = self.by_name[name]
+					selected[proc.internalId] = proc
+			for group in groups:
+				selected.update(self.by_group.get(group, {}))
+		return sorted(selected.values(), key=lambda proc: proc.internalId)
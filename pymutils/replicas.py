@@ -0,0 +1,104 @@
+import collections
+import copy
+import os
+
+def available_cpus():
+	if hasattr(os, "sched_getaffinity"):
+		return sorted(os.sched_getaffinity(0))
+	return list(range(os.cpu_count() or 1))
+
+def replica_count(key, procdef):
+	if "replicas" not in procdef:
+		return None
+	count = procdef["replicas"]
+	if count == "auto":
+		return len(available_cpus())
+	if not isinstance(count, int) or count < 1:
+		raise ValueError("Invalid replicas '{0}' for process {1}, must be a positive number or 'auto'.".format(count, key))
+	return count
+
+def substitute(value, variables):
+	"""Replaces the {name} placeholders of variables in every string found in value."""
+	if isinstance(value, str):
+		for name, replacement in variables.items():
+			value = value.replace("{" + name + "}", str(replacement))
+		return value
+	if isinstance(value, list):
+		return [substitute(item, variables) for item in value]
+	if isinstance(value, dict):
+		return collections.OrderedDict((k, substitute(v, variables)) for k, v in value.items())
+	return value
+
+def replica_cpus(key, procdef, replica, cpus):
+	"""Returns the cores replica should be pinned to according to scheduling.cpu_affinity, or None if it lists them.
+
+	cpu_affinity "replica" pins each replica to its own core, a number to that many cores.
+	"""
+	affinity = procdef.get("scheduling", {}).get("cpu_affinity")
+	if affinity is None or isinstance(affinity, list):
+		return None
+	per_replica = 1
+	if affinity != "replica":
+		if isinstance(affinity, bool) or not isinstance(affinity, int) or affinity < 1:
+			raise ValueError("Invalid cpu_affinity '{0}' for process {1}, must be a list of cores, 'replica' or a number of cores.".format(affinity, key))
+		per_replica = affinity
+	start = (replica * per_replica) % len(cpus)
+	return [cpus[(start + i) % len(cpus)] for i in range(min(per_replica, len(cpus)))]
+
+def pin(key, procdef, replica, cpus):
+	"""Returns the definition with the cores of replica resolved in scheduling.cpu_affinity."""
+	pinned = replica_cpus(key, procdef, replica, cpus)
+	if pinned is not None:
+		procdef["scheduling"] = collections.OrderedDict(procdef["scheduling"])
+		procdef["scheduling"]["cpu_affinity"] = pinned
+	return procdef
+
+def expand_replica(key, procdef, replica, cpus):
+	variables = {"replica": replica}
+	if "port" in procdef:
+		variables["port"] = int(procdef["port"]) + replica
+	instance = collections.OrderedDict(procdef)
+	# The count is not part of the definition of a replica, so scaling leaves existing replicas alone on reload.
+	del instance["replicas"]
+	instance["arguments"] = substitute(procdef["arguments"], variables)
+	instance["options"] = substitute(procdef.get("options", {}), variables)
+	for check in ("verifier", "liveness"):
+		if check in procdef:
+			instance[check] = collections.OrderedDict(procdef[check])
+			instance[check]["arguments"] = substitute(procdef[check].get("arguments", {}), variables)
+	instance["groups"] = list(procdef.get("groups", [])) + [key]
+	return pin(key, instance, replica, cpus)
+
+def expand_processes(processes):
+	"""Expands the process definitions with replicas into one definition per replica.
+
+	Replica i of the process key is named key.i, belongs to the group key and
+	gets {replica} and {port} (the port option plus i) substituted in its
+	arguments, options, and verifier and liveness arguments, and its cores
+	resolved in scheduling.cpu_affinity. Dependencies on a replicated process
+	are expanded to dependencies on all of its replicas.
+	"""
+	expanded = collections.OrderedDict()
+	members = {}
+	cpus = available_cpus()
+	for key, procdef in processes.items():
+		if "executable" not in procdef or "arguments" not in procdef:
+			raise KeyError("Missing executable or arguments in definition for process {0}.".format(key))
+		if "cpu_affinity" in procdef or "cpu_affinity" in procdef.get("options", {}):
+			raise ValueError("cpu_affinity of process {0} must be set under scheduling.".format(key))
+		count = replica_count(key, procdef)
+		if count is None:
+			expanded[key] = pin(key, copy.copy(procdef), 0, cpus)
+			continue
+		members[key] = []
+		for replica in range(count):
+			name = "{0}.{1}".format(key, replica)
+			expanded[name] = expand_replica(key, procdef, replica, cpus)
+			members[key].append(name)
+	for name, procdef in expanded.items():
+		if "depends_on" in procdef:
+			depends_on = []
+			for dep in procdef["depends_on"]:
+				depends_on += members.get(dep, [dep])
+			procdef["depends_on"] = depends_on
+	return expanded
@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import threading
+import time
+from .global_storage import Globals
+from .backoff import Backoff
+from .debug import log, verbose
+from .events import emit
+from .snapshot import state_changed
+
+class RestartPolicy:
+	"""Decides whether and when an exited process is restarted.
+
+	policy is one of never, on-failure or always. A run shorter than min_uptime
+	seconds counts as a crash: consecutive crashes are restarted with exponential
+	backoff starting at backoff seconds up to max_backoff, and after max_failures
+	of them the process is marked failed and left alone.
+	"""
+
+	POLICIES = ("never", "on-failure", "always")
+
+	def __init__(self, **kwargs):
+		self.policy = "never"
+		self.min_uptime = 5
+		self.max_failures = 5
+		backoff = 1
+		max_backoff = 60
+
+		if "policy" in kwargs:
+			self.policy = kwargs["policy"]
+			if self.policy not in RestartPolicy.POLICIES:
+				raise ValueError("Invalid restart policy '{0}', must be one of {1}.".format(self.policy, ", ".join(RestartPolicy.POLICIES)))
+
+		if "min_uptime" in kwargs:
+			self.min_uptime = float(kwargs["min_uptime"])
+
+		if "max_failures" in kwargs:
+			self.max_failures = int(kwargs["max_failures"])
+
+		if "backoff" in kwargs:
+			backoff = float(kwargs["backoff"])
+
+		if "max_backoff" in kwargs:
+			max_backoff = float(kwargs["max_backoff"])
+
+		self.backoff = Backoff(initial=backoff, max=max_backoff, jitter=0.1)
+
+	def should_restart(self, code):
+		if self.policy == "always":
+			return True
+		if self.policy == "on-failure":
+			return code != 0
+		return False
+
+class Restarter:
+	"""Restarts exited processes according to their restart policies.
+
+	Driven from the monitor loop: exits are reported through process_exited(),
+	and run_due() starts the restarts whose backoff elapsed, each on its own
+	thread so that verifiers do not hold up the loop.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.queue = []
+		self.counter = itertools.count()
+		self.in_flight = 0
+
+	def pending(self):
+		with self.lock:
+			return len(self.queue) + self.in_flight
+
+	def next_timeout(self):
+		"""Returns the time until the next restart is due, or None if none is scheduled."""
+		with self.lock:
+			if not self.queue:
+				return None
+			return max(0, self.queue[0][0] - time.time())
+
+	def process_exited(self, proc, code=None):
+		policy = proc.restart_policy
+		if policy is None or proc.failed or proc.stopped or Globals.shutdown:
+			return
+		if proc.restart_lock.locked():
+			# Stopped by a restart of the manager (HTTP, rolling, liveness), neither a failure nor a crash.
+			return
+		if code is None:
+			code = proc.proc.returncode
+		now = time.time()
+		if code != 0:
+			proc.last_failure = now
+		if not policy.should_restart(code):
+			return
+		if now - proc.started_at < policy.min_uptime:
+			proc.failures += 1
+		else:
+			proc.failures = 0
+		if proc.failures >= policy.max_failures:
+			proc.failed = True
+			log("[WARNING] Process {0} is crash looping, giving up after {1} failures.".format(proc.name or proc.cmdString, proc.failures))
+			emit("process.failed", id=proc.internalId, name=proc.name, failures=proc.failures)
+			state_changed()
+			return
+		delay = policy.backoff.delay(proc.failures - 1) if proc.failures > 0 else 0
+		verbose("Restarting process {0} in {1:.2f}s.".format(proc.name or proc.cmdString, delay))
+		with self.lock:
+			heapq.heappush(self.queue, (now + delay, next(self.counter), proc))
+
+	def run_due(self):
+		now = time.time()
+		with self.lock:
+			due = []
+			while self.queue and self.queue[0][0] <= now:
+				due.append(heapq.heappop(self.queue)[2])
+			self.in_flight += len(due)
+		for proc in due:
+			thread = threading.Thread(target=self._restart, args=(proc,))
+			thread.daemon = True
+			thread.start()
+
+	def _restart(self, proc):
+		try:
+			# Skip processes restarted or stopped by someone else in the meantime.
+			if Globals.shutdown or proc.stopped or proc.poll() is None:
+				return
+			try:
+				proc.restart(Globals.terminate_time_allowed)
+				proc.restart_count += 1
+				state_changed()
+			except Exception as e:
+				proc.restart_count += 1
+				state_changed()
+				log("[WARNING] Automatic restart of process {0} failed: {1}".format(proc.name or proc.cmdString, e))
+				if proc.poll() is None:
+					# Unverified; its exit is reported through the supervisor like any other.
+					proc.kill()
+				else:
+					self.process_exited(proc, -1)
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+			if Globals.supervisor is not None:
+				Globals.supervisor.notify()
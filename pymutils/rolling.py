@@ -0,0 +1,40 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .debug import verbose
+
+class RollingRestartAborted(Exception):
+	def __init__(self, failed, remaining):
+		self.failed = failed
+		self.remaining = remaining
+
+	def __str__(self):
+		return "Rolling restart aborted, restart failed for process(es) {0}; {1} process(es) were not restarted.".format(", ".join(str(proc.internalId) for proc in self.failed), len(self.remaining))
+
+def rolling_restart(job, procs, batch=1, timeout=5):
+	"""Restarts the processes at most batch at a time, moving on only once the restarted processes passed their verifiers.
+
+	Every restart is recorded as a step of the job. If a restart or its verification
+	fails, the remaining processes are left untouched and RollingRestartAborted is raised.
+	"""
+	batch = max(1, batch)
+	with ThreadPoolExecutor(max_workers=batch) as pool:
+		for start in range(0, len(procs), batch):
+			chunk = procs[start:start + batch]
+			verbose("Rolling restart of processes {0}.".format(", ".join(str(proc.internalId) for proc in chunk)))
+			started = time.time()
+			for proc in chunk:
+				proc.reset_failures()
+			futures = [(proc, pool.submit(proc.restart, timeout)) for proc in chunk]
+			failed = []
+			for proc, future in futures:
+				try:
+					future.result()
+					job.step("restart", started, process=proc.internalId, success=True)
+				except Exception as e:
+					etype, _, _ = sys.exc_info()
+					job.step("restart", started, process=proc.internalId, success=False, error="{0}: {1}".format(etype.__name__, e))
+					failed.append(proc)
+			if failed:
+				raise RollingRestartAborted(failed, procs[start + batch:])
+	return [proc.get_data() for proc in procs]
@@ -0,0 +1,77 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .global_storage import Globals
+from .debug import log
+
+class Scheduler:
+	"""Runs calls at given times from a heap of timers, on a small pool of worker threads.
+
+	One thread waits for the earliest timer and hands due calls to the pool, so
+	any number of periodic tasks cost the heap entries only. Times are taken
+	from the monotonic clock.
+	"""
+
+	def __init__(self, workers=4):
+		self.condition = threading.Condition()
+		self.queue = []
+		self.counter = itertools.count()
+		self.pool = ThreadPoolExecutor(max_workers=workers)
+		self.closed = False
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def call_at(self, when, func, *args):
+		"""Calls func(*args) on a worker once the monotonic clock reaches when. Returns the timer, to cancel it."""
+		timer = [when, next(self.counter), func, args]
+		with self.condition:
+			heapq.heappush(self.queue, timer)
+			if self.queue[0] is timer:
+				self.condition.notify()
+		return timer
+
+	def call_later(self, delay, func, *args):
+		return self.call_at(time.monotonic() + delay, func, *args)
+
+	def cancel(self, timer):
+		# Cancelled timers stay in the heap until due, and are then dropped.
+		timer[2] = None
+
+	def _run(self):
+		while True:
+			with self.condition:
+				while not self.closed and (not self.queue or self.queue[0][0] > time.monotonic()):
+					self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+				if self.closed:
+					return
+				timer = heapq.heappop(self.queue)
+			if timer[2] is not None:
+				try:
+					self.pool.submit(self._call, timer[2], timer[3])
+				except RuntimeError:
+					# The interpreter is exiting.
+					return
+
+	def _call(self, func, args):
+		try:
+			func(*args)
+		except Exception as e:
+			log("[WARNING] scheduled call {0} failed: {1}: {2}".format(getattr(func, "__qualname__", func), type(e).__name__, e))
+
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		self.pool.shutdown(wait=False)
+
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+	"""Returns the shared scheduler, starting it on first use."""
+	with _scheduler_lock:
+		if Globals.scheduler is None:
+			Globals.scheduler = Scheduler()
+		return Globals.scheduler
@@ -0,0 +1,133 @@
+import os
+import selectors
+import time
+from .global_storage import Globals
+from .process import Process, live_groups
+from .debug import verbose, debug, log
+from .snapshot import state_changed
+from .events import emit
+from . import supervisor
+
+def shutdown_waves(processes):
+	"""Orders processes in reverse dependency order: a process is stopped only after every process depending on it."""
+	names = dict((proc.name, proc) for proc in processes if proc.name is not None)
+	dependents = dict((proc, 0) for proc in processes)
+	for proc in processes:
+		for dep in proc.depends_on:
+			if dep in names:
+				dependents[names[dep]] += 1
+	waves = []
+	remaining = list(processes)
+	while remaining:
+		wave = [proc for proc in remaining if dependents[proc] == 0]
+		if not wave:
+			# Cycles cannot be launched, but stop whatever is left rather than hang.
+			wave = remaining
+		for proc in wave:
+			remaining.remove(proc)
+			for dep in proc.depends_on:
+				if dep in names and names[dep] in dependents:
+					dependents[names[dep]] -= 1
+		waves.append(wave)
+	return waves
+
+def _wait_all(processes, started, deadline, latencies):
+	"""Waits for all processes at once until the deadline, recording the time each one took to exit."""
+	selector = selectors.DefaultSelector()
+	polled = []
+	for proc in processes:
+		if proc.poll() is not None:
+			latencies[proc] = time.time() - started
+			continue
+		try:
+			fd = os.pidfd_open(proc.proc.pid)
+			selector.register(fd, selectors.EVENT_READ, proc)
+		except (AttributeError, OSError):
+			polled.append(proc)
+	try:
+		while (selector.get_map() or polled) and not Globals.in_force_quit:
+			left = deadline - time.time()
+			if left <= 0:
+				break
+			if polled:
+				left = min(left, 0.05)
+			for key, _ in selector.select(left):
+				if key.data.poll() is not None:
+					latencies[key.data] = time.time() - started
+					selector.unregister(key.fd)
+					os.close(key.fd)
+			for proc in list(polled):
+				if proc.poll() is not None:
+					latencies[proc] = time.time() - started
+					polled.remove(proc)
+	finally:
+		for key in list(selector.get_map().values()):
+			os.close(key.fd)
+		selector.close()
+
+def _wait_trees(processes, deadline):
+	"""Waits until the deadline for the trees of the processes to empty, returning the processes whose tree did not."""
+	lingering = alive_trees(processes)
+	while lingering and time.time() < deadline and not Globals.in_force_quit:
+		time.sleep(0.05)
+		lingering = alive_trees(lingering)
+	return lingering
+
+def alive_trees(processes):
+	"""Returns the processes whose tree is still running, scanning /proc at most once for all of them."""
+	groups = live_groups() if any(proc.cgroup is None for proc in processes) else None
+	return [proc for proc in processes if proc.tree_alive(groups)]
+
+def stop_processes(processes, timeout, waves=False):
+	"""Terminates the process trees together and waits for them against a single deadline.
+
+	Trees still running at the deadline are killed. With waves, processes are
+	stopped in reverse dependency order, each wave getting its own deadline.
+	Returns the time each process took to stop, by process.
+	"""
+	lingering = alive_trees([proc for proc in processes if proc.poll() is not None])
+	processes = [proc for proc in processes if proc.poll() is None or proc in lingering]
+	latencies = {}
+	emit("shutdown.begin", processes=len(processes), waves=waves)
+	for wave in (shutdown_waves(processes) if waves else [processes]):
+		if Globals.in_force_quit:
+			break
+		emit("shutdown.wave", ids=[proc.internalId for proc in wave])
+		debug("Sending SIGTERM to {0} processes.".format(len(wave)))
+		started = time.time()
+		for proc in wave:
+			try:
+				proc.terminate()
+			except Exception:
+				pass
+		_wait_all(wave, started, started + timeout, latencies)
+		left = _wait_trees(wave, started + timeout)
+		for proc in left:
+			verbose("Process tree of {0} did not stop within {1}s, killing.".format(proc.cmdString, timeout))
+			emit("shutdown.kill", id=proc.internalId, name=proc.name)
+			try:
+				proc.kill()
+			except Exception:
+				pass
+		_wait_all(left, started, time.time() + timeout, latencies)
+		for proc in _wait_trees(left, time.time() + timeout):
+			log("[WARNING] process tree of {0} is not empty after SIGKILL.".format(proc.cmdString))
+	for proc, latency in latencies.items():
+		proc.stop_latency = latency
+		Globals.stop_latencies[proc.name or str(proc.internalId)] = round(latency, 3)
+		verbose("Process {0} stopped in {1:.3f}s.".format(proc.cmdString, latency))
+		emit("shutdown.stopped", id=proc.internalId, name=proc.name, seconds=round(latency, 3))
+	state_changed()
+	emit("shutdown.complete", stopped=len(latencies))
+	return latencies
+
+def shutdown_all():
+	"""Stops every managed process using the configured graceful time and shutdown order."""
+	stop_processes(list(Process.processes), Globals.terminate_time_allowed, Globals.shutdown_waves)
+
+def async_shutdown(job):
+	"""Shuts down every process as a job, then lets the manager exit."""
+	shutdown_all()
+	Globals.may_terminate = True
+	supervisor.notify()
+	return {"stop_latencies": Globals.stop_latencies}
@@ -0,0 +1,35 @@
+import hashlib
+import json
+import threading
+from .global_storage import Globals
+
+class Snapshot:
+	"""A rendered JSON document, rendered again only after the state of the manager changed.
+
+	The document is keyed by a version counter bumped through state_changed(),
+	along with the manager status, and carries an ETag derived from its body.
+	"""
+
+	def __init__(self, render):
+		self.render = render
+		self.lock = threading.Lock()
+		self.key = None
+		self.body = None
+		self.etag = None
+
+	def get(self):
+		"""Returns the body and the ETag of the current document."""
+		key = (Globals.state_version, Globals.status, Globals.shutdown)
+		with self.lock:
+			if key != self.key:
+				self.body = json.dumps(self.render())
+				self.etag = '"{0}"'.format(hashlib.sha1(self.body.encode("utf-8")).hexdigest()[:16])
+				self.key = key
+			return self.body, self.etag
+
+_version_lock = threading.Lock()
+
+def state_changed():
+	"""Marks every snapshot as outdated. Called whenever a process starts, exits or is removed."""
+	with _version_lock:
+		Globals.state_version += 1
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import socket
+from .verifier import Verifier
+from .global_storage import Globals
+from .backoff import Backoff
+from .verifier_engine import get_engine
+from .sockets import SocketSpec
+
+class SocketVerifier(Verifier):
+	"""Passes once a connection to the socket of the process is accepted.
+
+	The socket is given as address, either "host:port" or the path of a Unix
+	socket. Connections are opened without blocking on the verifier engine loop,
+	waiting between refused attempts according to backoff. Fails early if the
+	process exits.
+	"""
+
+	def __init__(self, **kwargs):
+		self.timeout = 30
+		self.interval = 1
+		self.backoff = Backoff()
+		self.host = "localhost"
+		self.port = 0
+		self.path = None
+
+		if "timeout" in kwargs:
+			self.timeout = kwargs["timeout"]
+
+		if "interval" in kwargs:
+			self.interval = kwargs["interval"]
+
+		if "backoff" in kwargs:
+			self.backoff = Backoff(**kwargs["backoff"])
+
+		if "address" in kwargs:
+			spec = SocketSpec(kwargs["address"])
+			if spec.family == socket.AF_UNIX:
+				self.path = spec.bind_address
+			else:
+				self.host = spec.bind_address[0] or "localhost"
+				self.port = spec.bind_address[1]
+
+		self.resolved = None
+
+	def describe(self):
+		if self.path is not None:
+			return self.path
+		return "{0}:{1}".format(self.host, self.port)
+
+	def targets(self, spec):
+		"""Returns whether the verifier connects to the declared socket spec."""
+		if spec.family == socket.AF_UNIX:
+			return self.path is not None and os.path.abspath(self.path) == os.path.abspath(spec.bind_address)
+		return self.path is None and self.port == spec.bind_address[1]
+
+	async def connect(self):
+		if self.path is not None:
+			await self.connect_socket(socket.AF_UNIX, self.path)
+			return
+		# The address which accepted is kept, so repeated checks skip the resolver thread until one fails.
+		if self.resolved is not None:
+			candidates = [self.resolved]
+		else:
+			infos = await asyncio.get_event_loop().getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+			candidates = [(info[0], info[4]) for info in infos]
+		error = None
+		for candidate in candidates:
+			try:
+				await self.connect_socket(*candidate)
+				self.resolved = candidate
+				return
+			except OSError as e:
+				error = e
+		self.resolved = None
+		raise error
+
+	async def connect_socket(self, family, address):
+		"""Connects a non-blocking socket and closes it, without the transport of a stream."""
+		loop = asyncio.get_event_loop()
+		sock = socket.socket(family, socket.SOCK_STREAM)
+		try:
+			sock.setblocking(False)
+			await loop.sock_connect(sock, address)
+		finally:
+			sock.close()
+
+	def run(self, proc):
+		return get_engine().verify(self, proc)
+
+	async def arun(self, proc):
+		loop = asyncio.get_event_loop()
+		timeout_at = loop.time() + self.timeout
+		delays = self.backoff.delays()
+		while loop.time() < timeout_at:
+			try:
+				self.log_verbose("Connecting to {0}".format(self.describe()))
+				await asyncio.wait_for(self.connect(), self.interval)
+				return True
+			except asyncio.TimeoutError:
+				self.log_fail("Connection to {0} timed out after {1}s".format(self.describe(), self.interval))
+			except OSError as e:
+				self.log_fail("Connection error: {0}".format(e))
+			if Globals.shutdown:
+				return False
+			if proc.poll() is not None:
+				self.log_fail("Process exited with code {0} before accepting connections.".format(proc.poll()))
+				return False
+			await asyncio.sleep(max(0, min(next(delays), timeout_at - loop.time())))
+		return False
+
+class TcpConnectVerifier(SocketVerifier):
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+
+		if "host" in kwargs:
+			self.host = kwargs["host"]
+
+		if "port" in kwargs:
+			self.port = int(kwargs["port"])
+
+class UnixSocketVerifier(SocketVerifier):
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		if self.path is None:
+			self.path = ""
+
+		if "path" in kwargs:
+			self.path = kwargs["path"]
@@ -0,0 +1,140 @@
+import os
+import socket
+import sys
+import threading
+from .global_storage import Globals
+from .debug import debug
+
+DEFAULT_BACKLOG = 128
+
+# Runs between the manager and the command: moves the inherited sockets to the file
+# descriptors 3 and up, sets LISTEN_FDS and LISTEN_PID, which only the process itself
+# knows, then execs the command. The pid is kept across the exec.
+TRAMPOLINE = """import fcntl, os, sys
+count = int(sys.argv[1])
+sources = [int(fd) for fd in sys.argv[2:2 + count]]
+copies = [fcntl.fcntl(fd, fcntl.F_DUPFD, 3 + count) for fd in sources]
+for fd in sources:
+	os.close(fd)
+for target, fd in enumerate(copies, 3):
+	os.dup2(fd, target)
+	os.close(fd)
+os.environ["LISTEN_FDS"] = str(count)
+os.environ["LISTEN_PID"] = str(os.getpid())
+os.execvp(sys.argv[2 + count], sys.argv[2 + count:])
+"""
+
+class SocketSpec:
+	"""A listening socket declared by a process: "host:port", ":port", "[ipv6]:port", or the path of a Unix socket.
+
+	The declaration is either the address string or an object with address,
+	and optionally name (reported in LISTEN_FDNAMES) and backlog.
+	"""
+
+	def __init__(self, declaration):
+		if not isinstance(declaration, dict):
+			declaration = {"address": declaration}
+		if "address" not in declaration:
+			raise KeyError("Missing address in socket declaration {0}.".format(declaration))
+		self.address = str(declaration["address"])
+		self.name = declaration.get("name")
+		self.backlog = int(declaration.get("backlog", DEFAULT_BACKLOG))
+		if "/" in self.address:
+			self.family = socket.AF_UNIX
+			self.bind_address = self.address
+		else:
+			host, sep, port = self.address.rpartition(":")
+			if not sep or not port.isdigit():
+				raise ValueError("Invalid socket address '{0}', must be host:port or a path.".format(self.address))
+			self.family = socket.AF_INET
+			if host.startswith("["):
+				host = host[1:-1]
+				self.family = socket.AF_INET6
+			self.bind_address = (host, int(port))
+
+	def bind(self):
+		if self.family == socket.AF_UNIX:
+			if os.path.exists(self.address) and not os.path.isdir(self.address):
+				# Left by an earlier manager, nobody accepts on it anymore.
+				os.remove(self.address)
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			sock.bind(self.address)
+			sock.listen(self.backlog)
+			return sock
+		# Bound by hand rather than with socket.create_server, which needs Python 3.8.
+		sock = socket.socket(self.family, socket.SOCK_STREAM)
+		try:
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			sock.bind(self.bind_address)
+			sock.listen(self.backlog)
+		except BaseException:
+			sock.close()
+			raise
+		return sock
+
+class ListenSockets:
+	"""The listening sockets of all processes, bound once and kept open by the manager.
+
+	Every incarnation of a process inherits the same sockets, so connections
+	queue up instead of being refused while the process restarts. Processes
+	declaring the same address share its socket.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.sockets = {}
+
+	def get(self, spec):
+		with self.lock:
+			if spec.address not in self.sockets:
+				self.sockets[spec.address] = (spec, spec.bind())
+				debug("Listening on {0}.".format(spec.address))
+			return self.sockets[spec.address][1]
+
+	def retain(self, addresses):
+		"""Closes the sockets whose address is not in addresses."""
+		with self.lock:
+			for address in [a for a in self.sockets if a not in addresses]:
+				self._close(*self.sockets.pop(address))
+
+	def close(self):
+		with self.lock:
+			for spec, sock in self.sockets.values():
+				self._close(spec, sock)
+			self.sockets = {}
+
+	def _close(self, spec, sock):
+		sock.close()
+		if spec.family == socket.AF_UNIX:
+			try:
+				os.remove(spec.address)
+			except OSError:
+				pass
+		debug("Closed socket {0}.".format(spec.address))
+
+_listen_sockets_lock = threading.Lock()
+
+def get_listen_sockets():
+	"""Returns the shared listening sockets, creating the registry on first use."""
+	with _listen_sockets_lock:
+		if Globals.listen_sockets is None:
+			Globals.listen_sockets = ListenSockets()
+		return Globals.listen_sockets
+
+def socket_addresses(procdefs):
+	"""Returns the addresses of the sockets declared by the process definitions."""
+	addresses = set()
+	for procdef in procdefs:
+		for declaration in procdef.get("options", {}).get("sockets", []):
+			addresses.add(SocketSpec(declaration).address)
+	return addresses
+
+def wrap_command(args, declarations, env):
+	"""Returns the command line and environment running args with the declared sockets, and the fds to pass."""
+	specs = [SocketSpec(declaration) for declaration in declarations]
+	fds = [get_listen_sockets().get(spec).fileno() for spec in specs]
+	if any(spec.name for spec in specs):
+		env = dict(os.environ if env is None else env)
+		env["LISTEN_FDNAMES"] = ":".join(spec.name or "unknown" for spec in specs)
+	args = [sys.executable, "-I", "-S", "-c", TRAMPOLINE, str(len(fds))] + [str(fd) for fd in fds] + list(args)
+	return args, env, fds
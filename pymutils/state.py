@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+from .global_storage import Globals
+from .debug import debug, log, verbose
+
+def start_time(pid):
+	"""Returns the start time of a process in clock ticks since boot, from /proc/<pid>/stat, or None if it is gone."""
+	try:
+		with open("/proc/{0}/stat".format(pid), "rb") as f:
+			data = f.read()
+	except OSError:
+		return None
+	fields = data[data.rindex(b")") + 2:].split()
+	if fields[0] == b"Z":
+		return None
+	return int(fields[19])
+
+def definition_hash(procdef):
+	return hashlib.sha1(json.dumps(procdef, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class AdoptedProcess:
+	"""A Popen-like handle of a process launched by a previous manager.
+
+	The process is not a child of this manager, so its exit code cannot be
+	known: it is reported as -1. A pidfd tells when the process has exited.
+	"""
+
+	def __init__(self, pid, args):
+		self.pid = pid
+		self.args = args
+		self.stdin = None
+		self.stdout = None
+		self.stderr = None
+		self.returncode = None
+		self.pidfd = None
+		try:
+			self.pidfd = os.pidfd_open(pid)
+		except (AttributeError, OSError):
+			pass
+
+	def __del__(self):
+		if self.pidfd is not None:
+			os.close(self.pidfd)
+			self.pidfd = None
+
+	def _wait(self, timeout):
+		if self.pidfd is not None:
+			return bool(select.select([self.pidfd], [], [], timeout)[0])
+		deadline = time.time() + (timeout or 0)
+		while True:
+			try:
+				os.kill(self.pid, 0)
+			except ProcessLookupError:
+				return True
+			if timeout is not None and time.time() >= deadline:
+				return False
+			time.sleep(0.05)
+
+	def poll(self):
+		if self.returncode is None and self._wait(0):
+			self.returncode = -1
+		return self.returncode
+
+	def wait(self, timeout=None):
+		if self.returncode is None:
+			if not self._wait(timeout):
+				raise subprocess.TimeoutExpired(self.args, timeout)
+			self.returncode = -1
+		return self.returncode
+
+	def send_signal(self, signum):
+		if self.poll() is None:
+			try:
+				os.kill(self.pid, signum)
+			except ProcessLookupError:
+				pass
+
+	def terminate(self):
+		self.send_signal(signal.SIGTERM)
+
+	def kill(self):
+		self.send_signal(signal.SIGKILL)
+
+class StateFile:
+	"""Keeps a file listing the running processes, so a later manager can adopt them.
+
+	Every entry records the name, pid, start time and command of a process,
+	whether its standard streams are piped to the manager, and a hash of its
+	definition. The file is rewritten in the background shortly after the state
+	of the manager changes.
+	"""
+
+	def __init__(self, path, interval=0.5):
+		self.path = os.path.abspath(path)
+		self.interval = interval
+		self.version = None
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def load(self):
+		"""Returns the entries of the processes in the file which are still running, by name."""
+		try:
+			with open(self.path) as f:
+				data = json.load(f)
+		except FileNotFoundError:
+			return {}
+		except (OSError, ValueError) as e:
+			log("[WARNING] could not read state file {0}: {1}".format(self.path, e))
+			return {}
+		entries = {}
+		for entry in data.get("processes", []):
+			if start_time(entry["pid"]) == entry["start_time"]:
+				entries[entry["name"]] = entry
+			else:
+				debug("Process {0} with pid {1} is gone.".format(entry["name"], entry["pid"]))
+		return entries
+
+	def entries(self):
+		from .process import Process
+		entries = []
+		for proc in Process.processes:
+			if proc.name is None or proc.proc is None or proc.proc.returncode is not None:
+				continue
+			started = start_time(proc.proc.pid)
+			if started is None:
+				continue
+			entries.append({
+				"name": proc.name,
+				"pid": proc.proc.pid,
+				"start_time": started,
+				"started_at": proc.started_at,
+				"command": proc.cmdString,
+				"piped": proc.proc.stdin is not None or proc.proc.stdout is not None,
+				"definition": definition_hash(proc.definition) if proc.definition is not None else None,
+				"cgroup": proc.cgroup,
+				"restarts": proc.restart_count,
+			})
+		return entries
+
+	def write(self):
+		with self.lock:
+			self.version = Globals.state_version
+			temporary = self.path + ".tmp"
+			with open(temporary, "w") as f:
+				json.dump({"manager": os.getpid(), "processes": self.entries()}, f, separators=(",", ":"))
+			os.replace(temporary, self.path)
+
+	def remove(self):
+		with self.lock:
+			try:
+				os.remove(self.path)
+			except FileNotFoundError:
+				pass
+
+	def start(self):
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+
+	def _run(self):
+		while not self.stopped.wait(self.interval):
+			if Globals.state_version != self.version:
+				try:
+					self.write()
+				except OSError as e:
+					log("[WARNING] could not write state file {0}: {1}".format(self.path, e))
+
+def stop_stale(entries, timeout):
+	"""Stops the process trees of entries which cannot be adopted, killing them after timeout seconds."""
+	entries = list(entries)
+	for entry in entries:
+		verbose("Stopping process {0} (pid {1}) left by the previous manager.".format(entry["name"], entry["pid"]))
+		try:
+			os.killpg(entry["pid"], signal.SIGTERM)
+		except (ProcessLookupError, PermissionError):
+			pass
+	deadline = time.time() + timeout
+	while time.time() < deadline and any(start_time(entry["pid"]) == entry["start_time"] for entry in entries):
+		time.sleep(0.05)
+	for entry in entries:
+		try:
+			os.killpg(entry["pid"], signal.SIGKILL)
+		except (ProcessLookupError, PermissionError):
+			pass
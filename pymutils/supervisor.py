@@ -0,0 +1,139 @@
+import os
+import selectors
+import signal
+import threading
+from .global_storage import Globals
+from .debug import debug
+
+class Supervisor:
+	"""Waits for managed processes to change state without polling them.
+
+	Every watched process is registered through a pidfd, which becomes readable
+	once the process exits, so only the processes that actually exited are
+	reaped. On kernels without pidfd support, SIGCHLD wakes the supervisor and
+	all watched processes are polled instead.
+	"""
+
+	def __init__(self):
+		self.selector = selectors.DefaultSelector()
+		self.lock = threading.Lock()
+		self.watched = {}
+		self.pending = []
+		self.use_pidfd = hasattr(os, "pidfd_open")
+		self.wake_r, self.wake_w = os.pipe()
+		os.set_blocking(self.wake_r, False)
+		os.set_blocking(self.wake_w, False)
+		self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+		if not self.use_pidfd:
+			debug("pidfd is not available, supervising on SIGCHLD.")
+			signal.signal(signal.SIGCHLD, self._on_sigchld)
+
+	def _on_sigchld(self, signum, frame):
+		self.notify()
+
+	def notify(self):
+		"""Wakes up the thread blocked in wait(). Safe to call from any thread or signal handler."""
+		try:
+			os.write(self.wake_w, b"\0")
+		except (BlockingIOError, OSError):
+			pass
+
+	def watch(self, proc):
+		"""Starts (or restarts, after Process.restart) supervising the process."""
+		with self.lock:
+			self.pending.append(proc)
+		self.notify()
+
+	def running(self):
+		with self.lock:
+			return len(self.watched) + len(self.pending)
+
+	def _register_pending(self, exited):
+		with self.lock:
+			pending = self.pending
+			self.pending = []
+		for proc in pending:
+			self._unwatch(proc)
+			popen = proc.proc
+			if popen is None or popen.returncode is not None:
+				continue
+			fd = None
+			if self.use_pidfd:
+				try:
+					fd = os.pidfd_open(popen.pid)
+				except ProcessLookupError:
+					if proc.poll() is not None:
+						exited.append(proc)
+					continue
+				except OSError:
+					debug("pidfd_open failed, supervising on SIGCHLD.")
+					self.use_pidfd = False
+					signal.signal(signal.SIGCHLD, self._on_sigchld)
+			with self.lock:
+				self.watched[proc] = (popen, fd)
+			if fd is not None:
+				self.selector.register(fd, selectors.EVENT_READ, proc)
+			elif proc.poll() is not None:
+				self._unwatch(proc)
+				exited.append(proc)
+
+	def _unwatch(self, proc):
+		with self.lock:
+			entry = self.watched.pop(proc, None)
+		if entry is not None and entry[1] is not None:
+			self.selector.unregister(entry[1])
+			os.close(entry[1])
+
+	def _drain_wakeups(self):
+		try:
+			while os.read(self.wake_r, 4096):
+				pass
+		except BlockingIOError:
+			pass
+
+	def wait(self, timeout=None):
+		"""Blocks until a watched process exits, notify() is called or the timeout expires.
+
+		Returns the list of processes found to have exited.
+		"""
+		exited = []
+		self._register_pending(exited)
+		if exited:
+			return exited
+		for key, _ in self.selector.select(timeout):
+			proc = key.data
+			if proc is None:
+				self._drain_wakeups()
+				continue
+			popen, fd = self.watched.get(proc, (None, None))
+			if popen is not proc.proc:
+				# The process was restarted since this pidfd was registered, the new
+				# incarnation is already queued for registration.
+				self._unwatch(proc)
+				continue
+			if proc.poll() is not None:
+				self._unwatch(proc)
+				exited.append(proc)
+		if not self.use_pidfd:
+			with self.lock:
+				procs = list(self.watched)
+			for proc in procs:
+				if proc.poll() is not None:
+					self._unwatch(proc)
+					exited.append(proc)
+		self._register_pending(exited)
+		return exited
+
+	def close(self):
+		with self.lock:
+			procs = list(self.watched)
+		for proc in procs:
+			self._unwatch(proc)
+		self.selector.close()
+		os.close(self.wake_r)
+		os.close(self.wake_w)
+
+def notify():
+	"""Wakes up the global supervisor, if there is one, so it re-evaluates the shared state."""
+	if Globals.supervisor is not None:
+		Globals.supervisor.notify()
@@ -1,13 +1,35 @@
+import asyncio
 from .global_storage import Globals
+from .events import emit
 
 class Verifier:
+	process = None
+	# Whether the verifier reads the captured output of the process.
+	needs_output = False
+
 	def run(self, proc):
 		return True
 
+	async def arun(self, proc):
+		"""Asynchronous variant of run(), executed on the verifier engine loop.
+
+		The default implementation adapts synchronous verifiers by running run() on
+		the loop's executor. Verifiers that can wait without blocking should override it.
+		"""
+		return await asyncio.get_event_loop().run_in_executor(None, self.run, proc)
+
+	def emit_event(self, kind, message):
+		if self.process is not None:
+			emit(kind, id=self.process.internalId, name=self.process.name, message=message)
+		else:
+			emit(kind, message=message)
+
 	def log_fail(self, message):
+		self.emit_event("verifier.attempt_failed", message)
 		if "verifier.fail" in Globals.messages or "verifier.verbose" in Globals.messages:
 			print("Verifier fail: {0}".format(message))
 
 	def log_verbose(self, message):
+		self.emit_event("verifier.attempt", message)
 		if "verifier.verbose" in Globals.messages:
 			print("Verifier: {0}".format(message))
\ No newline at end of file
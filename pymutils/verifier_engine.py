@@ -0,0 +1,47 @@
+import asyncio
+import threading
+from .global_storage import Globals
+from .aio_http import ConnectionPool
+
+class VerifierEngine:
+	"""Runs verifiers on a single asyncio event loop in a background thread.
+
+	Verifiers implementing arun() share the loop and its keep-alive HTTP
+	connection pool, so any number of readiness checks cost a single thread.
+	Synchronous verifiers go through the Verifier.arun adapter, which runs them
+	on the loop's default executor.
+	"""
+
+	def __init__(self):
+		self.loop = asyncio.new_event_loop()
+		self.http = ConnectionPool()
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _run(self):
+		asyncio.set_event_loop(self.loop)
+		self.loop.run_forever()
+
+	def submit(self, coro):
+		"""Schedules a coroutine on the engine loop, returning a concurrent.futures.Future."""
+		return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+	def verify(self, verifier, proc):
+		"""Runs the verifier against the process, blocking the calling thread until it finishes."""
+		return self.submit(verifier.arun(proc)).result()
+
+	def stop(self):
+		def close():
+			self.http.close()
+			self.loop.stop()
+		self.loop.call_soon_threadsafe(close)
+
+_engine_lock = threading.Lock()
+
+def get_engine():
+	"""Returns the shared verifier engine, starting it on first use."""
+	with _engine_lock:
+		if Globals.verifier_engine is None:
+			Globals.verifier_engine = VerifierEngine()
+		return Globals.verifier_engine
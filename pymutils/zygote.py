@@ -0,0 +1,396 @@
+"""A fork server launching Python processes from an interpreter with preloaded modules.
+
+The manager starts the server with python -m pymutils.zygote, connected through
+a Unix socket pair. The server imports the preload modules once, then forks a
+child for every launch request: the child takes the file descriptors sent with
+the request as its standard streams and runs the requested script or module, so
+it starts with the preloaded modules already imported. The server reaps its
+children and reports their exit codes to the manager.
+
+Messages are JSON lines; launch requests carry the standard streams of the
+child as SCM_RIGHTS ancillary data.
+"""
+import array
+import importlib
+import json
+import os
+import re
+import runpy
+import select
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+MAX_MESSAGE = 1 << 20
+
+def send_message(sock, message, fds=()):
+	data = (json.dumps(message) + "\n").encode()
+	if fds:
+		sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+		data = data[sent:]
+	if data:
+		sock.sendall(data)
+
+class MessageReader:
+	"""Splits the stream of a socket into JSON messages, collecting the file descriptors received along."""
+
+	def __init__(self, sock):
+		self.sock = sock
+		self.buffer = b""
+		self.fds = []
+
+	def read(self):
+		"""Reads once from the socket and returns the complete messages, or None at EOF."""
+		fds = array.array("i")
+		data, ancdata, _, _ = self.sock.recvmsg(65536, socket.CMSG_SPACE(16 * fds.itemsize))
+		for level, kind, cdata in ancdata:
+			if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+				fds.frombytes(cdata[:len(cdata) - (len(cdata) % fds.itemsize)])
+		self.fds.extend(fds)
+		if not data:
+			return None
+		self.buffer += data
+		messages = []
+		while b"\n" in self.buffer:
+			line, self.buffer = self.buffer.split(b"\n", 1)
+			messages.append(json.loads(line.decode()))
+		if len(self.buffer) > MAX_MESSAGE:
+			raise ValueError("Zygote message too long.")
+		return messages
+
+	def take_fds(self, count):
+		fds = self.fds[:count]
+		self.fds = self.fds[count:]
+		return fds
+
+def exit_code(status):
+	if os.WIFSIGNALED(status):
+		return -os.WTERMSIG(status)
+	return os.WEXITSTATUS(status)
+
+def zygote_argv(args, python=None):
+	"""Returns the interpreter arguments if args run a script or module with the zygote interpreter, or None.
+
+	Only plain "python script.py ...", "python -m module ..." and "python -c code ..."
+	command lines are forked from the zygote, and only if python resolves to the
+	same interpreter as the zygote (python, defaulting to the running one), as
+	another version or installation has other modules.
+	"""
+	if len(args) < 2 or not re.match(r"^python[0-9.]*$", os.path.basename(args[0])):
+		return None
+	interpreter = shutil.which(args[0])
+	if interpreter is None or os.path.realpath(interpreter) != os.path.realpath(python or sys.executable):
+		return None
+	if args[1] in ("-m", "-c"):
+		return list(args[1:]) if len(args) > 2 else None
+	if args[1].startswith("-"):
+		return None
+	return list(args[1:])
+
+# Server side, running in the zygote.
+
+def run_child(request, fds):
+	"""Runs the requested Python program in the forked child. Never returns."""
+	code = 1
+	try:
+		os.setsid()
+		signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.SIG_DFL)
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		if request.get("cgroup"):
+			with open(os.path.join(request["cgroup"], "cgroup.procs"), "w") as f:
+				f.write("0")
+		if request.get("limits") or request.get("scheduling"):
+			from pymutils.limits import ProcessLimits
+			ProcessLimits(request.get("limits"), request.get("scheduling")).apply()
+		for target, fd in enumerate(fds):
+			os.dup2(fd, target)
+		for fd in fds:
+			if fd > 2:
+				os.close(fd)
+		sys.stdin = open(0, "r", closefd=False)
+		sys.stdout = open(1, "w", closefd=False, buffering=1)
+		sys.stderr = open(2, "w", closefd=False, buffering=1)
+		if request.get("cwd"):
+			os.chdir(request["cwd"])
+		if request.get("env") is not None:
+			os.environ.clear()
+			os.environ.update(request["env"])
+		argv = request["argv"]
+		try:
+			if argv[0] == "-m":
+				sys.argv = argv[1:]
+				sys.path[0] = os.getcwd()
+				runpy.run_module(argv[1], run_name="__main__", alter_sys=True)
+			elif argv[0] == "-c":
+				sys.argv = ["-c"] + argv[2:]
+				exec(compile(argv[1], "<string>", "exec"), {"__name__": "__main__"})
+			else:
+				sys.argv = argv
+				sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+				runpy.run_path(argv[0], run_name="__main__")
+			code = 0
+		except SystemExit as e:
+			if e.code is None:
+				code = 0
+			elif isinstance(e.code, int):
+				code = e.code
+			else:
+				print(e.code, file=sys.stderr)
+				code = 1
+	except BaseException:
+		traceback.print_exc()
+	finally:
+		try:
+			sys.stdout.flush()
+			sys.stderr.flush()
+		finally:
+			os._exit(code)
+
+def serve(sock, preload):
+	"""Preloads the modules, then serves launch requests until the manager closes the socket."""
+	started = time.time()
+	for module in preload:
+		importlib.import_module(module)
+	wake_r, wake_w = os.pipe()
+	os.set_blocking(wake_r, False)
+	os.set_blocking(wake_w, False)
+	signal.set_wakeup_fd(wake_w)
+	signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	send_message(sock, {"ready": True, "preload_seconds": time.time() - started})
+
+	reader = MessageReader(sock)
+	selector = selectors.DefaultSelector()
+	selector.register(sock, selectors.EVENT_READ)
+	selector.register(wake_r, selectors.EVENT_READ)
+	while True:
+		for key, _ in selector.select():
+			if key.fd == wake_r:
+				try:
+					while os.read(wake_r, 4096):
+						pass
+				except BlockingIOError:
+					pass
+				continue
+			messages = reader.read()
+			if messages is None:
+				return
+			for request in messages:
+				fds = reader.take_fds(3)
+				started = time.time()
+				pid = os.fork()
+				if pid == 0:
+					signal.set_wakeup_fd(-1)
+					sock.close()
+					os.close(wake_r)
+					os.close(wake_w)
+					run_child(request, fds)
+				for fd in fds:
+					os.close(fd)
+				send_message(sock, {"id": request["id"], "pid": pid, "fork_seconds": time.time() - started})
+		while True:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				break
+			if pid == 0:
+				break
+			send_message(sock, {"exit": pid, "code": exit_code(status)})
+
+# Manager side.
+
+class ZygoteProcess:
+	"""A Popen-like handle of a process forked by the zygote.
+
+	The process is not a child of the manager: its exit code is the one reported
+	by the zygote, and a pidfd tells when the process has exited.
+	"""
+
+	def __init__(self, zygote, pid, args, stdin, stdout):
+		self.zygote = zygote
+		self.pid = pid
+		self.args = args
+		self.stdin = stdin
+		self.stdout = stdout
+		self.stderr = None
+		self.returncode = None
+		self.exited = threading.Event()
+		self.pidfd = None
+		try:
+			self.pidfd = os.pidfd_open(pid)
+		except (AttributeError, OSError):
+			pass
+
+	def __del__(self):
+		if self.pidfd is not None:
+			os.close(self.pidfd)
+			self.pidfd = None
+
+	def _set_code(self, code):
+		self.returncode = code
+		self.exited.set()
+
+	def _gone(self):
+		"""Returns whether the process has exited, even if the zygote did not report it yet."""
+		if self.pidfd is not None:
+			return bool(select.select([self.pidfd], [], [], 0)[0])
+		try:
+			os.kill(self.pid, 0)
+		except ProcessLookupError:
+			return True
+		return False
+
+	def poll(self):
+		if self.returncode is None and self._gone():
+			# The exit report of the zygote follows the exit closely.
+			self.exited.wait(1)
+		return self.returncode
+
+	def wait(self, timeout=None):
+		if not self.exited.wait(timeout):
+			raise subprocess.TimeoutExpired(self.args, timeout)
+		return self.returncode
+
+	def send_signal(self, signum):
+		if self.returncode is None:
+			try:
+				os.kill(self.pid, signum)
+			except ProcessLookupError:
+				pass
+
+	def terminate(self):
+		self.send_signal(signal.SIGTERM)
+
+	def kill(self):
+		self.send_signal(signal.SIGKILL)
+
+class Zygote:
+	"""Starts the fork server and launches processes through it."""
+
+	def __init__(self, preload=(), python=None):
+		self.preload = list(preload)
+		self.python = python or sys.executable
+		self.lock = threading.Lock()
+		self.next_id = 1
+		self.launches = {}
+		self.handles = {}
+		self.early_exits = {}
+		self.sock = None
+		self.server = None
+		self.boot_seconds = None
+		self.thread = None
+
+	def start(self):
+		"""Starts the server and waits until it has imported the preload modules."""
+		started = time.time()
+		self.sock, remote = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+		# Makes pymutils importable by the server; launched processes get the environment of the manager.
+		env = dict(os.environ)
+		root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		env["PYTHONPATH"] = root + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+		self.server = subprocess.Popen([self.python, "-m", "pymutils.zygote", str(remote.fileno())] + self.preload,
+			stdin=subprocess.DEVNULL, pass_fds=[remote.fileno()], start_new_session=True, env=env)
+		remote.close()
+		self.reader = MessageReader(self.sock)
+		messages = []
+		while not messages:
+			messages = self.reader.read()
+			if messages is None:
+				raise RuntimeError("The zygote exited before it was ready.")
+		self.boot_seconds = time.time() - started
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+		return self
+
+	def _run(self):
+		from .supervisor import notify
+		while True:
+			try:
+				messages = self.reader.read()
+			except OSError:
+				messages = None
+			if messages is None:
+				break
+			for message in messages:
+				if "exit" in message:
+					with self.lock:
+						handle = self.handles.pop(message["exit"], None)
+						if handle is None:
+							self.early_exits[message["exit"]] = message["code"]
+					if handle is not None:
+						handle._set_code(message["code"])
+					notify()
+				else:
+					with self.lock:
+						launch = self.launches.get(message["id"])
+					if launch is not None:
+						launch["reply"] = message
+						launch["done"].set()
+		with self.lock:
+			handles = list(self.handles.values())
+			self.handles = {}
+			launches = list(self.launches.values())
+		for handle in handles:
+			handle._set_code(-1)
+		for launch in launches:
+			launch["done"].set()
+
+	def spawn(self, args, argv, stdin, stdout, cwd=None, env=None, **extra):
+		"""Forks a process from the zygote running argv, with the given stdin and stdout (also used as stderr).
+
+		stdin and stdout are file descriptors for the child. Returns the handle and
+		the time the launch took.
+		"""
+		started = time.time()
+		if env is None:
+			env = dict(os.environ)
+		with self.lock:
+			request = {"id": self.next_id, "argv": argv, "cwd": cwd or os.getcwd(), "env": env}
+			request.update(extra)
+			self.next_id += 1
+			launch = {"done": threading.Event(), "reply": None}
+			self.launches[request["id"]] = launch
+			send_message(self.sock, request, [stdin, stdout, stdout])
+		launch["done"].wait()
+		with self.lock:
+			del self.launches[request["id"]]
+		if launch["reply"] is None:
+			raise RuntimeError("The zygote exited.")
+		return launch["reply"]["pid"], time.time() - started
+
+	def register(self, handle):
+		"""Starts tracking the exit of a launched process."""
+		with self.lock:
+			if handle.pid in self.early_exits:
+				code = self.early_exits.pop(handle.pid)
+			else:
+				self.handles[handle.pid] = handle
+				return
+		handle._set_code(code)
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+		if self.server is not None:
+			try:
+				self.server.wait(5)
+			except subprocess.TimeoutExpired:
+				self.server.kill()
+				self.server.wait()
+			self.server = None
+
+def main():
+	sock = socket.socket(fileno=int(sys.argv[1]))
+	serve(sock, sys.argv[2:])
+
+if __name__ == "__main__":
+	main()
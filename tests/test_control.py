@@ -0,0 +1,46 @@
+import os
+import stat
+import pytest
+from pymutils.control import ControlServer, parse_commands, execute, handle_line
+
+def test_parse_commands_selects_by_name_group_id_and_all():
+	commands = parse_commands(["restart", "web", "@workers", "#3", "stop", "all", "signal", "HUP", "db"])
+	assert commands == [
+		{"op": "restart", "id": ["3"], "name": ["web"], "group": ["workers"]},
+		{"op": "stop", "id": [], "name": [], "group": [], "all": True},
+		{"op": "signal", "signal": "HUP", "id": [], "name": ["db"], "group": []},
+	]
+
+def test_parse_commands_rejects_unknown_commands():
+	with pytest.raises(ValueError, match="Unknown command"):
+		parse_commands(["frobnicate", "web"])
+
+def test_parse_commands_requires_a_signal_name():
+	with pytest.raises(ValueError, match="Missing signal"):
+		parse_commands(["signal"])
+
+def test_execute_rejects_invalid_commands():
+	assert execute({"op": ["status"]})["success"] is False
+	assert execute("status")["success"] is False
+
+def test_execute_reports_unexpected_errors():
+	result = execute({"op": "restart", "all": True, "timeout": None})
+	assert result["success"] is False
+	assert result["op"] == "restart"
+	assert result["error"].startswith("TypeError: ")
+
+def test_handle_line_answers_every_command_of_an_array():
+	results = handle_line('[{"op": "status", "id": [null]}, {"op": "status"}]')
+	assert [result["success"] for result in results] == [False, True]
+
+def test_handle_line_reports_invalid_json():
+	assert handle_line("{bad")["success"] is False
+
+def test_the_control_socket_is_created_owner_only(tmp_path):
+	umask = os.umask(0o022)
+	server = ControlServer(str(tmp_path / "control.sock")).start()
+	try:
+		assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+		assert os.umask(umask) == 0o022
+	finally:
+		server.close()
@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import pytest
+from pymutils.federation import Federation, FederationError, Member, selection_query
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYMANAGER = os.path.join(ROOT, "pymanager.py")
+
+def test_selection_query():
+	assert selection_query(["web", "@workers", "#3", "db", "@cache"]) == {"name": "web,db", "group": "workers,cache", "id": "3"}
+	assert selection_query(["all"]) == {"all": "1"}
+	assert selection_query([]) == {}
+
+def test_members_are_parsed_from_urls_and_objects():
+	assert Member("localhost:5001").url == "http://localhost:5001"
+	assert Member("localhost:5001").name == "localhost:5001"
+	member = Member({"url": "https://web1:5001/", "name": "web1"})
+	assert (member.url, member.name) == ("https://web1:5001", "web1")
+	with pytest.raises(FederationError):
+		Member({"name": "web1"})
+	with pytest.raises(FederationError):
+		Member("ftp://web1")
+
+def test_federation_requires_unique_members():
+	with pytest.raises(FederationError):
+		Federation([])
+	with pytest.raises(FederationError):
+		Federation(["localhost:5001", "localhost:5001"])
+
+def test_merge_reports_errors_per_node():
+	federation = Federation(["a:1", "b:2", "c:3"])
+	results = [
+		[{"success": True, "data": {"count": 2}, "seconds": 0.1}, {"success": True, "data": {"status": "running"}, "seconds": 0.2}],
+		[{"success": True, "data": {"count": 1}, "seconds": 0.1}, {"success": False, "error": "Process is in shutdown.", "seconds": 0.3}],
+		[{"success": False, "error": "No answer within 5.0s.", "seconds": 5.0}, {"success": False, "error": "No answer within 5.0s.", "seconds": 5.0}],
+	]
+	merged = federation.merge(results, lambda processes, status: {"count": processes["count"], "status": status["status"]})
+	assert merged["success"] is False
+	assert merged["errors"] == {"b:2": "Process is in shutdown.", "c:3": "No answer within 5.0s."}
+	assert merged["nodes"][0] == {"name": "a:1", "url": "http://a:1", "seconds": 0.2, "success": True, "count": 2, "status": "running"}
+	assert merged["nodes"][1]["success"] is False
+	assert merged["nodes"][2]["seconds"] == 5.0
+
+def free_port():
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+def get_json(url):
+	with urllib.request.urlopen(url, timeout=2) as response:
+		return json.loads(response.read().decode("utf-8"))
+
+@pytest.fixture
+def managers(tmp_path):
+	"""Starts two managers on localhost ports, each running a process in the group work and one outside it."""
+	ports = [free_port(), free_port()]
+	procs = []
+	for port in ports:
+		config = {
+			"http": {"enabled": True, "port": port},
+			"keep_alive": True,
+			"graceful_time": 2,
+			"processes": {
+				"worker": {"executable": "sleep", "arguments": ["600"], "groups": ["work"]},
+				"other": {"executable": "sleep", "arguments": ["601"]},
+			},
+		}
+		path = tmp_path / "m{0}.json".format(port)
+		path.write_text(json.dumps(config))
+		procs.append(subprocess.Popen([sys.executable, PYMANAGER, "-f", str(path)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+	deadline = time.time() + 10
+	for port in ports:
+		while True:
+			try:
+				if get_json("http://localhost:{0}/status".format(port))["status"] == "running":
+					break
+			except OSError:
+				pass
+			assert time.time() < deadline, "manager on port {0} did not start".format(port)
+			time.sleep(0.1)
+	yield ports, procs
+	for proc in procs:
+		if proc.poll() is None:
+			proc.terminate()
+			proc.wait(10)
+
+def federation(members, *command):
+	args = [sys.executable, PYMANAGER, "federation", "-t", "2"]
+	for member in members:
+		args += ["-m", member]
+	result = subprocess.run(args + list(command), stdout=subprocess.PIPE, timeout=30)
+	return result.returncode, json.loads(result.stdout.decode("utf-8"))
+
+def test_federation_status_restart_and_shutdown(managers):
+	ports, procs = managers
+	members = ["localhost:{0}".format(port) for port in ports]
+	unreachable = "localhost:{0}".format(free_port())
+
+	code, status = federation(members, "status")
+	assert code == 0
+	assert status["success"] and status["errors"] == {}
+	assert status["count"] == 4
+	assert [node["status"] for node in status["nodes"]] == ["running", "running"]
+
+	code, status = federation(members + [unreachable], "status")
+	assert code == 1
+	assert list(status["errors"]) == [unreachable]
+	assert status["count"] == 4
+
+	pids = dict((port, get_json("http://localhost:{0}/".format(port))["processes"]) for port in ports)
+	code, restart = federation(members, "restart", "@work")
+	assert code == 0
+	assert [node["job"]["kind"] for node in restart["nodes"]] == ["restart", "restart"]
+	for port in ports:
+		deadline = time.time() + 10
+		while get_json("http://localhost:{0}/jobs".format(port))["jobs"][0]["status"] != "succeeded":
+			assert time.time() < deadline
+			time.sleep(0.1)
+		after = dict((proc["name"], proc["pid"]) for proc in get_json("http://localhost:{0}/".format(port))["processes"])
+		before = dict((proc["name"], proc["pid"]) for proc in pids[port])
+		assert after["worker"] != before["worker"]
+		assert after["other"] == before["other"]
+
+	code, shutdown = federation(members + [unreachable], "shutdown")
+	assert code == 1
+	assert [node["success"] for node in shutdown["nodes"]] == [True, True, False], shutdown
+	for proc in procs:
+		assert proc.wait(15) == 0
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import Future
+import pytest
+from pymutils.launcher import Launcher, DependencyError
+
+def make_launcher(graph, satisfied=()):
+	launcher = Launcher(satisfied=satisfied)
+	for name, deps in graph.items():
+		launcher.add(name, lambda: None, deps)
+	return launcher
+
+def test_order_groups_independent_processes_in_waves():
+	launcher = make_launcher({"db": [], "cache": [], "web": ["db", "cache"], "worker": ["db"], "proxy": ["web"]})
+	waves = launcher.order()
+	assert [sorted(wave) for wave in waves] == [["cache", "db"], ["web", "worker"], ["proxy"]]
+
+def test_order_skips_satisfied_dependencies():
+	launcher = make_launcher({"web": ["db"]}, satisfied=["db"])
+	assert launcher.order() == [["web"]]
+
+def test_order_rejects_undefined_dependency():
+	launcher = make_launcher({"web": ["db"]})
+	with pytest.raises(DependencyError, match="undefined process db"):
+		launcher.order()
+
+def test_order_rejects_cycles():
+	launcher = make_launcher({"a": ["b"], "b": ["a"], "c": []})
+	with pytest.raises(DependencyError, match="cycle between processes: a, b"):
+		launcher.order()
+
+def test_add_rejects_duplicates():
+	launcher = make_launcher({"a": []})
+	with pytest.raises(DependencyError):
+		launcher.add("a", lambda: None)
+
+def test_factories_returning_futures_are_satisfied_when_they_resolve():
+	pending = Future()
+	launched = []
+	launcher = Launcher(max_workers=1)
+	launcher.add("db", lambda: pending)
+	launcher.add("web", lambda: launched.append("web") or "web", ["db"])
+	threading.Timer(0.1, pending.set_result, ["db"]).start()
+	assert launcher.run() == {"db": "db", "web": "web"}
+	assert launched == ["web"]
+
+def test_failed_futures_abort_the_launch():
+	failed = Future()
+	failed.set_exception(RuntimeError("verification failed"))
+	launcher = make_launcher({})
+	launcher.add("db", lambda: failed)
+	launcher.add("web", lambda: "web", ["db"])
+	with pytest.raises(RuntimeError):
+		launcher.run()
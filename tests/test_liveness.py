@@ -0,0 +1,53 @@
+import pytest
+from pymutils import liveness
+from pymutils.liveness import LivenessCheck
+from pymutils.verifier import Verifier
+
+class Incarnation:
+	pass
+
+class Restarted:
+	"""A process whose restart starts a new incarnation which fails its verifier, or keeps the old one on a handoff."""
+
+	def __init__(self, handoff=False):
+		self.internalId = 1
+		self.name = "web"
+		self.cmdString = "web"
+		self.proc = Incarnation()
+		self.failures = 0
+		self.failed = False
+		self.terminated = False
+		self.handoff = handoff
+
+	def restart(self, timeout):
+		if not self.handoff:
+			self.proc = Incarnation()
+		raise Exception("Verification failed.")
+
+	def force_terminate(self, timeout):
+		assert self.failed
+		self.terminated = True
+
+@pytest.fixture
+def events(monkeypatch):
+	events = []
+	monkeypatch.setattr(liveness, "emit", lambda kind, **data: events.append(kind))
+	monkeypatch.setattr(liveness, "log", lambda message: None)
+	return events
+
+def test_a_restart_failing_its_verifier_stops_and_fails_the_process(events):
+	proc = Restarted()
+	LivenessCheck(proc, Verifier()).restart()
+	assert proc.terminated and proc.failed
+	assert events == ["process.failed"]
+
+def test_a_failed_handoff_keeps_the_previous_incarnation(events):
+	proc = Restarted(handoff=True)
+	LivenessCheck(proc, Verifier()).restart()
+	assert not proc.terminated and not proc.failed
+	assert events == []
+
+@pytest.mark.parametrize("options", [{"period": 0}, {"action": "ignore"}])
+def test_invalid_options_are_rejected(options):
+	with pytest.raises(ValueError):
+		LivenessCheck(None, Verifier(), **options)
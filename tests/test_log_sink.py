@@ -0,0 +1,57 @@
+import gzip
+import os
+import pytest
+from pymutils.log_sink import LogSink
+
+@pytest.fixture
+def path(tmp_path):
+	return str(tmp_path / "out.log")
+
+def test_writes_are_flushed_on_close(path):
+	sink = LogSink(path, flush_interval=60)
+	sink.write("one\n")
+	sink.write(b"two\n")
+	sink.close()
+	with open(path, "rb") as f:
+		assert f.read() == b"one\ntwo\n"
+	sink.write("after close\n")
+
+def test_the_file_is_appended_to(path):
+	with open(path, "w") as f:
+		f.write("earlier\n")
+	sink = LogSink(path)
+	sink.write("later\n")
+	sink.close()
+	with open(path) as f:
+		assert f.read() == "earlier\nlater\n"
+
+def test_rotation_keeps_the_given_number_of_backups(path):
+	sink = LogSink(path, max_bytes=10, backups=2)
+	for i in range(4):
+		sink.write("line {0:04}\n".format(i))
+		sink.flush()
+	sink.close()
+	assert os.path.getsize(path) == 0
+	with open(path + ".1") as f:
+		assert f.read() == "line 0003\n"
+	with open(path + ".2") as f:
+		assert f.read() == "line 0002\n"
+	assert not os.path.exists(path + ".3")
+
+def test_rotated_files_are_compressed(path):
+	sink = LogSink(path, max_bytes=10, compress=True)
+	sink.write("line 0000\n")
+	sink.flush()
+	sink.close()
+	with gzip.open(path + ".1.gz") as f:
+		assert f.read() == b"line 0000\n"
+
+def test_without_backups_rotation_truncates(path):
+	sink = LogSink(path, max_bytes=10, backups=0)
+	sink.write("line 0000\n")
+	sink.flush()
+	sink.write("next\n")
+	sink.close()
+	with open(path) as f:
+		assert f.read() == "next\n"
+	assert os.listdir(os.path.dirname(path)) == ["out.log"]
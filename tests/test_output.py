@@ -0,0 +1,56 @@
+import os
+import time
+from pymutils.output import RingBuffer, OutputMultiplexer
+
+def test_the_ring_buffer_keeps_the_last_bytes():
+	buffer = RingBuffer(8)
+	buffer.append(b"abc")
+	assert buffer.getvalue() == b"abc"
+	buffer.append(b"defgh")
+	assert buffer.getvalue() == b"abcdefgh"
+	buffer.append(b"ij")
+	assert buffer.getvalue() == b"cdefghij"
+	buffer.append(b"0123456789")
+	assert buffer.getvalue() == b"23456789"
+	assert buffer.total == 20
+
+def test_tail_drops_the_line_cut_off_by_wrapping():
+	buffer = RingBuffer(12)
+	buffer.append(b"first\nsecond\nthird\n")
+	assert buffer.tail() == ["third"]
+	buffer = RingBuffer(64)
+	buffer.append(b"one\ntwo\nthree\n")
+	assert buffer.tail(2) == ["two", "three"]
+	assert buffer.tail(0) == []
+
+def test_subscribe_returns_what_was_written_since_the_mark():
+	buffer = RingBuffer(16)
+	buffer.append(b"old output\n")
+	mark = buffer.total
+	buffer.append(b"new\n")
+	chunks = []
+	assert buffer.subscribe(chunks.append, mark) == b"new\n"
+	buffer.append(b"more\n")
+	buffer.unsubscribe(chunks.append)
+	buffer.append(b"unseen\n")
+	assert chunks == [b"more\n"]
+
+def test_the_multiplexer_drains_pipes_into_their_writers():
+	multiplexer = OutputMultiplexer()
+	read, write = os.pipe()
+	pipe = os.fdopen(read, "rb")
+	buffer = RingBuffer(1024)
+	multiplexer.attach(pipe, buffer.append)
+	# More than a pipe holds, which a reader that fell behind would block the writer on.
+	data = b"x" * (1 << 20)
+	os.write(write, b"start\n")
+	written = 0
+	while written < len(data):
+		written += os.write(write, data[written:written + 65536])
+	os.close(write)
+	deadline = time.time() + 10
+	while not pipe.closed and time.time() < deadline:
+		time.sleep(0.05)
+	assert pipe.closed
+	assert buffer.total == len(data) + 6
+	assert buffer.getvalue() == b"x" * 1024
@@ -0,0 +1,36 @@
+import pymanager
+from pymanager import diff_definitions
+from pymutils.global_storage import Globals
+from pymutils.jobs import jobs
+from pymutils.replicas import expand_processes
+
+def worker(replicas, port=8000):
+	return {"executable": "python", "arguments": ["worker.py", "{port}"], "replicas": replicas, "options": {"port": port}}
+
+def test_unchanged_definitions_are_left_alone():
+	procdefs = expand_processes({"db": {"executable": "db", "arguments": []}, "w": worker(2)})
+	assert diff_definitions(expand_processes({"db": {"executable": "db", "arguments": []}, "w": worker(2)}), procdefs) == ([], [], [])
+
+def test_added_removed_and_changed_processes_are_told_apart():
+	running = {"a": {"executable": "a", "arguments": []}, "b": {"executable": "b", "arguments": []}}
+	procdefs = {"b": {"executable": "b", "arguments": ["-v"]}, "c": {"executable": "c", "arguments": []}}
+	assert diff_definitions(running, procdefs) == (["c"], ["a"], ["b"])
+
+def test_changing_the_replica_count_only_touches_the_replicas_added_or_removed():
+	running = expand_processes({"w": worker(3)})
+	assert diff_definitions(running, expand_processes({"w": worker(5)})) == (["w.3", "w.4"], [], [])
+	assert diff_definitions(running, expand_processes({"w": worker(1)})) == ([], ["w.1", "w.2"], [])
+
+def test_changing_a_replicated_definition_changes_every_replica():
+	running = expand_processes({"w": worker(2)})
+	assert diff_definitions(running, expand_processes({"w": worker(2, 9000)})) == ([], [], ["w.0", "w.1"])
+
+def test_sighup_is_ignored_until_the_processes_are_launched(monkeypatch):
+	submitted = []
+	monkeypatch.setattr(jobs, "submit", lambda *args: submitted.append(args))
+	monkeypatch.setattr(Globals, "reloader", None)
+	pymanager.reload_signal(None, None)
+	assert submitted == []
+	monkeypatch.setattr(Globals, "reloader", pymanager.reload_config)
+	pymanager.reload_signal(None, None)
+	assert submitted == [("reload", pymanager.reload_config)]
@@ -0,0 +1,61 @@
+import collections
+import pytest
+from pymutils.replicas import expand_processes
+
+def test_processes_without_replicas_are_kept():
+	processes = collections.OrderedDict([("db", {"executable": "db", "arguments": []})])
+	assert expand_processes(processes) == processes
+
+def test_replicas_are_named_grouped_and_substituted():
+	processes = collections.OrderedDict([
+		("web", {
+			"executable": "web",
+			"arguments": ["--port", "{port}", "--id", "{replica}"],
+			"port": 8000,
+			"replicas": 2,
+			"groups": ["frontend"],
+			"verifier": {"type": "v.TcpConnectVerifier", "arguments": {"port": "{port}"}},
+		}),
+	])
+	expanded = expand_processes(processes)
+	assert list(expanded) == ["web.0", "web.1"]
+	assert expanded["web.1"]["arguments"] == ["--port", "8001", "--id", "1"]
+	assert expanded["web.1"]["groups"] == ["frontend", "web"]
+	assert expanded["web.1"]["verifier"]["arguments"] == {"port": "8001"}
+	assert "replicas" not in expanded["web.1"]
+	# The definition is not modified in place.
+	assert processes["web"]["verifier"]["arguments"] == {"port": "{port}"}
+
+def test_dependencies_on_replicated_processes_are_expanded():
+	processes = collections.OrderedDict([
+		("worker", {"executable": "worker", "arguments": [], "replicas": 3}),
+		("web", {"executable": "web", "arguments": [], "depends_on": ["worker", "db"]}),
+	])
+	assert expand_processes(processes)["web"]["depends_on"] == ["worker.0", "worker.1", "worker.2", "db"]
+
+def test_replica_cpu_affinity_pins_each_replica():
+	processes = {"w": {"executable": "w", "arguments": [], "replicas": 2, "scheduling": {"cpu_affinity": "replica"}}}
+	expanded = expand_processes(processes)
+	assert len(expanded["w.0"]["scheduling"]["cpu_affinity"]) == 1
+	assert processes["w"]["scheduling"]["cpu_affinity"] == "replica"
+
+def test_cpu_affinity_of_a_single_process_is_resolved():
+	expanded = expand_processes({"w": {"executable": "w", "arguments": [], "scheduling": {"cpu_affinity": 1}}})
+	assert len(expanded["w"]["scheduling"]["cpu_affinity"]) == 1
+
+@pytest.mark.parametrize("procdef", [
+	{"executable": "w", "arguments": [], "cpu_affinity": "replica"},
+	{"executable": "w", "arguments": [], "options": {"cpu_affinity": [0]}},
+])
+def test_cpu_affinity_outside_scheduling_is_rejected(procdef):
+	with pytest.raises(ValueError):
+		expand_processes({"w": procdef})
+
+@pytest.mark.parametrize("count", [0, -1, "two"])
+def test_invalid_replica_counts_are_rejected(count):
+	with pytest.raises(ValueError):
+		expand_processes({"w": {"executable": "w", "arguments": [], "replicas": count}})
+
+def test_missing_executable_is_rejected():
+	with pytest.raises(KeyError):
+		expand_processes({"w": {"arguments": []}})
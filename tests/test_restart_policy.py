@@ -0,0 +1,87 @@
+import threading
+import time
+import pytest
+from pymutils.restart_policy import RestartPolicy, Restarter
+
+class Exited:
+	def __init__(self, returncode):
+		self.returncode = returncode
+
+class Managed:
+	"""The attributes of a Process the restarter reads and updates."""
+
+	def __init__(self, policy, returncode=1, uptime=0):
+		self.internalId = 1
+		self.name = "crashy"
+		self.cmdString = "crashy"
+		self.restart_policy = policy
+		self.restart_lock = threading.Lock()
+		self.proc = Exited(returncode)
+		self.started_at = time.time() - uptime
+		self.failed = False
+		self.stopped = False
+		self.failures = 0
+		self.last_failure = None
+
+def test_policies():
+	assert RestartPolicy(policy="always").should_restart(0)
+	assert RestartPolicy(policy="on-failure").should_restart(1)
+	assert not RestartPolicy(policy="on-failure").should_restart(0)
+	assert not RestartPolicy().should_restart(1)
+	with pytest.raises(ValueError):
+		RestartPolicy(policy="sometimes")
+
+def test_backoff_doubles_up_to_max_backoff():
+	policy = RestartPolicy(policy="always", backoff=1, max_backoff=4)
+	for attempt, expected in enumerate([1, 2, 4, 4, 4]):
+		assert expected * 0.9 <= policy.backoff.delay(attempt) <= expected
+
+def test_crashes_are_restarted_with_backoff_until_max_failures():
+	policy = RestartPolicy(policy="on-failure", backoff=1, max_backoff=60, max_failures=3)
+	restarter = Restarter()
+	proc = Managed(policy)
+	restarter.process_exited(proc)
+	restarter.process_exited(proc)
+	assert proc.failures == 2
+	assert proc.last_failure is not None
+	# The first crash waits backoff seconds, the second twice as long, less up to 10% jitter.
+	first, second = sorted(when for when, _, _ in restarter.queue)
+	assert 0.8 < first - time.time() <= 1
+	assert 1.7 < second - time.time() <= 2
+	restarter.process_exited(proc)
+	assert proc.failed
+	assert restarter.pending() == 2
+	restarter.process_exited(proc)
+	assert restarter.pending() == 2
+
+def test_long_runs_reset_the_failures():
+	policy = RestartPolicy(policy="always", min_uptime=5)
+	restarter = Restarter()
+	proc = Managed(policy, returncode=0, uptime=10)
+	proc.failures = 4
+	restarter.process_exited(proc)
+	assert proc.failures == 0
+	assert proc.last_failure is None
+	assert restarter.next_timeout() == 0
+
+def test_clean_exits_are_not_restarted_on_failure():
+	restarter = Restarter()
+	proc = Managed(RestartPolicy(policy="on-failure"), returncode=0)
+	restarter.process_exited(proc)
+	assert restarter.pending() == 0
+
+def test_exits_caused_by_a_restart_are_ignored():
+	restarter = Restarter()
+	proc = Managed(RestartPolicy(policy="always"), returncode=-15)
+	with proc.restart_lock:
+		restarter.process_exited(proc)
+	assert proc.last_failure is None
+	assert proc.failures == 0
+	assert restarter.pending() == 0
+
+def test_stopped_processes_are_not_restarted():
+	restarter = Restarter()
+	proc = Managed(RestartPolicy(policy="always"))
+	proc.stopped = True
+	restarter.process_exited(proc)
+	assert restarter.pending() == 0
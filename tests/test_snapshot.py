@@ -0,0 +1,48 @@
+from wsgiref.util import setup_testing_defaults
+import bottle
+import pymutils.http_service
+from pymutils.global_storage import Globals
+from pymutils.snapshot import Snapshot, state_changed
+
+def test_the_document_is_rendered_again_only_after_a_change():
+	renders = []
+	def render():
+		renders.append(1)
+		return {"renders": len(renders)}
+	snapshot = Snapshot(render)
+	body, etag = snapshot.get()
+	assert snapshot.get() == (body, etag)
+	assert len(renders) == 1
+	state_changed()
+	assert snapshot.get()[1] != etag
+	assert len(renders) == 2
+
+def test_an_unchanged_body_keeps_its_etag():
+	snapshot = Snapshot(lambda: {"constant": True})
+	etag = snapshot.get()[1]
+	state_changed()
+	assert snapshot.get()[1] == etag
+
+def get(path, **headers):
+	environ = {"PATH_INFO": path, "REQUEST_METHOD": "GET"}
+	environ.update(("HTTP_" + name.upper(), value) for name, value in headers.items())
+	setup_testing_defaults(environ)
+	answer = {}
+	def start_response(status, response_headers, exc_info=None):
+		answer["status"] = int(status.split()[0])
+		answer["headers"] = dict((name.lower(), value) for name, value in response_headers)
+	answer["body"] = b"".join(bottle.default_app()(environ, start_response))
+	return answer
+
+def test_a_matching_etag_is_answered_with_304(monkeypatch):
+	monkeypatch.setattr(Globals, "status", "running")
+	first = get("/status")
+	assert first["status"] == 200
+	etag = first["headers"]["etag"]
+	cached = get("/status", if_none_match=etag)
+	assert cached["status"] == 304
+	assert cached["body"] == b""
+	monkeypatch.setattr(Globals, "status", "shutdown")
+	changed = get("/status", if_none_match=etag)
+	assert changed["status"] == 200
+	assert changed["headers"]["etag"] != etag
@@ -0,0 +1,54 @@
+import asyncio
+import socket
+import pytest
+import pymanager
+from pymutils.socket_verifier import SocketVerifier, TcpConnectVerifier, UnixSocketVerifier
+from pymutils.sockets import SocketSpec
+
+@pytest.fixture
+def listener():
+	sock = socket.socket()
+	sock.bind(("127.0.0.1", 0))
+	sock.listen(1)
+	yield sock
+	sock.close()
+
+def test_the_base_verifier_connects_to_its_address(listener):
+	verifier = SocketVerifier(address="127.0.0.1:{0}".format(listener.getsockname()[1]))
+	assert verifier.describe() == "127.0.0.1:{0}".format(listener.getsockname()[1])
+	asyncio.run(verifier.connect())
+
+def test_the_base_verifier_connects_to_a_unix_socket(tmp_path):
+	path = str(tmp_path / "s.sock")
+	sock = socket.socket(socket.AF_UNIX)
+	sock.bind(path)
+	sock.listen(1)
+	try:
+		verifier = SocketVerifier(address=path)
+		assert verifier.describe() == path
+		asyncio.run(verifier.connect())
+	finally:
+		sock.close()
+
+def test_a_refused_connection_raises(listener):
+	port = listener.getsockname()[1]
+	listener.close()
+	with pytest.raises(OSError):
+		asyncio.run(TcpConnectVerifier(host="127.0.0.1", port=port).connect())
+
+def test_verifiers_tell_which_declared_sockets_they_target(tmp_path):
+	assert TcpConnectVerifier(port=8000).targets(SocketSpec(":8000"))
+	assert SocketVerifier(address="localhost:8000").targets(SocketSpec("127.0.0.1:8000"))
+	assert not TcpConnectVerifier(port=8001).targets(SocketSpec(":8000"))
+	assert not TcpConnectVerifier(port=8000).targets(SocketSpec(str(tmp_path / "s.sock")))
+	assert UnixSocketVerifier(path=str(tmp_path / "s.sock")).targets(SocketSpec(str(tmp_path / "s.sock")))
+
+def test_socket_verifiers_on_declared_sockets_are_warned_about(monkeypatch):
+	warnings = []
+	monkeypatch.setattr(pymanager, "log", warnings.append)
+	verifiers = {"TcpConnectVerifier": TcpConnectVerifier}
+	procdef = {"executable": "web", "arguments": [], "options": {"sockets": [":8000"]}}
+	pymanager.prepare_process("web", dict(procdef, verifier={"type": "TcpConnectVerifier", "arguments": {"port": 8000}}), verifiers)
+	assert len(warnings) == 1 and "8000" in warnings[0]
+	pymanager.prepare_process("web", dict(procdef, verifier={"type": "TcpConnectVerifier", "arguments": {"port": 8001}}), verifiers)
+	assert len(warnings) == 1
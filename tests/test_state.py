@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import pytest
+from pymutils.global_storage import Globals
+from pymutils.process import Process
+from pymutils.state import StateFile, AdoptedProcess, definition_hash, start_time
+
+SLEEPER = [sys.executable, "-c", "import sys, time\nprint('started', flush=True)\ntime.sleep(30)"]
+
+@pytest.fixture
+def state_file(tmp_path, monkeypatch):
+	state = StateFile(str(tmp_path / "state.json"))
+	monkeypatch.setattr(Globals, "state_file", state)
+	monkeypatch.setattr(Globals, "log_options", {})
+	monkeypatch.setattr(Globals, "log_sinks", {})
+	return state
+
+@pytest.fixture
+def launched():
+	procs = []
+	def launch(*args, **kwargs):
+		proc = Process(*args, **kwargs)
+		Process.add_process(proc)
+		procs.append(proc)
+		return proc
+	yield launch
+	for proc in procs:
+		Process.processes.remove(proc)
+		if proc.poll() is None:
+			proc.kill()
+			proc.wait()
+
+def wait_for_output(path):
+	deadline = time.time() + 10
+	while time.time() < deadline:
+		if os.path.exists(path) and os.path.getsize(path) > 0:
+			return
+		time.sleep(0.05)
+	raise AssertionError("{0} received no output.".format(path))
+
+def test_a_process_writing_its_log_directly_is_adopted(state_file, launched, tmp_path):
+	log = str(tmp_path / "out.log")
+	procdef = {"executable": SLEEPER[0], "arguments": SLEEPER[1:]}
+	proc = launched(SLEEPER, None, "sleeper", redirect_output=log)
+	proc.definition = procdef
+	assert proc.proc.stdout is None
+	wait_for_output(log)
+	state_file.write()
+
+	entries = StateFile(state_file.path).load()
+	assert list(entries) == ["sleeper"]
+	entry = entries["sleeper"]
+	assert not entry["piped"]
+	assert entry["pid"] == proc.proc.pid
+	assert entry["definition"] == definition_hash(procdef)
+
+	adopted = launched(SLEEPER, None, "sleeper", entry)
+	assert isinstance(adopted.proc, AdoptedProcess)
+	assert adopted.poll() is None
+	proc.proc.terminate()
+	assert adopted.proc.wait(10) == -1
+	proc.proc.wait()
+
+def test_a_rotated_log_is_piped_and_not_adoptable(state_file, launched, tmp_path, monkeypatch):
+	monkeypatch.setattr(Globals, "log_options", {"max_bytes": 1 << 20})
+	proc = launched(SLEEPER, None, "sleeper", redirect_output=str(tmp_path / "out.log"))
+	assert proc.proc.stdout is not None
+	wait_for_output(str(tmp_path / "out.log"))
+	assert state_file.entries()[0]["piped"]
+
+def test_captured_output_is_piped(state_file, launched, tmp_path):
+	proc = launched(SLEEPER, None, "sleeper", redirect_output=str(tmp_path / "out.log"), capture_output=True)
+	assert proc.proc.stdout is not None
+	assert proc.output is not None
+
+def test_processes_which_are_gone_or_reused_are_not_loaded(state_file):
+	child = subprocess.Popen(["sleep", "30"])
+	try:
+		entries = [
+			{"name": "running", "pid": child.pid, "start_time": start_time(child.pid)},
+			{"name": "reused", "pid": child.pid, "start_time": start_time(child.pid) - 1},
+			{"name": "gone", "pid": 2 ** 22 + 1, "start_time": 1},
+		]
+		with open(state_file.path, "w") as f:
+			json.dump({"manager": 1, "processes": entries}, f)
+		assert list(state_file.load()) == ["running"]
+	finally:
+		child.kill()
+		child.wait()
+
+def test_a_missing_or_unreadable_state_file_adopts_nothing(state_file):
+	assert state_file.load() == {}
+	with open(state_file.path, "w") as f:
+		f.write("{")
+	assert state_file.load() == {}
@@ -0,0 +1,30 @@
+import os
+import sys
+import pytest
+from pymutils.zygote import zygote_argv
+
+@pytest.fixture
+def interpreters(tmp_path, monkeypatch):
+	"""A PATH holding python, a link to the running interpreter, and python2, another program."""
+	os.symlink(os.path.realpath(sys.executable), str(tmp_path / "python"))
+	other = tmp_path / "python2"
+	other.write_text("#!/bin/sh\n")
+	other.chmod(0o755)
+	monkeypatch.setenv("PATH", str(tmp_path))
+	return tmp_path
+
+def test_the_running_interpreter_is_forked(interpreters):
+	assert zygote_argv(["python", "-m", "http.server"]) == ["-m", "http.server"]
+	assert zygote_argv([str(interpreters / "python"), "app.py", "-v"]) == ["app.py", "-v"]
+
+def test_another_interpreter_is_not_forked(interpreters):
+	assert zygote_argv(["python2", "app.py"]) is None
+	assert zygote_argv(["python", "app.py"], python=str(interpreters / "python2")) is None
+
+def test_a_missing_interpreter_is_not_forked(interpreters):
+	assert zygote_argv(["python3.0", "app.py"]) is None
+
+def test_interpreter_options_and_other_programs_are_not_forked(interpreters):
+	assert zygote_argv(["python", "-u", "app.py"]) is None
+	assert zygote_argv(["python", "-m"]) is None
+	assert zygote_argv(["node", "app.js"]) is None